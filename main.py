@@ -1,6 +1,22 @@
 from src.settings import OUTLOOK_EMAIL, OUTLOOK_PASSWORD, REDIS_HOST, TELEGRAM_TOKEN
-from src import AlertManager, AlertMonitor, RedisCache, EmailHandler
+from src.settings import INBOX_MODE, INBOX_POLL_MIN_INTERVAL, INBOX_POLL_MAX_INTERVAL, INBOX_STREAMING_TIMEOUT, INBOX_SAFETY_INTERVAL
+from src.settings import INBOX_PAGE_SIZE, INBOX_BATCH_SIZE, INBOX_QUEUE_SIZE, EWS_BATCH_WINDOW
+from src.settings import INBOX_CONCURRENCY, INBOX_WORKER_QUEUE_SIZE
+from src.settings import MESSAGE_CACHE_SIZE, MESSAGE_CACHE_TTL, FOLDER_REFRESH_INTERVAL
+from src.settings import REDIS_KEY_PREFIX, REDIS_FRESH_START, SCHEDULER_POLL_INTERVAL, SCHEDULER_MAX_RUNNING
+from src.settings import REDIS_COALESCE_WINDOW
+from src.settings import FLAP_WINDOW, FLAP_THRESHOLD
+from src.settings import MASS_WINDOW, MASS_THRESHOLD, MASS_DETAIL_MAX, MASS_SITE_MIN_GROUPS
+from src.settings import DEDUP_TTL, DEDUP_MAX_SIZE, DEDUP_DELETE_WINDOW
+from src.settings import PARTITIONS, WORKER_ID, PARTITION_LEASE_TTL, PARTITION_HEARTBEAT_INTERVAL, MESSAGE_CLAIM_TTL
+from src.settings import EVENT_BUS, EVENT_STREAM_MAXLEN, EVENT_BLOCK, EVENT_MIN_IDLE, EVENT_MAX_DELIVERIES
+from src.settings import TELEGRAM_CHAT_ID, TELEGRAM_QUEUE_SIZE, TELEGRAM_DIGEST_THRESHOLD, TELEGRAM_DIGEST_MAX
+from src.settings import USERS_DB_PATH
+from src.settings import METRICS_HOST, METRICS_PORT
+from src import AlertManager, AlertMonitor, AlertScheduler, RedisCache, EmailHandler, MessageCache, create_inbox_source
+from src import AlertCoalescer, EventBus, NotificationSpool, PartitionLeases, TelegramDispatcher, UserStore
 from src.telegram_bot import router
+from src.metrics import MetricsServer, QUEUE_DEPTH, PENDING_TIMERS, PARTITIONS_OWNED, TELEGRAM_MESSAGES
 from aiogram import Bot, Dispatcher
 from aiogram.types import BotCommand
 import asyncio
@@ -19,18 +35,133 @@ async def set_bot_commands(bot: Bot):
 
 async def start_services():
     bot = Bot(token=TELEGRAM_TOKEN)
-    dp = Dispatcher()
+    user_store = await UserStore.create(USERS_DB_PATH)
+    dp = Dispatcher(user_store=user_store)
     dp.include_router(router)
 
     await set_bot_commands(bot)
 
-    email_handler = await EmailHandler.create(bot, OUTLOOK_EMAIL, OUTLOOK_PASSWORD)
-    redis_cache = await RedisCache.create(REDIS_HOST)
-    alert_manager = AlertManager(email_handler, redis_cache)
-    alert_monitor = AlertMonitor(alert_manager, email_handler)
+    telegram_dispatcher = TelegramDispatcher(
+        bot,
+        TELEGRAM_CHAT_ID,
+        recipients=user_store.users,
+        queue_size=TELEGRAM_QUEUE_SIZE,
+        digest_threshold=TELEGRAM_DIGEST_THRESHOLD,
+        digest_max=TELEGRAM_DIGEST_MAX
+    )
+    message_cache = MessageCache(max_size=MESSAGE_CACHE_SIZE, ttl=MESSAGE_CACHE_TTL)
+    email_handler = await EmailHandler.create(telegram_dispatcher, OUTLOOK_EMAIL, OUTLOOK_PASSWORD, EWS_BATCH_WINDOW, message_cache)
+    redis_cache = await RedisCache.create(
+        REDIS_HOST,
+        fresh_start=REDIS_FRESH_START,
+        coalesce_window=REDIS_COALESCE_WINDOW,
+        prefix=REDIS_KEY_PREFIX,
+        flap_window=FLAP_WINDOW,
+        mass_window=MASS_WINDOW,
+        mass_detail_max=MASS_DETAIL_MAX
+    )
+    scheduler = AlertScheduler(
+        redis_cache.redis,
+        key=redis_cache.key('timers'),
+        poll_interval=SCHEDULER_POLL_INTERVAL,
+        max_running=SCHEDULER_MAX_RUNNING
+    )
+    alert_manager = AlertManager(
+        email_handler,
+        redis_cache,
+        scheduler,
+        flap_threshold=FLAP_THRESHOLD,
+        mass_threshold=MASS_THRESHOLD,
+        mass_site_min_groups=MASS_SITE_MIN_GROUPS
+    )
+    email_handler.spool = NotificationSpool(redis_cache.redis, redis_cache.key('spool'))
+    await alert_manager.restore()
+    await alert_manager.schedule_spool_flush()
+    alert_coalescer = AlertCoalescer(
+        alert_manager,
+        email_handler,
+        ttl=DEDUP_TTL,
+        max_size=DEDUP_MAX_SIZE,
+        delete_window=DEDUP_DELETE_WINDOW
+    )
+    leases = None
+    if PARTITIONS > 0:
+        leases = PartitionLeases(
+            redis_cache.redis,
+            key=redis_cache.key('leases'),
+            partitions=PARTITIONS,
+            worker_id=WORKER_ID,
+            lease_ttl=PARTITION_LEASE_TTL,
+            heartbeat_interval=PARTITION_HEARTBEAT_INTERVAL,
+            claim_ttl=MESSAGE_CLAIM_TTL,
+            on_lost=alert_coalescer.clear
+        )
+        await leases.heartbeat()
+    bus = None
+    if EVENT_BUS:
+        bus = EventBus(
+            redis_cache.redis,
+            key=redis_cache.key('events'),
+            consumer=WORKER_ID,
+            maxlen=EVENT_STREAM_MAXLEN,
+            block=EVENT_BLOCK,
+            min_idle=EVENT_MIN_IDLE,
+            max_deliveries=EVENT_MAX_DELIVERIES
+        )
+        alert_manager.bus = bus
+    inbox_source = create_inbox_source(
+        email_handler.account.inbox,
+        mode=INBOX_MODE,
+        min_interval=INBOX_POLL_MIN_INTERVAL,
+        max_interval=INBOX_POLL_MAX_INTERVAL,
+        connection_timeout=INBOX_STREAMING_TIMEOUT,
+        safety_interval=INBOX_SAFETY_INTERVAL
+    )
+    alert_monitor = AlertMonitor(
+        alert_coalescer,
+        email_handler,
+        inbox_source,
+        page_size=INBOX_PAGE_SIZE,
+        batch_size=INBOX_BATCH_SIZE,
+        queue_size=INBOX_QUEUE_SIZE,
+        concurrency=INBOX_CONCURRENCY,
+        worker_queue_size=INBOX_WORKER_QUEUE_SIZE,
+        leases=leases,
+        bus=bus
+    )
 
+    QUEUE_DEPTH.set_function(alert_monitor.queue_depth, queue='inbox')
+    QUEUE_DEPTH.set_function(telegram_dispatcher.queue.qsize, queue='telegram')
+    QUEUE_DEPTH.set_function(email_handler.spool.size, queue='spool')
+    if bus is not None:
+        QUEUE_DEPTH.set_function(lambda: bus.pending(bus.stream('notifications')), queue='notifications')
+    PENDING_TIMERS.set_function(scheduler.pending)
+    if leases is not None:
+        PARTITIONS_OWNED.set_function(lambda: len(leases.owned))
+    for result in telegram_dispatcher.stats:
+        TELEGRAM_MESSAGES.set_function(lambda result=result: telegram_dispatcher.stats[result], result=result)
+    metrics_server = MetricsServer(METRICS_HOST, METRICS_PORT)
+    metrics_server.add_health_check('redis', redis_cache.redis.ping)
+    await metrics_server.start()
+
+    asyncio.create_task(telegram_dispatcher.run())
+    asyncio.create_task(scheduler.run())
+    if leases is not None:
+        asyncio.create_task(leases.run())
+    asyncio.create_task(email_handler.folders.run(FOLDER_REFRESH_INTERVAL))
     asyncio.create_task(alert_monitor.start())
-    await dp.start_polling(bot, skip_updates=True)
+    if bus is not None:
+        asyncio.create_task(alert_monitor.consume())
+        asyncio.create_task(alert_manager.run_notifications())
+    try:
+        await dp.start_polling(bot, skip_updates=True)
+    finally:
+        # Накопленные в окнах удаления писем, регистрации алертов и действия с письмами выполняются до выхода.
+        await alert_coalescer.close()
+        await redis_cache.close()
+        await email_handler.batcher.close()
+        await metrics_server.stop()
+        await user_store.close()
 
 
 async def main():
@@ -1,12 +1,38 @@
+from .alert_coalescer import AlertCoalescer
 from .alert_manager import AlertManager
 from .alert_monitor import AlertMonitor
+from .alert_parser import ParsedAlert, parse_alert
+from .alert_scheduler import AlertScheduler
 from .email_handler import EmailHandler
+from .event_bus import EventBus
+from .folder_registry import FolderRegistry
+from .message_cache import MessageCache
+from .notification_spool import NotificationSpool
+from .partition_leases import PartitionLeases
+from .inbox_source import InboxSource, PollingInboxSource, StreamingInboxSource, create_inbox_source
 from .redis_cache import RedisCache
+from .telegram_dispatcher import TelegramDispatcher
+from .user_store import UserStore
 
 
 __all__ = [
+    'AlertCoalescer',
     'AlertManager',
     'AlertMonitor',
+    'AlertScheduler',
     'EmailHandler',
-    'RedisCache'
+    'EventBus',
+    'FolderRegistry',
+    'InboxSource',
+    'MessageCache',
+    'NotificationSpool',
+    'ParsedAlert',
+    'PartitionLeases',
+    'parse_alert',
+    'PollingInboxSource',
+    'StreamingInboxSource',
+    'create_inbox_source',
+    'RedisCache',
+    'TelegramDispatcher',
+    'UserStore'
 ]
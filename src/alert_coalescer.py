@@ -0,0 +1,143 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import List, Optional, Set, Tuple
+from .alert_entity import AlertProblem, AlertResolved
+from .alert_manager import AlertManager
+from .alert_parser import ParsedAlert
+from .email_handler import EmailHandler
+from .metrics import ALERTS, DEDUP_LOOKUPS
+from .settings import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class AlertCoalescer:
+    """
+    Отсекает повторные problem-алерты до AlertManager.
+    Помнит ключи host:subject, которые уже записаны в Redis, поэтому повтор не обращается ни к Redis, ни к EWS:
+    его письмо откладывается и удаляется вместе с остальными повторами одним запросом.
+    Resolved по ключу убирает его из памяти, и следующий problem снова проходит в AlertManager.
+    """
+
+    def __init__(self, alert_manager: AlertManager, email_handler: EmailHandler,
+                 ttl: float = 600, max_size: int = 10000, delete_window: float = 1.0):
+        """
+        :param ttl: Сколько секунд ключ считается активным без обращения к Redis.
+        :param max_size: Максимальное количество ключей; самые давно использованные вытесняются.
+        :param delete_window: Сколько секунд копить письма повторов перед удалением.
+        """
+        self.alert_manager = alert_manager
+        self.email_handler = email_handler
+        self.ttl = ttl
+        self.max_size = max_size
+        self.delete_window = delete_window
+        # Ключ -> (срок, id письма, которым алерт записан в Redis).
+        self._active: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._pending_deletes: List[str] = []
+        # Письма, которые ждут удаления или удаляются сейчас.
+        self._deleting: Set[str] = set()
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        return len(self._active)
+
+    def clear(self, *_) -> None:
+        """
+        Забывает все ключи. Вызывается, когда экземпляр теряет партиции хостов:
+        resolved по ним теперь получает другой экземпляр, и помнить их активными больше нельзя.
+        """
+        self._active.clear()
+
+    @property
+    def hit_rate(self) -> float:
+        """Доля problem-алертов, отсеянных как повторы."""
+        hits, misses = DEDUP_LOOKUPS.value(result='hit'), DEDUP_LOOKUPS.value(result='miss')
+        return hits / (hits + misses) if hits + misses else 0.0
+
+    @staticmethod
+    def _problem_key(alert: ParsedAlert) -> str:
+        return AlertProblem(None, alert.host, alert.alert_type, alert.subject)._cache_key
+
+    @staticmethod
+    def _resolved_key(alert: ParsedAlert) -> str:
+        return AlertResolved(None, alert.host, alert.alert_type, alert.subject)._cache_key
+
+    def _is_active(self, key: str) -> bool:
+        entry = self._active.get(key)
+        if entry is None:
+            return False
+        if entry[0] < time.monotonic():
+            del self._active[key]
+            return False
+        self._active.move_to_end(key)
+        return True
+
+    def _remember(self, key: str, message_id: str) -> None:
+        self._active[key] = (time.monotonic() + self.ttl, message_id)
+        self._active.move_to_end(key)
+        while len(self._active) > self.max_size:
+            self._active.popitem(last=False)
+
+    async def problem_handler(self, message_id, alert: ParsedAlert):
+        """Отсекает повтор активного алерта, остальные передает в AlertManager."""
+        try:
+            key = self._problem_key(alert)
+            if self._is_active(key):
+                if self._active[key][1] == message_id:
+                    # То же письмо, которое не удалось пометить прочитанным, пришло снова: это не повтор.
+                    logger.info(f"Письмо {message_id} уже обработано.")
+                    return
+                DEDUP_LOOKUPS.inc(result='hit')
+                ALERTS.inc(type='duplicate')
+                logger.info(f"Алерт {message_id} повторяет активный {key}, письмо будет удалено.")
+                self._schedule_delete(message_id)
+                return
+            DEDUP_LOOKUPS.inc(result='miss')
+            if await self.alert_manager.problem_handler(message_id, alert) is not None:
+                self._remember(key, message_id)
+        except Exception as e:
+            logger.error(f"Ошибка в AlertCoalescer.problem_handler: {e}", exc_info=True)
+
+    async def resolved_handler(self, message_id, alert: ParsedAlert):
+        """Забывает ключ и передает resolved в AlertManager."""
+        try:
+            self._active.pop(self._resolved_key(alert), None)
+        except Exception as e:
+            logger.error(f"Ошибка в AlertCoalescer.resolved_handler: {e}", exc_info=True)
+        await self.alert_manager.resolved_handler(message_id, alert)
+
+    async def is_registered(self, message_id, alert: ParsedAlert) -> bool:
+        """См. AlertManager.is_registered."""
+        return await self.alert_manager.is_registered(message_id, alert)
+
+    def _schedule_delete(self, message_id) -> None:
+        # Письмо удаляется по id; из кэша оно убирается сразу, чтобы его не пометили прочитанным до удаления.
+        self.email_handler.message_cache.invalidate(message_id)
+        # До удаления письмо остается непрочитанным, и следующая проверка входящих может прочитать его снова.
+        if message_id in self._deleting:
+            return
+        self._deleting.add(message_id)
+        self._pending_deletes.append(message_id)
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.delete_window, self._flush_deletes)
+
+    def _flush_deletes(self) -> None:
+        """Удаляет накопленные за окно письма повторов одним запросом к EWS."""
+        self._flush_handle = None
+        pending, self._pending_deletes = self._pending_deletes, []
+        if pending:
+            logger.info(f"Удаляю {len(pending)} писем повторов, доля повторов {self.hit_rate:.0%}.")
+            task = asyncio.ensure_future(self.email_handler.delete_messages(pending))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            task.add_done_callback(lambda _: self._deleting.difference_update(pending))
+
+    async def close(self) -> None:
+        """Удаляет накопленные письма повторов, не дожидаясь окна, и ждет завершения удаления."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_deletes()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
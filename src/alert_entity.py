@@ -1,33 +1,70 @@
-import json
-from .settings.config import CRITICAL_HOSTS, EXCLUDE_GROUPS
+import orjson
+from typing import Any, Dict, Optional
+from .settings.config import CRITICAL_HOSTS, EXCLUDE_GROUPS, MASS_SITES
 import os
 from .settings import setup_logger
+from .host_matcher import RuleMatcher
 
 logger = setup_logger(__name__)
 
+# Схема записи алерта в Redis. Запись хранится как orjson-массив [версия, значения полей по порядку],
+# производные поля (папка, темы, таймер) не хранятся и вычисляются заново.
+# Новые поля только дописываются в конец; в записях прежних версий их значения None.
+# Версия 2: changekey письма problem. Больше не записывается: после пересылки и копирования он устаревает,
+# и письмо перемещается по одному id; поле оставлено, чтобы не сдвигать последующие.
+RECORD_VERSION = 2
+RECORD_FIELDS = (
+    'message_id', 'host', 'alert_type', 'subject', 'severity', 'group', 'group_label',
+    'time', 'received_at', 'created_at', 'create_case', 'changekey',
+)
+
+
+def encode_record(record: Dict[str, Any]) -> bytes:
+    """Кодирует запись алерта для Redis."""
+    return orjson.dumps([RECORD_VERSION] + [record.get(field) for field in RECORD_FIELDS])
+
+
+def decode_record(raw: bytes) -> Optional[Dict[str, Any]]:
+    """Декодирует запись алерта из Redis."""
+    data = orjson.loads(raw)
+    version, values = data[0], data[1:]
+    if version > RECORD_VERSION:
+        logger.error(f"Неизвестная версия записи алерта: {version}")
+        return None
+    return {field: values[index] if index < len(values) else None for index, field in enumerate(RECORD_FIELDS)}
+
 
 class Alert:
     """Общий класс для алертов."""
 
-    def __init__(self, message_id: int, host: str, alert_type: str, subject: str,):
+    __slots__ = ('message_id', 'host', 'alert_type', '_subject', 'time', 'received_at')
+
+    def __init__(self, message_id: int, host: str, alert_type: str, subject: str, time: str = None,
+                 received_at: float = None):
         try:
             self.message_id = message_id
             self.host = host
             self.alert_type = alert_type
             self.subject = subject
+            self.time = time or ''
+            self.received_at = received_at
         except Exception as e:
             logger.error(f"Ошибка при инициализации Alert: {e}", exc_info=True)
 
+    @property
+    def subject(self,):
+        """Возвращает тему сообщения."""
+        return self._subject
+
+    @subject.setter
+    def subject(self, value: str):
+        self._subject = value
+
     @property
     def _cache_key(self) -> str:
         """Создает ключ для кэша."""
         return f'{self.host}:{self.subject}'
 
-    @property
-    def _json_alert(self):
-        """Преобразует alert в json."""
-        return json.dumps(self.__dict__)
-
     def _defines_a_folder(self,):
         """Определяет папку."""
         try:
@@ -130,6 +167,7 @@ class AlertProblem(Alert):
         ]
     }
     _exclude_groups = EXCLUDE_GROUPS
+    _sites = MASS_SITES
 
     _EMERGENCY_ALERTS = {
         "Unavailable by ICMP ping": ["GSC01", "GSC02", "RHS01", "RHS02", "POS02", "POS19", "POS06", "POS07", "POS21", "POS09", "POS18", "POS22", "KVS01", "KVS07", "KVS09", "BOS01"],
@@ -140,30 +178,37 @@ class AlertProblem(Alert):
         "Disk space is low (free < 10% for 30m)": ["GSC01", "GSC02", "RHS01", "RHS02", "POS02", "POS19", "POS06", "POS07", "POS21", "POS09", "POS18", "POS22", "KVS01", "KVS07", "KVS09", "BOS01"]
     }
 
-    def __init__(self, message_id, host, alert_type, subject, severity: str = None, group: str = None):
+    __slots__ = (
+        'severity', 'group', 'group_label', 'create_case', 'is_flapping', 'is_massgroup_problem', 'is_regular',
+        'mass_site', '_is_critical', '_is_emergency',
+    )
+
+    def __init__(self, message_id, host, alert_type, subject, severity: str = None, group: str = None,
+                 time: str = None, group_label: str = None, received_at: float = None):
         try:
-            super().__init__(message_id, host, alert_type, subject,)
+            super().__init__(message_id, host, alert_type, subject, time, received_at)
             self.severity = severity
             self.group = group
-            self.is_critical = self._is_critical_host(subject, host)
-            self.is_emergency = self._check_emergency(subject, host) if not self.is_critical else False
-            self.is_exclude_group = True if self._exclude_groups in group else False
+            self.group_label = group_label or group or ''
             self.create_case = False
             self.is_flapping = False
             self.is_massgroup_problem = False
             self.is_regular = False
-            self.resolved_subject = self.resolved_subject_msg()
-            self.folder_path = self._defines_a_folder()
-            self.delete_time = self._set_delete_timer()
+            # Площадка, если уведомление о массовой проблеме отправляется по площадке, а не по группе.
+            self.mass_site = None
+            # Классификация вычисляется при первом обращении.
+            self._is_critical = None
+            self._is_emergency = None
         except Exception as e:
             logger.error(f"Ошибка при инициализации AlertProblem: {e}", exc_info=True)
 
+    # Таблицы правил компилируются один раз при загрузке модуля.
+    _critical_matcher = RuleMatcher(_critical_hosts, empty_matches_any_host=True)
+    _emergency_matcher = RuleMatcher(_EMERGENCY_ALERTS)
+
     def _check_emergency(self, subject: str, host: str) -> bool:
-        for alert_subject, critical_hosts in self._EMERGENCY_ALERTS.items():
-            if alert_subject in subject:
-                if any(critical_host in host for critical_host in critical_hosts):
-                    return True
-        return False
+        """Проверяет, относится ли алерт к аварийным по таблице _EMERGENCY_ALERTS."""
+        return self._emergency_matcher.matches(subject, host)
 
     def _is_critical_host(self, subject: str, host: str) -> bool:
         """
@@ -171,19 +216,85 @@ class AlertProblem(Alert):
         Если тема входит в словарь и у нее есть значения, проверяет наличие хоста в этих значениях.
         Если тема входит в словарь, но значений нет, считает хост критичным без проверки.
         """
-        for alert_subject, critical_hosts in self._critical_hosts.items():
-            if alert_subject in subject:
-                if critical_hosts:
-                    if any(critical_host in host for critical_host in critical_hosts):
-                        return True
-                else:
-                    return True
-        return False
+        return self._critical_matcher.matches(subject, host)
+
+    @property
+    def is_critical(self) -> bool:
+        """Критичный ли хост; вычисляется один раз."""
+        if self._is_critical is None:
+            self._is_critical = self._is_critical_host(self.subject, self.host)
+        return self._is_critical
+
+    @property
+    def is_emergency(self) -> bool:
+        """Аварийный ли алерт; вычисляется один раз."""
+        if self._is_emergency is None:
+            self._is_emergency = not self.is_critical and self._check_emergency(self.subject, self.host)
+        return self._is_emergency
+
+    @property
+    def is_exclude_group(self) -> bool:
+        """Относится ли алерт к исключенной группе (ПБО)."""
+        return bool(self.group) and self._exclude_groups in self.group
+
+    @property
+    def site(self) -> Optional[str]:
+        """Площадка, в которую входит группа алерта (MASS_SITES), или None."""
+        return self._sites.get(self.group) if self.group else None
+
+    @property
+    def folder_path(self):
+        """Папка для problem письма."""
+        return self._defines_a_folder()
+
+    @property
+    def delete_time(self):
+        """Через сколько секунд без resolved отправлять уведомление."""
+        return self._set_delete_timer()
+
+    @property
+    def resolved_subject(self) -> str:
+        """Тема для resolved письма."""
+        return self.resolved_subject_msg()
+
+    def to_payload(self) -> dict:
+        """Возвращает аргументы, по которым алерт можно восстановить, например в обработчике таймера."""
+        return {
+            'message_id': self.message_id,
+            'host': self.host,
+            'alert_type': self.alert_type,
+            'subject': self.subject,
+            'severity': self.severity,
+            'group': self.group,
+            'time': self.time,
+            'group_label': self.group_label,
+            'received_at': self.received_at,
+        }
+
+    @classmethod
+    def from_payload(cls, payload: dict) -> "AlertProblem":
+        """Восстанавливает алерт из to_payload()."""
+        return cls(**payload)
+
+    def to_record(self, created_at: Optional[float] = None) -> Dict[str, Any]:
+        """Возвращает запись алерта для Redis по схеме RECORD_FIELDS."""
+        return dict(self.to_payload(), created_at=created_at, create_case=self.create_case)
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> "AlertProblem":
+        """Восстанавливает алерт из записи в Redis."""
+        alert = cls(
+            record['message_id'], record['host'], record['alert_type'], record['subject'],
+            record.get('severity'), record.get('group'), record.get('time'),
+            record.get('group_label'), record.get('received_at')
+        )
+        alert.create_case = bool(record.get('create_case'))
+        return alert
 
     @property
     def _flap_key(self) -> str:
-        """Создает ключ для флапа."""
-        return f'flap:{self.host}'
+        """Создает ключ для флапа: sorted set событий хоста по времени."""
+        return f'flaps:{self.host}'
 
     @property
     def _group_mass_key(self) -> str:
@@ -227,6 +338,8 @@ class AlertProblem(Alert):
     def mass_subject_msg(self):
         """Создает тему для массовых проблем."""
         if self.is_massgroup_problem:
+            if self.mass_site:
+                return f"❌ MASS_SITE_PROBLEM!!! {self.mass_site}"
             return f"❌ MASS_GROUP_PROBLEM!!! {self.subject}"
 
     def _set_delete_timer(self,):
@@ -247,9 +360,11 @@ class AlertProblem(Alert):
 class AlertResolved(Alert):
     """Класс для resolved алертов."""
 
-    def __init__(self, message_id, host, alert_type, subject,):
+    __slots__ = ('resolved_subject_msg',)
+
+    def __init__(self, message_id, host, alert_type, subject, time: str = None, received_at: float = None):
         try:
-            super().__init__(message_id, host, alert_type, subject,)
+            super().__init__(message_id, host, alert_type, subject, time, received_at)
             self.resolved_subject_msg = ""
         except Exception as e:
             logger.error(f"Ошибка при инициализации AlertResolved: {e}", exc_info=True)
@@ -266,4 +381,25 @@ class AlertResolved(Alert):
             self.resolved_subject_msg = value
             self._subject = value.replace(' Resolved', '').replace('✅', '')
         except Exception as e:
-            logger.error(f"Ошибка при установке subject: {e}", exc_info=True)\
+            logger.error(f"Ошибка при установке subject: {e}", exc_info=True)
+
+    def to_payload(self) -> dict:
+        """Возвращает данные, по которым алерт можно восстановить, например в обработчике уведомлений."""
+        return {
+            'message_id': self.message_id,
+            'host': self.host,
+            'alert_type': self.alert_type,
+            'subject': self.subject,
+            'time': self.time,
+            'received_at': self.received_at,
+            'resolved_subject_msg': self.resolved_subject_msg,
+        }
+
+    @classmethod
+    def from_payload(cls, payload: dict) -> "AlertResolved":
+        """Восстанавливает алерт из to_payload()."""
+        payload = dict(payload)
+        resolved_subject_msg = payload.pop('resolved_subject_msg', '')
+        alert = cls(**payload)
+        alert.resolved_subject_msg = resolved_subject_msg
+        return alert
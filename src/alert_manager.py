@@ -1,9 +1,14 @@
 from .alert_entity import AlertProblem, AlertResolved, Alert
-import asyncio
-from .redis_cache import RedisCache
+from .alert_parser import ParsedAlert
+from .alert_scheduler import AlertScheduler
+from .metrics import ALERTS, FLAPS, MASS_EVENTS
+from .redis_cache import ProblemState, RedisCache
 from .email_handler import EmailHandler
+from .event_bus import EventBus
 from .settings import setup_logger
-import copy
+import asyncio
+import time
+from typing import Any, Dict, Optional
 
 logger = setup_logger(__name__)
 
@@ -11,116 +16,254 @@ logger = setup_logger(__name__)
 class AlertManager:
     """Класс для управления алертами."""
 
-    _flap_timer = 5 * 60
-    _mass_timer = 5 * 60
-
-    def __init__(self, email_handler: EmailHandler, redis_cache: RedisCache):
+    def __init__(self, email_handler: EmailHandler, redis_cache: RedisCache, scheduler: AlertScheduler,
+                 flap_threshold: int = 5, mass_threshold: int = 5, mass_site_min_groups: int = 2):
+        """
+        :param flap_threshold: Сколько problem по хосту за окно флапов (RedisCache.flap_window) считается флапом.
+        :param mass_threshold: Сколько алертов в группе или на площадке считается массовой проблемой.
+        :param mass_site_min_groups: Сколько групп площадки должно быть затронуто, чтобы уведомлять по площадке.
+        """
         self.email_handler = email_handler
         self.redis_cache = redis_cache
-        self.active_flap_tasks = set()
-        self.active_mass_tasks = set()
-        self.active_timer_delete_tasks = set()
+        self.scheduler = scheduler
+        self.flap_threshold = flap_threshold
+        self.mass_threshold = mass_threshold
+        self.mass_site_min_groups = mass_site_min_groups
+        # Если задан, уведомления отправляются через поток Redis отдельным этапом (run_notifications).
+        self.bus: Optional[EventBus] = None
+        scheduler.register('delete', self._on_timer(self._check_after_timer_delete))
+        scheduler.register('spool', self._flush_spool)
 
-    async def problem_handler(self, message_id, host, severity, alert_type, subject: str, group,):
-        """Добавляет алерт в кэш."""
+    @staticmethod
+    def _on_timer(check):
+        """Оборачивает проверку так, чтобы она восстанавливала алерт из данных таймера."""
+        async def handler(payload: dict):
+            await check(AlertProblem.from_payload(payload))
+        return handler
+
+    async def restore(self) -> None:
+        """
+        Восстанавливает таймеры эскалации для алертов, которые были активны до перезапуска.
+        Уже поставленные таймеры не меняются, недостающие ставятся на оставшееся время.
+        """
+        restored = 0
+        now = time.time()
+        for record in await self.redis_cache.reconcile():
+            try:
+                problem_alert = AlertProblem.from_record(record)
+                if problem_alert.create_case or problem_alert.delete_time is None:
+                    continue
+                delay = max(0, (record.get('created_at') or now) + problem_alert.delete_time - now)
+                if await self.scheduler.schedule('delete', problem_alert._cache_key, problem_alert.to_payload(), delay):
+                    restored += 1
+            except Exception as e:
+                logger.error(f"Ошибка при восстановлении алерта {record.get('message_id')}: {e}", exc_info=True)
+        logger.info(f"Восстановлено {restored} таймеров эскалации.")
+
+    async def problem_handler(self, message_id, alert: ParsedAlert) -> Optional[bool]:
+        """
+        Добавляет алерт в кэш. Все обновления состояния в Redis выполняются одним pipeline.
+        Возвращает True для нового алерта, False для повтора и None при ошибке.
+        """
         try:
-            problem_alert = AlertProblem(message_id, host, alert_type, subject, severity, group)
+            problem_alert = AlertProblem(
+                message_id, alert.host, alert.alert_type, alert.subject, alert.severity, alert.group,
+                alert.time, alert.group_label, alert.received_at
+            )
 
-            if not await self.redis_cache.get(problem_alert):
-                await self.redis_cache.save(problem_alert)
-            else:
+            state = await self.redis_cache.register_problem(problem_alert, self._schedule_timers)
+            self.scheduler.wakeup()
+            ALERTS.inc(type='problem' if state.is_new else 'duplicate')
+            if state.flap_count >= self.flap_threshold:
+                await self._notify_flap(problem_alert, state.flap_count)
+            if state.mass_issues >= self.mass_threshold or state.site_issues >= self.mass_threshold:
+                await self._check_mass_issue(problem_alert, state)
+            if not state.is_new:
+                # Письмо помечается прочитанным после обработки, поэтому после падения оно может прийти снова;
+                # тогда в кэше записано это же письмо, и удалять его как повтор нельзя.
+                cached = await self.redis_cache.get(problem_alert)
+                if cached and cached.get('message_id') == problem_alert.message_id:
+                    logger.info(f"Письмо {problem_alert.message_id} уже обработано.")
+                    return False
                 logger.info(f"Алерт {problem_alert.message_id} уже существует в кэше!")
                 await self.email_handler.delete_message(problem_alert.message_id)
-            await self.redis_cache.add_to_mass_group(problem_alert)
-            await self.redis_cache.increase_flap_count(problem_alert)
-
-            if problem_alert._flap_key not in self.active_flap_tasks:
-                self.active_flap_tasks.add(problem_alert._flap_key)
-                asyncio.create_task(self._check_flap_after_timeout(problem_alert))
-
-            if not problem_alert.is_exclude_group and problem_alert._group_mass_key not in self.active_mass_tasks:
-                self.active_mass_tasks.add(problem_alert._group_mass_key)
-                asyncio.create_task(self._check_mass_issue_after_timeout(problem_alert))
-
-            if problem_alert._cache_key not in self.active_timer_delete_tasks:
-                self.active_timer_delete_tasks.add(problem_alert._cache_key)
-                asyncio.create_task(self._check_after_timer_delete(problem_alert))
+            return state.is_new
         except Exception as e:
             logger.error(f"Ошибка в problem_handler: {e}", exc_info=True)
+            return None
+
+    async def _schedule_timers(self, pipe, problem_alert: AlertProblem):
+        """
+        Добавляет в pipeline таймер эскалации.
+        Таймер с тем же ключом не ставится повторно, поэтому отдельные списки активных задач не нужны.
+        """
+        if problem_alert.delete_time is not None:
+            await self.scheduler.schedule('delete', problem_alert._cache_key, problem_alert.to_payload(),
+                                          problem_alert.delete_time, pipe)
 
     async def _check_after_timer_delete(self, problem_alert: AlertProblem):
         """Проверка после таймаута."""
         try:
-            copy_problem_alert = copy.copy(problem_alert)
-            await asyncio.sleep(copy_problem_alert.delete_time)
-
-            if await self.redis_cache.get(copy_problem_alert):
-                logger.info(f'Прошло {copy_problem_alert.delete_time} сек, отправляю нотификацию!')
-                copy_problem_alert.is_regular = True
-                await self.redis_cache.save(copy_problem_alert, {
-                    "create_case": True,
-                    "resolved_subject": copy_problem_alert.resolved_subject_msg()
-                })
-                await self.email_handler.send_alert_notification(copy_problem_alert)
-
-            self.active_timer_delete_tasks.discard(problem_alert._cache_key)
+            # Отметка ставится, только если алерт еще не закрыт: resolved мог забрать запись в любой момент.
+            if await self.redis_cache.update(problem_alert, {"create_case": True}):
+                logger.info(f'Прошло {problem_alert.delete_time} сек, отправляю нотификацию!')
+                problem_alert.is_regular = True
+                await self.notify(problem_alert)
         except Exception as e:
             logger.error(f"Ошибка в _check_after_timer_delete: {e}", exc_info=True)
 
-    async def _check_flap_after_timeout(self, problem_alert: AlertProblem):
-        """Ждет 5 минут и проверяет флапы."""
+    async def schedule_spool_flush(self) -> None:
+        """Ставит таймер отправки отложенных уведомлений на ближайшие 10:00 по Москве, если его еще нет."""
+        if self.email_handler.spool is not None:
+            await self.scheduler.schedule('spool', 'flush', {}, self.email_handler.seconds_until_sending_hours())
+
+    async def _flush_spool(self, payload: dict):
+        """
+        В начале часов рассылки отправляет уведомления, отложенные за ночь.
+        Алерты, которые уже закрылись, отбрасываются, остальные уходят сводками по группам.
+        """
         try:
-            copy_problem_alert = copy.copy(problem_alert)
-            await asyncio.sleep(self._flap_timer)
-
-            data = await self.redis_cache.get_flap_count(copy_problem_alert)
-            logger.info(f"Данные флапа: {data}")
-            if data and data["count"] >= 5:
-                logger.warning(f"⚠️ Хост {copy_problem_alert.host} флапается! ({data['count']} за 5 минут)")
-                copy_problem_alert.is_flapping = True
-                await self.email_handler.send_alert_notification(copy_problem_alert, extra_data=data)
-
-            self.active_flap_tasks.discard(copy_problem_alert._flap_key)
-            await self.redis_cache.delete_flap(copy_problem_alert)
+            spooled = await self.email_handler.spool.drain()
+            active = await self.redis_cache.active([alert for _, alert in spooled])
+            alerts = []
+            for (kind, alert), is_active in zip(spooled, active):
+                if not is_active:
+                    continue
+                alert.is_regular = kind == 'regular'
+                alert.is_flapping = kind == 'flap'
+                alert.is_massgroup_problem = kind == 'mass'
+                alerts.append(alert)
+            logger.info(f"Отложенных уведомлений: {len(spooled)}, уже закрыто: {len(spooled) - len(alerts)}.")
+            if alerts:
+                await self.email_handler.send_digests(alerts)
         except Exception as e:
-            logger.error(f"Ошибка в _check_flap_after_timeout: {e}", exc_info=True)
+            logger.error(f"Ошибка при отправке отложенных уведомлений: {e}", exc_info=True)
+        finally:
+            await self.schedule_spool_flush()
 
-    async def _check_mass_issue_after_timeout(self, problem_alert: AlertProblem):
-        """Ждет 5 минут и проверяет массовость инцидента."""
+    async def _notify_flap(self, problem_alert: AlertProblem, flap_count: int):
+        """
+        Отправляет уведомление о флапе, как только по хосту набралось flap_threshold событий за скользящее окно.
+        Повторно по тому же хосту уведомление отправляется не раньше, чем через окно.
+        """
         try:
-            copy_problem_alert = copy.copy(problem_alert)
-            await asyncio.sleep(self._mass_timer)
-
-            data = await self.redis_cache.get_mass_group(copy_problem_alert)
-            if data:
-                total_issues = sum(len(issues) for issues in data.values())
-                if total_issues >= 5:
-                    logger.warning(f"🚨 Массовая проблема в группе {copy_problem_alert.group}! ({len(data['hosts'])} хостов)")
-                    copy_problem_alert.is_massgroup_problem = True
-                    await self.email_handler.send_alert_notification(copy_problem_alert, extra_data=data)
-
-            self.active_mass_tasks.discard(copy_problem_alert._group_mass_key)
-            await self.redis_cache.delete_mass_group(copy_problem_alert)
+            if not await self.redis_cache.claim_flap(problem_alert, int(self.redis_cache.flap_window)):
+                return
+            data = await self.redis_cache.get_flap_count(problem_alert)
+            if not data:
+                data = {'count': flap_count, 'mass': [], 'window': self.redis_cache.flap_window}
+            logger.warning(f"⚠️ Хост {problem_alert.host} флапается! "
+                           f"({data['count']} за {self.redis_cache.flap_window:g} сек)")
+            problem_alert.is_flapping = True
+            FLAPS.inc()
+            await self.notify(problem_alert, extra_data=data)
         except Exception as e:
-            logger.error(f"Ошибка в _check_mass_issue_after_timeout: {e}", exc_info=True)
+            logger.error(f"Ошибка в _notify_flap: {e}", exc_info=True)
 
-    async def resolved_handler(self, message_id, host, subject: str, alert_type):
-        """Обрабатывает resolved."""
+    async def _check_mass_issue(self, problem_alert: AlertProblem, state: ProblemState):
+        """
+        Отправляет уведомление о массовой проблеме, как только в группе набралось mass_threshold алертов.
+        Если затронуто несколько групп одной площадки, отправляется одно уведомление по площадке,
+        и уведомления по ее группам больше не отправляются. Повтор — не раньше, чем через окно массовости.
+        """
         try:
-            resolved_alert = AlertResolved(message_id, host, alert_type, subject)
-            cached_alert: dict = await self.redis_cache.get(resolved_alert)
-            if cached_alert:
-                problem_message_id = cached_alert.get('message_id')
-                problem_folder_path = cached_alert.get('folder_path', '')
-                resolved_folder_path = problem_folder_path.replace('problem', 'resolved')
-                resolved_alert.resolved_subject_msg = cached_alert.get('resolved_subject')
-                if cached_alert.get('create_case'):
-                    await self.email_handler.send_alert_notification(resolved_alert)
-
-                await self.email_handler.move_to_folder(problem_message_id, problem_folder_path)
-                await self.email_handler.move_to_folder(resolved_alert.message_id, resolved_folder_path)
-
-            await self.email_handler.delete_message(resolved_alert.message_id)
-            await self.redis_cache.delete(resolved_alert)
+            cooldown = int(self.redis_cache.mass_window)
+            site = problem_alert.site
+            if site and state.site_groups >= self.mass_site_min_groups and state.site_issues >= self.mass_threshold:
+                if await self.redis_cache.claim_mass('site', site, cooldown):
+                    logger.warning(f"🚨 Массовая проблема на площадке {site}! ({state.site_groups} групп)")
+                    problem_alert.mass_site = site
+                    await self._notify_mass(problem_alert, await self.redis_cache.get_mass_site(site))
+                return
+            if state.mass_issues < self.mass_threshold:
+                return
+            if site and await self.redis_cache.mass_fired('site', site):
+                return
+            if await self.redis_cache.claim_mass('group', problem_alert.group, cooldown):
+                logger.warning(f"🚨 Массовая проблема в группе {problem_alert.group}! ({state.mass_hosts} хостов)")
+                await self._notify_mass(problem_alert, await self.redis_cache.get_mass_group(problem_alert))
+        except Exception as e:
+            logger.error(f"Ошибка в _check_mass_issue: {e}", exc_info=True)
+
+    async def _notify_mass(self, problem_alert: AlertProblem, data):
+        """Отправляет уведомление о массовой проблеме с деталями data."""
+        problem_alert.is_massgroup_problem = True
+        MASS_EVENTS.inc()
+        await self.notify(problem_alert, extra_data=data)
+
+    async def resolved_handler(self, message_id, alert: ParsedAlert):
+        """
+        Обрабатывает resolved.
+        Запись problem забирается из Redis вместе с отменой таймера эскалации одним запросом,
+        письма перемещаются по сохраненным id без повторного чтения из EWS.
+        """
+        try:
+            resolved_alert = AlertResolved(
+                message_id, alert.host, alert.alert_type, alert.subject, alert.time, alert.received_at
+            )
+            cached_alert = await self.redis_cache.pop(resolved_alert, self._cancel_timers)
+            ALERTS.inc(type='resolved')
+            if not cached_alert:
+                await self.email_handler.delete_message(resolved_alert.message_id)
+                return
+
+            problem_alert = AlertProblem.from_record(cached_alert)
+            problem_folder_path = problem_alert.folder_path or ''
+            resolved_folder_path = problem_folder_path.replace('problem', 'resolved')
+            resolved_alert.resolved_subject_msg = problem_alert.resolved_subject
+            if problem_alert.create_case:
+                await self.notify(resolved_alert)
+
+            # Оба перемещения попадают в одно окно пакетной отправки.
+            await asyncio.gather(
+                self.email_handler.move_to_folder(problem_alert.message_id, problem_folder_path),
+                self.email_handler.move_to_folder(resolved_alert.message_id, resolved_folder_path)
+            )
         except Exception as e:
             logger.error(f"Ошибка в resolved_handler: {e}", exc_info=True)
+
+    async def is_registered(self, message_id, alert: ParsedAlert) -> bool:
+        """Записан ли в Redis problem именно из этого письма, например перед повторной обработкой события."""
+        if alert.alert_type != 'Problem':
+            return False
+        cached = await self.redis_cache.get(AlertProblem(None, alert.host, alert.alert_type, alert.subject))
+        return bool(cached) and cached.get('message_id') == message_id
+
+    async def notify(self, alert: Alert, extra_data=None) -> None:
+        """Отправляет уведомление сразу или, если задан bus, записывает его в поток уведомлений."""
+        if self.bus is None:
+            await self.email_handler.send_alert_notification(alert, extra_data=extra_data)
+            return
+        await self.bus.publish([(self.bus.stream('notifications'), self._notification_event(alert, extra_data))])
+
+    @staticmethod
+    def _notification_event(alert: Alert, extra_data) -> Dict[str, Any]:
+        """Событие уведомления: вид, данные алерта и детали флапа или массовой проблемы."""
+        event = {'kind': EmailHandler._notification_kind(alert), 'alert': alert.to_payload(), 'extra_data': extra_data}
+        if isinstance(alert, AlertProblem):
+            event['mass_site'] = alert.mass_site
+        return event
+
+    @staticmethod
+    def _alert_from_event(event: Dict[str, Any]) -> Alert:
+        """Восстанавливает алерт из события уведомления."""
+        kind = event['kind']
+        if kind == 'resolved':
+            return AlertResolved.from_payload(event['alert'])
+        alert = AlertProblem.from_payload(event['alert'])
+        alert.is_regular = kind == 'regular'
+        alert.is_flapping = kind == 'flap'
+        alert.is_massgroup_problem = kind == 'mass'
+        alert.mass_site = event.get('mass_site')
+        return alert
+
+    async def _on_notification(self, event: Dict[str, Any]) -> None:
+        await self.email_handler.send_alert_notification(self._alert_from_event(event), extra_data=event['extra_data'])
+
+    async def run_notifications(self) -> None:
+        """Этап уведомлений: отправляет уведомления из потока; медленная отправка не задерживает разбор писем."""
+        await self.bus.consume([self.bus.stream('notifications')], self._on_notification)
+
+    async def _cancel_timers(self, pipe, alert: Alert):
+        """Добавляет в pipeline отмену таймера эскалации: для закрытого алерта он не нужен."""
+        await self.scheduler.cancel('delete', alert._cache_key, pipe)
@@ -1,91 +1,286 @@
 import asyncio
+import concurrent.futures
+import threading
+import zlib
 from exchangelib import Message
-import re
+from typing import List, Optional, Tuple, Union
+from .alert_coalescer import AlertCoalescer
 from .alert_manager import AlertManager
+from .alert_parser import ParsedAlert, parse_alert
 from .email_handler import EmailHandler
+from .event_bus import EventBus
+from .inbox_source import InboxSource, PollingInboxSource
+from .partition_leases import PartitionLeases
 from .settings import setup_logger
 
 logger = setup_logger(__name__)
 
+# Письмо для обработчика: id, разобранный алерт, (поток, id события), если алерт пришел через EventBus,
+# и само письмо, если его нужно пометить прочитанным после обработки.
+WorkItem = Tuple[str, ParsedAlert, Optional[Tuple[str, str]], Optional[Message]]
+
 
 class AlertMonitor:
     """Класс для мониторинга почты и обработки алертов."""
 
-    def __init__(self, alert_manager: AlertManager, email_handler: EmailHandler):
+    def __init__(self, alert_manager: Union[AlertManager, AlertCoalescer], email_handler: EmailHandler,
+                 inbox_source: Optional[InboxSource] = None, page_size: int = 100,
+                 batch_size: int = 25, queue_size: int = 4, concurrency: int = 8, worker_queue_size: int = 25,
+                 leases: Optional[PartitionLeases] = None, bus: Optional[EventBus] = None):
+        """
+        :param alert_manager: AlertManager или стоящий перед ним AlertCoalescer.
+        :param page_size: Размер страницы при выборке писем из EWS.
+        :param batch_size: Сколько писем передается обработчику за раз.
+        :param queue_size: Сколько пачек может ждать обработки, прежде чем выборка приостановится.
+        :param concurrency: Сколько писем обрабатывается одновременно.
+        :param worker_queue_size: Сколько писем может ждать своего обработчика, прежде чем выборка приостановится.
+        :param leases: Если задан, обрабатываются только письма хостов своих партиций (несколько экземпляров на один ящик).
+        :param bus: Если задан, разобранные алерты записываются в потоки Redis, а обработчики читают их в consume();
+            письмо помечается прочитанным только после записи алерта в поток.
+        """
         self.alert_manager = alert_manager
         self.email_handler = email_handler
+        self.inbox_source = inbox_source or PollingInboxSource()
+        self.page_size = page_size
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.concurrency = max(1, concurrency)
+        self.worker_queue_size = worker_queue_size
+        self.leases = leases
+        self.bus = bus
+        self._worker_queues: List["asyncio.Queue[WorkItem]"] = []
+        # Обработанные письма и их id до обработки; помечаются прочитанными пачкой в _mark_handled.
+        self._handled: List[Tuple[Message, str]] = []
+        self._workers = []
 
     async def start(self,) -> None:
-        """Запускает процесс мониторинга почты."""
+        """Запускает процесс мониторинга почты: проверяет входящие и ждет следующего сигнала от источника."""
+        await self.inbox_source.start()
         while True:
+            processed = 0
             try:
-                await self.check_inbox()
+                processed = await self.check_inbox()
             except Exception as e:
                 logger.error(f'Ошибка в процессе мониторинга: {e}', exc_info=True)
+            await self.inbox_source.wait_for_mail(had_mail=processed > 0)
+
+    def _fetch_unread(self, loop: asyncio.AbstractEventLoop, queue: "asyncio.Queue[Optional[List[Message]]]",
+                      stop: threading.Event) -> None:
+        """
+        Выбирает непрочитанные письма в рабочем потоке и складывает их пачками в очередь.
+        Если очередь заполнена, выборка ждет, пока обработчик не освободит место.
+        В конце в очередь кладется None. Если обработка прервалась и выставлен stop, выборка бросает очередь
+        и завершается, не занимая поток пула вечным ожиданием места.
+        """
+        def put(item) -> bool:
+            future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+            while True:
+                try:
+                    future.result(timeout=0.5)
+                    return True
+                except concurrent.futures.TimeoutError:
+                    if stop.is_set():
+                        future.cancel()
+                        return False
+
+        batch = []
+        try:
+            for msg in self.email_handler.iter_unread(self.page_size):
+                if stop.is_set():
+                    break
+                batch.append(msg)
+                if len(batch) >= self.batch_size:
+                    if not put(batch):
+                        return
+                    batch = []
+            if batch and not stop.is_set():
+                put(batch)
+        finally:
+            if not stop.is_set():
+                put(None)
+
+    def _start_workers(self) -> None:
+        """Запускает обработчики писем, если они еще не запущены."""
+        if self._workers:
+            return
+        for _ in range(self.concurrency):
+            queue = asyncio.Queue(maxsize=self.worker_queue_size)
+            self._worker_queues.append(queue)
+            self._workers.append(asyncio.create_task(self._worker(queue)))
+
+    async def _worker(self, queue: "asyncio.Queue[WorkItem]") -> None:
+        """
+        Обрабатывает письма своей очереди строго по порядку.
+        Событие из потока подтверждается, а письмо отдается на пометку о прочтении только после обработки.
+        """
+        while True:
+            message_id, alert, event, message = await queue.get()
+            try:
+                await self._handle_alert(message_id, alert)
+                if event is not None:
+                    await self.bus.ack(event[0], [event[1]])
+                if message is not None:
+                    self._handled.append((message, message_id))
+            except Exception as e:
+                logger.error(f'Ошибка при обработке сообщения: {e}', exc_info=True)
+            finally:
+                queue.task_done()
+
+    def queue_depth(self) -> int:
+        """Сколько разобранных писем ждут своих обработчиков."""
+        return sum(queue.qsize() for queue in self._worker_queues)
+
+    def _worker_queue(self, alert: ParsedAlert) -> "asyncio.Queue[WorkItem]":
+        """
+        Выбирает очередь обработчика по хосту.
+        Problem и Resolved одного хоста попадают в одну очередь и обрабатываются в порядке получения.
+        """
+        return self._worker_queues[zlib.crc32(alert.host.encode()) % len(self._worker_queues)]
 
-    async def check_inbox(self) -> None:
-        """Проверяет входящие сообщения"""
+    async def check_inbox(self) -> int:
+        """
+        Проверяет входящие сообщения. Возвращает количество обработанных писем.
+        Письма разных хостов обрабатываются параллельно; пока очереди обработчиков заполнены, выборка ждет.
+        """
+        self._start_workers()
         loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        processed = 0
         try:
-            messages = await loop.run_in_executor(None, lambda: self.email_handler.account.inbox.filter(is_read=False))
-            for msg in messages:
-                msg.is_read = True
-                try:
-                    await self.proccess_email(msg)
-                    await loop.run_in_executor(None, msg.save)
-                except Exception as e:
-                    logger.error(f'Ошибка при обработке сообщения: {e}', exc_info=True)
+            fetcher = loop.run_in_executor(None, self._fetch_unread, loop, queue, stop)
+            try:
+                while True:
+                    batch = await queue.get()
+                    if batch is None:
+                        break
+                    processed += await self._process_batch(batch)
+                    await self._mark_handled()
+            except BaseException:
+                # Обработка прервалась: выборка останавливается, иначе ее поток навсегда повиснет на полной очереди.
+                stop.set()
+                await asyncio.gather(fetcher, return_exceptions=True)
+                raise
+            await fetcher
         except Exception as e:
             logger.error(f'Ошибка при проверке входящих сообщений: {e}', exc_info=True)
+        if self.bus is None:
+            # И после ошибки дожидаемся писем, уже отданных обработчикам, и помечаем их прочитанными:
+            # иначе следующая проверка снова поставила бы их в очереди, пока они еще ждут обработки.
+            try:
+                await asyncio.gather(*(worker_queue.join() for worker_queue in self._worker_queues))
+                await self._mark_handled()
+            except Exception as e:
+                logger.error(f'Ошибка при пометке обработанных писем: {e}', exc_info=True)
+        return processed
 
-    async def parse_to_dict(self, email_message: Message) -> dict:
-        """Парсим письмо и вытаскиваем нужную информацию в словарик."""
-        try:
-            body = email_message.text_body or ""
-            body_re = re.sub(r"\s+", "", body)
-            parsed_data = {
-                'subject': email_message.subject,
-                'sender': email_message.sender.email_address,
-                'alert_type': 'Resolved' if 'Resolved' in email_message.subject else 'Problem',
-                'host': await self._extract_value(body_re, r"Host:(.*?)(?:Groups|IP-adress|Severity|Time|$)"),
-                'severity': await self._extract_value(body_re, r"Severity:(.*?)(?:Time|$)"),
-                'groups': await self._extract_value(body_re, r"Groups:(.*?)(?:IP-adress|Severity|Time|$)")
-            }
-            logger.debug(f'Парсинг письма завершен: {parsed_data}')
-            return parsed_data
-        except Exception as e:
-            logger.error(f'Ошибка при парсинге письма: {e}', exc_info=True)
-            return {}
+    async def _process_batch(self, batch: List[Message]) -> int:
+        """
+        Разбирает пачку писем и передает алерты обработчикам или в потоки.
+        Письмо с алертом помечается прочитанным только после того, как алерт обработан или записан в поток:
+        письмо, которое ждет своей очереди во время падения или перезапуска, останется непрочитанным
+        и будет обработано снова.
+        """
+        parsed = []
+        for msg in batch:
+            try:
+                parsed.append((msg, self._parse(msg)))
+            except Exception as e:
+                logger.error(f'Ошибка при обработке сообщения: {e}', exc_info=True)
+                parsed.append((msg, None))
+        if self.leases is not None:
+            parsed = await self._claim(parsed)
+        if self.bus is not None:
+            await self._publish(parsed)
+        for msg, _ in parsed:
+            self.email_handler.remember_message(msg)
+        # Пометки о прочтении писем без алерта и уже записанных в поток уходят в EWS одним bulk_update.
+        await asyncio.gather(*(
+            self.email_handler.mark_as_read(msg) for msg, alert in parsed if alert is None or self.bus is not None
+        ))
+        if self.bus is None:
+            for msg, alert in parsed:
+                if alert is not None:
+                    await self._worker_queue(alert).put((msg.id, alert, None, msg))
+        return len(parsed)
+
+    async def _mark_handled(self) -> None:
+        """
+        Помечает прочитанными письма, которые обработчики уже обработали; пометки уходят одним bulk_update.
+        Перемещенное при обработке письмо помечается по новому id, удаленное — пропускается.
+        """
+        handled, self._handled = self._handled, []
+        messages = [
+            msg for msg, message_id in handled
+            if msg.id != message_id or self.email_handler.message_cache.get(message_id) is msg
+        ]
+        await asyncio.gather(*(self.email_handler.mark_as_read(msg) for msg in messages))
+
+    async def _claim(self, parsed: List[Tuple[Message, Optional[ParsedAlert]]]
+                     ) -> List[Tuple[Message, Optional[ParsedAlert]]]:
+        """
+        Оставляет письма хостов своих партиций, которые еще не взял другой экземпляр.
+        Письма чужих партиций не помечаются прочитанными и достаются владельцу партиции.
+        Письма без хоста может забрать любой экземпляр.
+        """
+        own = [(msg, alert) for msg, alert in parsed if alert is None or self.leases.owns(alert.host)]
+        claimed = await self.leases.claim_messages([msg.id for msg, _ in own])
+        return [item for item, is_claimed in zip(own, claimed) if is_claimed]
+
+    def _stream(self, host: str) -> str:
+        """Поток алертов партиции хоста: события одного хоста читает один потребитель, и их порядок сохраняется."""
+        return self.bus.stream('alerts', self.leases.partition(host) if self.leases is not None else 0)
+
+    def _streams(self) -> List[str]:
+        """Потоки, которые читает этот экземпляр."""
+        if self.leases is None:
+            return [self.bus.stream('alerts', 0)]
+        return [self.bus.stream('alerts', partition) for partition in sorted(self.leases.owned)]
+
+    async def _publish(self, parsed: List[Tuple[Message, Optional[ParsedAlert]]]) -> None:
+        """Записывает разобранные алерты пачки в потоки их партиций."""
+        await self.bus.publish([
+            (self._stream(alert.host), {'message_id': msg.id, 'alert': list(alert)})
+            for msg, alert in parsed if alert is not None
+        ])
+
+    async def consume(self) -> None:
+        """
+        Читает алерты из потоков своих партиций и раздает их обработчикам.
+        Повторно доставленное событие problem пропускается, если алерт с тем же письмом уже записан в Redis:
+        значит, прежний потребитель успел его обработать, но не подтвердить.
+        """
+        self._start_workers()
+        while True:
+            try:
+                for stream, entry_id, data, redelivered in await self.bus.read(self._streams(), exclusive=True):
+                    alert = ParsedAlert(*data['alert'])
+                    if redelivered and await self.alert_manager.is_registered(data['message_id'], alert):
+                        await self.bus.ack(stream, [entry_id])
+                        continue
+                    await self._worker_queue(alert).put((data['message_id'], alert, (stream, entry_id), None))
+            except Exception as e:
+                logger.error(f'Ошибка при чтении алертов из потока: {e}', exc_info=True)
+                await asyncio.sleep(1)
 
     @staticmethod
-    async def _extract_value(text: str, pattern: str):
-        """Извлекает значения по регулярному выражению."""
-        try:
-            match = re.search(pattern, text, re.DOTALL)
-            return match.group(1) if match else ''
-        except Exception as e:
-            logger.error(f'Ошибка при извлечении значения: {e}', exc_info=True)
-            return ''
+    def _parse(message: Message) -> Optional[ParsedAlert]:
+        """Разбирает письмо. Возвращает None, если в нем нет хоста."""
+        sender = message.sender.email_address if message.sender else ''
+        received = getattr(message, 'datetime_received', None)
+        alert = parse_alert(message.subject, sender, message.text_body, received.timestamp() if received else None)
 
-    async def proccess_email(self, message: Message):
-        """Проверяем почту."""
-        try:
-            parse_msg = await self.parse_to_dict(message)
-            host = parse_msg.get('host')
-            severity = parse_msg.get('severity')
-            alert_type = parse_msg.get('alert_type')
-            subject = parse_msg.get('subject')
-            group = parse_msg.get('groups')
-
-            logger.info(f'Обработка письма: host={host}, severity={severity}, alert_type={alert_type}, subject={subject}, group={group}')
-
-            if not host:
-                logger.warning('Не удалось извлечь хост из сообщения.')
-                return
-
-            if alert_type == 'Problem':
-                await self.alert_manager.problem_handler(message.id, host, severity, alert_type, subject, group)
-            elif alert_type == 'Resolved':
-                await self.alert_manager.resolved_handler(message.id, host, subject, alert_type)
-        except Exception as e:
-            logger.error(f'Ошибка при обработке письма: {e}', exc_info=True)
\ No newline at end of file
+        logger.info(f'Обработка письма: host={alert.host}, severity={alert.severity}, '
+                    f'alert_type={alert.alert_type}, subject={alert.subject}, group={alert.group}')
+
+        if not alert.host:
+            logger.warning('Не удалось извлечь хост из сообщения.')
+            return None
+        return alert
+
+    async def _handle_alert(self, message_id: str, alert: ParsedAlert) -> None:
+        """Передает разобранное письмо обработчику problem или resolved."""
+        if alert.alert_type == 'Problem':
+            await self.alert_manager.problem_handler(message_id, alert)
+        elif alert.alert_type == 'Resolved':
+            await self.alert_manager.resolved_handler(message_id, alert)
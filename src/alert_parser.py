@@ -0,0 +1,72 @@
+import re
+from typing import Dict, NamedTuple, Optional
+from .settings import setup_logger
+
+logger = setup_logger(__name__)
+
+# Поля тела письма Zabbix в том виде, в котором они встречаются в тексте.
+_LABELS = {
+    'Host': 'host',
+    'Groups': 'group',
+    'IP-adress': 'ip_address',
+    'Severity': 'severity',
+    'Time': 'time',
+    'Operational data': 'operational_data',
+}
+# Метки ищутся только в начале строки: так 'UpTime:' в Operational data не принимается за 'Time:'.
+_LABEL_RE = re.compile(r'^[ \t]*(' + '|'.join(map(re.escape, _LABELS)) + r')[ \t]*:', re.MULTILINE)
+
+
+class ParsedAlert(NamedTuple):
+    """Разобранное письмо Zabbix. Создается один раз на письмо и передается всем обработчикам."""
+
+    subject: str
+    sender: str
+    alert_type: str
+    # host, severity и group — без пробельных символов: из них строятся ключи кэша и групп.
+    host: str
+    severity: str
+    group: str
+    # Значения для отображения — как в письме.
+    group_label: str
+    time: str
+    ip_address: str
+    # Время получения письма сервером (unix time), если известно.
+    received_at: Optional[float] = None
+
+
+def parse_alert(subject: Optional[str], sender: Optional[str], body: Optional[str],
+                received_at: Optional[float] = None) -> ParsedAlert:
+    """
+    Разбирает письмо Zabbix за один проход по телу.
+    Значение поля — текст от его метки до следующей известной метки в начале строки;
+    повторные метки игнорируются.
+    """
+    subject = subject or ''
+    values: Dict[str, str] = {}
+    # split() по группе с меткой возвращает [текст до первой метки, метка, значение, метка, значение, ...].
+    parts = _LABEL_RE.split(body) if body else ()
+    for index in range(1, len(parts), 2):
+        field = _LABELS[parts[index]]
+        if field not in values:
+            values[field] = parts[index + 1].strip()
+
+    get = values.get
+    group_label = get('group', '')
+    return ParsedAlert(
+        subject,
+        sender or '',
+        'Resolved' if 'Resolved' in subject else 'Problem',
+        _compact(get('host', '')),
+        _compact(get('severity', '')),
+        _compact(group_label),
+        group_label,
+        get('time', ''),
+        _compact(get('ip_address', '')),
+        received_at,
+    )
+
+
+def _compact(value: str) -> str:
+    """Удаляет все пробельные символы."""
+    return ''.join(value.split())
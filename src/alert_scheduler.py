@@ -0,0 +1,178 @@
+import asyncio
+import json
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from redis.asyncio import Redis
+from redis.asyncio.client import Pipeline
+from .settings import setup_logger
+
+logger = setup_logger(__name__)
+
+TimerHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+class AlertScheduler:
+    """
+    Планировщик таймеров алертов, который переживает перезапуск сервиса.
+    Время срабатывания хранится в Redis ZSET, данные таймера — в хэше рядом.
+    Один диспетчер забирает наступившие таймеры и вызывает зарегистрированные обработчики;
+    одновременно выполняется не больше max_running обработчиков, остальные наступившие таймеры ждут в Redis.
+    """
+
+    # Добавляет таймер, только если такого еще нет.
+    _SCHEDULE_SCRIPT = """
+    if redis.call('ZADD', KEYS[1], 'NX', ARGV[1], ARGV[2]) == 1 then
+        redis.call('HSET', KEYS[2], ARGV[2], ARGV[3])
+        return 1
+    end
+    return 0
+    """
+
+    # Атомарно забирает наступившие таймеры вместе с их данными.
+    _POP_DUE_SCRIPT = """
+    local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+    local result = {}
+    for _, member in ipairs(due) do
+        redis.call('ZREM', KEYS[1], member)
+        table.insert(result, member)
+        table.insert(result, redis.call('HGET', KEYS[2], member) or '')
+        redis.call('HDEL', KEYS[2], member)
+    end
+    return result
+    """
+
+    def __init__(self, redis: Redis, key: str = 'timers', poll_interval: float = 1.0, batch_size: int = 100,
+                 max_running: int = 100):
+        """
+        :param redis: Клиент Redis.
+        :param key: Ключ ZSET с таймерами; данные хранятся в '{key}:payload'.
+        :param poll_interval: Максимальная пауза между проверками наступивших таймеров.
+        :param batch_size: Сколько таймеров забирается за одну проверку.
+        :param max_running: Сколько обработчиков таймеров может выполняться одновременно,
+            например когда после простоя или массовой проблемы наступают тысячи таймеров сразу.
+        """
+        self.redis = redis
+        self.key = key
+        self.payload_key = f'{key}:payload'
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.max_running = max(1, max_running)
+        self._handlers: Dict[str, TimerHandler] = {}
+        self._running_tasks = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._schedule = redis.register_script(self._SCHEDULE_SCRIPT)
+        self._pop_due = redis.register_script(self._POP_DUE_SCRIPT)
+
+    def register(self, kind: str, handler: TimerHandler) -> None:
+        """Регистрирует обработчик для таймеров вида kind."""
+        self._handlers[kind] = handler
+
+    @staticmethod
+    def _member(kind: str, key: str) -> str:
+        return f'{kind}:{key}'
+
+    def wakeup(self) -> None:
+        """Будит диспетчер, например после установки таймеров через pipeline."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def schedule(self, kind: str, key: str, payload: Dict[str, Any], delay: float,
+                       pipe: Optional[Pipeline] = None) -> bool:
+        """
+        Ставит таймер, если таймера с тем же kind и key еще нет.
+        Возвращает True, если таймер был поставлен.
+        Если передан pipe, команда только добавляется в него; после execute() нужно вызвать wakeup().
+        """
+        try:
+            due = time.time() + delay
+            added = await self._schedule(
+                keys=[self.key, self.payload_key],
+                args=[due, self._member(kind, key), json.dumps(payload)],
+                client=pipe
+            )
+            if pipe is not None:
+                return True
+            if added:
+                self.wakeup()
+            return bool(added)
+        except Exception as e:
+            logger.error(f"Ошибка при установке таймера {kind} для {key}: {e}", exc_info=True)
+            return False
+
+    async def cancel(self, kind: str, key: str, pipe: Optional[Pipeline] = None) -> bool:
+        """
+        Отменяет таймер. Возвращает True, если таймер был.
+        Если передан pipe, команды только добавляются в него.
+        """
+        member = self._member(kind, key)
+        if pipe is not None:
+            pipe.zrem(self.key, member)
+            pipe.hdel(self.payload_key, member)
+            return True
+        try:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.zrem(self.key, member)
+                pipe.hdel(self.payload_key, member)
+                removed, _ = await pipe.execute()
+            return bool(removed)
+        except Exception as e:
+            logger.error(f"Ошибка при отмене таймера {member}: {e}", exc_info=True)
+            return False
+
+    async def pending(self) -> int:
+        """Возвращает количество ожидающих таймеров."""
+        return await self.redis.zcard(self.key)
+
+    async def _pop(self, limit: int) -> List[Tuple[str, str, Dict[str, Any]]]:
+        """Забирает не больше limit наступивших таймеров: [(kind, key, payload), ...]."""
+        raw = await self._pop_due(keys=[self.key, self.payload_key], args=[time.time(), limit])
+        entries = []
+        for member, payload in zip(raw[::2], raw[1::2]):
+            member = member.decode() if isinstance(member, bytes) else member
+            kind, _, key = member.partition(':')
+            entries.append((kind, key, json.loads(payload) if payload else {}))
+        return entries
+
+    async def _next_delay(self) -> float:
+        """Возвращает паузу до ближайшего таймера, но не больше poll_interval."""
+        nearest = await self.redis.zrange(self.key, 0, 0, withscores=True)
+        if not nearest:
+            return self.poll_interval
+        return min(self.poll_interval, max(0.0, nearest[0][1] - time.time()))
+
+    async def _dispatch(self, kind: str, key: str, payload: Dict[str, Any]) -> None:
+        handler = self._handlers.get(kind)
+        if handler is None:
+            logger.warning(f"Нет обработчика для таймера {kind} ({key}).")
+            return
+        try:
+            await handler(payload)
+        except Exception as e:
+            logger.error(f"Ошибка в обработчике таймера {kind} для {key}: {e}", exc_info=True)
+
+    async def run(self) -> None:
+        """Диспетчер: забирает наступившие таймеры и запускает их обработчики."""
+        self._wakeup = asyncio.Event()
+        logger.info(f"Диспетчер таймеров запущен, ожидает {await self.pending()} таймеров.")
+        while True:
+            delay = self.poll_interval
+            try:
+                if len(self._running_tasks) >= self.max_running:
+                    # Наступившие таймеры остаются в Redis, пока не освободится место.
+                    await asyncio.wait(self._running_tasks, return_when=asyncio.FIRST_COMPLETED)
+                    continue
+                limit = min(self.batch_size, self.max_running - len(self._running_tasks))
+                entries = await self._pop(limit)
+                for kind, key, payload in entries:
+                    task = asyncio.create_task(self._dispatch(kind, key, payload))
+                    self._running_tasks.add(task)
+                    task.add_done_callback(self._running_tasks.discard)
+                delay = 0 if len(entries) >= limit else await self._next_delay()
+            except Exception as e:
+                logger.error(f"Ошибка в диспетчере таймеров: {e}", exc_info=True)
+            if delay:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+            self._wakeup.clear()
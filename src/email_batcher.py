@@ -0,0 +1,121 @@
+import asyncio
+from typing import Any, Dict, List, Optional, Set, Tuple
+from exchangelib import Account
+from .metrics import EWS_LATENCY
+from .settings import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class EmailBatcher:
+    """
+    Собирает изменения писем за короткое окно и отправляет их в EWS одним запросом:
+    bulk_update, bulk_move, bulk_copy или bulk_delete.
+    Каждый вызывающий получает результат по своему письму: значение из EWS или экземпляр исключения.
+    """
+
+    _UPDATE = 'update'
+    _MOVE = 'move'
+    _COPY = 'copy'
+    _DELETE = 'delete'
+    # Названия операций в метриках: обновление полей письма соответствует item.save().
+    _METRIC_NAMES = {_UPDATE: 'save', _MOVE: 'move', _COPY: 'copy', _DELETE: 'delete'}
+
+    def __init__(self, account: Account, window: float = 0.2, max_batch: int = 100):
+        """
+        :param account: Аккаунт exchangelib.
+        :param window: Сколько секунд копить изменения перед отправкой.
+        :param max_batch: Размер пачки, при котором она отправляется, не дожидаясь окна.
+        """
+        self.account = account
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: Dict[Tuple[str, Any], List[Tuple[Any, asyncio.Future]]] = {}
+        self._folders: Dict[Tuple[str, Any], Any] = {}
+        self._timers: Dict[Tuple[str, Any], asyncio.TimerHandle] = {}
+        # Отправляемые пачки: ссылки держатся здесь, иначе event loop может собрать задачу сборщиком мусора.
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def update(self, item, fields: List[str]):
+        """Сохраняет указанные поля письма. Возвращает (id, changekey) или исключение."""
+        return await self._submit(self._UPDATE, (item, fields))
+
+    async def move(self, item, folder):
+        """Перемещает письмо в папку. Возвращает (id, changekey) письма в новой папке или исключение."""
+        return await self._submit(self._MOVE, item, folder)
+
+    async def copy(self, item, folder):
+        """Копирует письмо в папку. Возвращает (id, changekey) копии или исключение."""
+        return await self._submit(self._COPY, item, folder)
+
+    async def delete(self, item):
+        """Удаляет письмо. Возвращает True или исключение."""
+        return await self._submit(self._DELETE, item)
+
+    async def _submit(self, op: str, payload, folder=None):
+        """Ставит изменение в пачку и ждет, пока пачка не будет отправлена."""
+        loop = asyncio.get_running_loop()
+        key = (op, folder.id if folder is not None else None)
+        future = loop.create_future()
+        batch = self._pending.setdefault(key, [])
+        batch.append((payload, future))
+        self._folders[key] = folder
+        if len(batch) >= self.max_batch:
+            self._start_flush(key)
+        elif key not in self._timers:
+            self._timers[key] = loop.call_later(self.window, self._start_flush, key)
+        return await future
+
+    def _start_flush(self, key: Tuple[str, Any]) -> None:
+        timer = self._timers.pop(key, None)
+        if timer:
+            timer.cancel()
+        batch = self._pending.pop(key, None)
+        folder = self._folders.pop(key, None)
+        if batch:
+            task = asyncio.ensure_future(self._flush(key[0], folder, batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def close(self) -> None:
+        """Отправляет накопленные изменения, не дожидаясь окна, и ждет завершения всех пачек."""
+        for key in list(self._pending):
+            self._start_flush(key)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _flush(self, op: str, folder, batch: List[Tuple[Any, asyncio.Future]]) -> None:
+        """Отправляет пачку в EWS и раздает результаты."""
+        payloads = [payload for payload, _ in batch]
+        try:
+            with EWS_LATENCY.time(operation=self._METRIC_NAMES[op]):
+                results = await asyncio.get_running_loop().run_in_executor(None, self._call, op, folder, payloads)
+            logger.info(f"Пакетная операция {op}: {len(payloads)} писем за один запрос.")
+        except Exception as e:
+            logger.error(f"Ошибка пакетной операции {op}: {e}", exc_info=True)
+            results = [e] * len(batch)
+
+        for index, (payload, future) in enumerate(batch):
+            result = results[index] if index < len(results) else None
+            if op in (self._UPDATE, self._MOVE):
+                self._apply_ids(payload[0] if op == self._UPDATE else payload, result)
+            if not future.done():
+                future.set_result(result)
+
+    def _call(self, op: str, folder, payloads: list) -> list:
+        """Вызывает bulk-метод аккаунта. Выполняется в рабочем потоке."""
+        if op == self._UPDATE:
+            return self.account.bulk_update(items=payloads)
+        if op == self._MOVE:
+            return self.account.bulk_move(ids=payloads, to_folder=folder)
+        if op == self._COPY:
+            return self.account.bulk_copy(ids=payloads, to_folder=folder)
+        if op == self._DELETE:
+            return self.account.bulk_delete(ids=payloads)
+        raise ValueError(f"Неизвестная пакетная операция {op}")
+
+    @staticmethod
+    def _apply_ids(item, result: Optional[Any]) -> None:
+        """Обновляет id и changekey письма после изменения, как это делают item.save() и item.move()."""
+        if isinstance(result, tuple) and hasattr(item, 'changekey'):
+            item.id, item.changekey = result
@@ -1,17 +1,28 @@
 from .settings import RECIPIENTS_EMAILS, EMAIL_TAC
 from exchangelib import Credentials, Account, Message, DELEGATE, ExtendedProperty
-from datetime import datetime, time
+from exchangelib.errors import ErrorFolderNotFound, ErrorToFolderNotFound
+from datetime import datetime, time, timedelta
 import pytz
 from .alert_entity import Alert, AlertProblem, AlertResolved
 import asyncio
-from typing import Optional
+from typing import Dict, Iterator, List, Optional
 from .settings import setup_logger
 from .telegram_bot import send_alert_to_telegram
-from aiogram import Bot
+from .email_batcher import EmailBatcher
+from .folder_registry import FolderRegistry
+from .message_cache import MessageCache
+from .notification_spool import NotificationSpool
+from .metrics import EWS_LATENCY, NOTIFICATION_LATENCY
+from .telegram_dispatcher import TelegramDispatcher
 
 
 logger = setup_logger(__name__)
 
+# Часы рассылки писем по Москве; вне их уведомления откладываются в NotificationSpool.
+_TZ_MOSCOW = pytz.timezone('Europe/Moscow')
+_SENDING_START = time(10, 0)
+_SENDING_END = time(20, 0)
+
 
 class FollowUpFlag(ExtendedProperty):
     property_tag = 0x1090
@@ -26,11 +37,19 @@ class EmailHandler:
 
     _recipients_emails = [RECIPIENTS_EMAILS]
     email_tac = EMAIL_TAC
+    # Поля, которые нужны для разбора алерта; id и changekey EWS возвращает всегда.
+    _fetch_fields = ('subject', 'sender', 'text_body', 'datetime_received')
 
-    def __init__(self, bot, username, password):
-        self.bot = bot
+    def __init__(self, telegram, username, password, batch_window: float = 0.2,
+                 message_cache: Optional[MessageCache] = None):
+        self.telegram = telegram
         self.username = username
         self.password = password
+        self.batch_window = batch_window
+        self.message_cache = message_cache or MessageCache()
+        self.folders: Optional[FolderRegistry] = None
+        # Если задан, уведомления вне часов рассылки откладываются, а не пропускаются.
+        self.spool: Optional[NotificationSpool] = None
 
     async def _connect(self,):
         """Подключение к почте."""
@@ -42,15 +61,20 @@ class EmailHandler:
                 autodiscover=True,
                 access_type=DELEGATE
             )
+            self.batcher = EmailBatcher(self.account, window=self.batch_window)
+            self.folders = FolderRegistry(self.account.inbox)
             logger.info('Успешное подключение к почте.')
         except Exception as e:
             logger.error(f'Подключиться к почте не удалось. {e}')
 
     @classmethod
-    async def create(cls, bot: Bot, username: str, password: str):
+    async def create(cls, telegram: TelegramDispatcher, username: str, password: str, batch_window: float = 0.2,
+                     message_cache: Optional[MessageCache] = None):
         """Фабричный метод для создания объекта с асинхронным подключением."""
-        self = cls(bot, username, password)
+        self = cls(telegram, username, password, batch_window, message_cache)
         await self._connect()
+        if self.folders:
+            await self.folders.resolve_all()
         return self
 
     def _get_recipients(self, alert: AlertProblem):
@@ -97,35 +121,114 @@ class EmailHandler:
             recipients = self._recipients_emails[:]
             subject, body = await self._get_subject_and_body_resolved(alert,)
 
-        message = await self.get_message(alert.message_id)
-        if message:
-            await send_alert_to_telegram(self.bot, message, subject, body, alert.alert_type)
+        kind, due_at = self._notification_kind(alert), self._notification_due(alert)
+        await send_alert_to_telegram(self.telegram, alert, subject, body, kind, due_at)
 
         if self._is_within_sending_hours():
-            await self.send_message(alert, recipients, subject, body)
+            message = await self.get_message(alert.message_id)
+            if message is None:
+                # Письмо могли уже переместить, например после resolved: уведомление ушло только в Telegram.
+                logger.error(f"Письмо {alert.message_id} не найдено, письмо-уведомление не отправлено.")
+                return
+            if await self.send_message(alert, recipients, subject, body, message) and due_at is not None:
+                latency = max(0.0, datetime.now().timestamp() - due_at)
+                NOTIFICATION_LATENCY.observe(latency, kind=kind, channel='email')
             if isinstance(alert, AlertProblem):
                 await self._mark_message(message)
                 await self.copy_and_mark_message(message)
                 logger.info(f"Письмо {message.subject} обработано и перемещено в 'create_case'.")
+        elif self.spool is not None:
+            if isinstance(alert, AlertProblem):
+                await self.spool.add(alert, kind)
+            else:
+                await self.spool.discard(alert)
+
+    @staticmethod
+    def _notification_kind(alert: Alert) -> str:
+        """Вид уведомления для метрик."""
+        if isinstance(alert, AlertResolved):
+            return 'resolved'
+        if alert.is_flapping:
+            return 'flap'
+        if alert.is_massgroup_problem:
+            return 'mass'
+        return 'regular'
+
+    @staticmethod
+    def _notification_due(alert: Alert) -> Optional[float]:
+        """
+        Время, к которому уведомление должно было уйти, для метрики задержки доставки.
+        Эскалация намеренно ждет delete_time после получения письма, эта пауза в задержку не входит.
+        """
+        if not alert.received_at:
+            return None
+        if isinstance(alert, AlertProblem) and alert.is_regular:
+            return alert.received_at + max(0, alert.delete_time or 0)
+        return alert.received_at
 
     def _is_within_sending_hours(self) -> bool:
         """Проверяет, находится ли текущее время в пределах 10:00–20:00 по Москве."""
-        tz_moscow = pytz.timezone('Europe/Moscow')
-        now = datetime.now(tz_moscow).time()
-        start = time(10, 0)
-        end = time(20, 0)
-        return start <= now <= end
+        now = datetime.now(_TZ_MOSCOW).time()
+        return _SENDING_START <= now <= _SENDING_END
+
+    def seconds_until_sending_hours(self) -> float:
+        """Сколько секунд осталось до ближайшего начала часов рассылки (10:00 по Москве)."""
+        now = datetime.now(_TZ_MOSCOW)
+        day = now.date() if now.time() < _SENDING_START else now.date() + timedelta(days=1)
+        start = _TZ_MOSCOW.localize(datetime.combine(day, _SENDING_START))
+        return (start - now).total_seconds()
+
+    async def send_digests(self, alerts: List[AlertProblem]) -> None:
+        """
+        Отправляет отложенные уведомления: по группе алерта одно пересланное письмо со списком всех ее алертов
+        вместо отдельной пересылки каждого. Все письма копируются в 'create_case', как и обычные уведомления.
+        """
+        groups: Dict[str, List[AlertProblem]] = {}
+        for alert in alerts:
+            groups.setdefault(alert.group_label or alert.group or '', []).append(alert)
+        await asyncio.gather(*(self._send_digest(group, group_alerts) for group, group_alerts in groups.items()))
+        logger.info(f"Отправлено {len(groups)} сводок по {len(alerts)} отложенным уведомлениям.")
+
+    async def _send_digest(self, group: str, alerts: List[AlertProblem]) -> None:
+        """Пересылает сводку по одной группе."""
+        try:
+            messages = [message for message in await self.get_messages([alert.message_id for alert in alerts])
+                        if message is not None]
+            if not messages:
+                logger.error(f"Письма для сводки по группе {group} не найдены.")
+                return
+            recipients = []
+            for alert in alerts:
+                recipients += [recipient for recipient in self._get_recipients(alert) if recipient not in recipients]
+            subject = f"❌ DIGEST!!! {group}: {len(alerts)} алертов вне рабочего времени"
+            body = "\n".join(f"{self._digest_subject(alert)} — Хост: {alert.host}, "
+                             f"Уровень: {alert.severity}, Время: {alert.time}" for alert in alerts)
+            await self.send_message(alerts[0], recipients, subject, body, messages[0])
+            for message in messages:
+                await self._mark_message(message)
+            await asyncio.gather(*(self.copy_and_mark_message(message) for message in messages))
+        except Exception as e:
+            logger.error(f"Ошибка при отправке сводки по группе {group}: {e}", exc_info=True)
+
+    @staticmethod
+    def _digest_subject(alert: AlertProblem) -> str:
+        if alert.is_flapping:
+            return alert.flap_subject_msg()
+        if alert.is_massgroup_problem:
+            return alert.mass_subject_msg()
+        return alert.regular_subject_msg()
 
     def _build_mass_body(self, alert: AlertProblem, mass_data: Optional[dict]) -> str:
         """Формирует тело письма для массовой проблемы."""
+        scope = f"на площадке {alert.mass_site}" if alert.mass_site else f"в группе {alert.group}"
         if not mass_data:
-            return f"Массовая проблема в группе {alert.group}, но дополнительных данных нет."
+            return f"Массовая проблема {scope}, но дополнительных данных нет."
 
         details = "\n".join(f"Хост: {host}, Тема: {subject}, Уровень: {severity}"
                             for host, alerts in mass_data.items()
                             for subject, severity in alerts)
 
-        return f"Массовая проблема в группе {alert.group}!\n\nДетали:\n{details}"
+        return f"Массовая проблема {scope}!\n\nДетали:\n{details}"
 
     def _build_flap_body(self, alert: AlertProblem, flap_data: Optional[dict]) -> str:
         """Формирует тело письма для флап-алерта."""
@@ -134,8 +237,13 @@ class EmailHandler:
 
         details = "\n".join(f"Тема: {subject}, Уровень: {severity}" for subject, severity in flap_data["mass"])
         count = flap_data.get("count", "N/A")
+        window = flap_data.get("window")
+        if window:
+            period = f" за {window / 60:g} мин" if window % 60 == 0 else f" за {window:g} сек"
+        else:
+            period = ""
 
-        return f"Хост {alert.host} флапается слишком часто ({count} раз за 5 минут)!\n\nСписок уведомлений:\n{details}"
+        return f"Хост {alert.host} флапается слишком часто ({count} раз{period})!\n\nСписок уведомлений:\n{details}"
 
     def _build_body_message(self, alert: AlertProblem,) -> str:
         """Формирует тело сообщения."""
@@ -146,83 +254,178 @@ class EmailHandler:
         minutes = alert.delete_time // 60
         return f'\nПрошло {minutes} минут без разрешения проблемы. Требуется внимание!'
 
+    def iter_unread(self, page_size: int = 100) -> Iterator[Message]:
+        """
+        Постранично выбирает непрочитанные письма, от старых к новым.
+        Страницы выбираются не по смещению, а от времени получения последнего письма предыдущей страницы:
+        пока письма обходятся, их помечают прочитанными этот и другие экземпляры, и смещение следующих страниц
+        сдвигалось бы, из-за чего письмо хоста могло пропустить свою очередь и обработаться после более позднего
+        письма того же хоста. Письма, полученные в ту же секунду, что и граница страницы, отсеиваются по id.
+        Итератор делает HTTP-запросы к EWS, поэтому его нужно обходить вне event loop.
+        """
+        seen = set()
+        since = None
+        size = page_size
+        while True:
+            filters = {'is_read': False} if since is None else {'is_read': False, 'datetime_received__gte': since}
+            messages = self.account.inbox.filter(**filters).only(*self._fetch_fields).order_by('datetime_received')
+            messages.page_size = size
+            messages.chunk_size = size
+            with EWS_LATENCY.time(operation='filter'):
+                page = list(messages[:size])
+            fresh = [message for message in page if message.id not in seen]
+            yield from fresh
+            if len(page) < size:
+                return
+            if fresh:
+                seen.update(message.id for message in fresh)
+                since = page[-1].datetime_received
+                size = page_size
+            else:
+                # Вся страница получена в одну секунду и уже выдана: граница не сдвигается, страница увеличивается.
+                size *= 2
+
+    def remember_message(self, message: Message) -> None:
+        """Кладет уже полученное письмо в кэш, чтобы не запрашивать его из EWS повторно."""
+        self.message_cache.put(message)
+
     async def get_message(self, message_id: str) -> Optional[Message]:
-        """Получаем письмо по id."""
+        """Получаем письмо по id: сначала из кэша, затем из EWS."""
+        message = self.message_cache.get(message_id)
+        if message:
+            return message
         try:
-            return await asyncio.get_running_loop().run_in_executor(
-                None, lambda: self.account.inbox.get(id=message_id)
-            )
+            with EWS_LATENCY.time(operation='get'):
+                message = await asyncio.get_running_loop().run_in_executor(
+                    None, lambda: self.account.inbox.get(id=message_id)
+                )
+            self.message_cache.put(message)
+            return message
         except Exception as e:
             logger.error(f"Ошибка при получении письма {message_id}: {e}")
             return None
 
-    async def _message_move(self, message: Message, folder_path: str):
-        loop = asyncio.get_event_loop()
+    async def get_messages(self, message_ids: List[str]) -> List[Optional[Message]]:
+        """Получает письма по id: сначала из кэша, остальные из EWS одним запросом."""
+        messages = {message_id: self.message_cache.get(message_id) for message_id in message_ids}
+        missing = [message_id for message_id, message in messages.items() if message is None]
+        if missing:
+            try:
+                with EWS_LATENCY.time(operation='get'):
+                    fetched = await asyncio.get_running_loop().run_in_executor(
+                        None, lambda: list(self.account.fetch(ids=[(message_id, None) for message_id in missing]))
+                    )
+                for message_id, message in zip(missing, fetched):
+                    if isinstance(message, Exception):
+                        logger.error(f"Ошибка при получении письма {message_id}: {message}")
+                        continue
+                    self.message_cache.put(message)
+                    messages[message_id] = message
+            except Exception as e:
+                logger.error(f"Ошибка при получении писем: {e}", exc_info=True)
+        return [messages[message_id] for message_id in message_ids]
+
+    async def _message_move(self, message, folder_path: str):
+        """Перемещает письмо: объект Message или кортеж (id, changekey)."""
+        name = message[0] if isinstance(message, tuple) else message.subject
         try:
-            folder_names = folder_path.split('\\')
-
-            folder = self.account.inbox
-            for name in folder_names:
-                folder = folder / name
-            await loop.run_in_executor(None, lambda: message.move(to_folder=folder))
-            logger.info(f"Письмо {message.subject} перемещено в {folder_path}.")
+            old_id = message[0] if isinstance(message, tuple) else message.id
+            folder = await self.folders.get(folder_path)
+            result = await self.batcher.move(message, folder)
+            if isinstance(result, (ErrorFolderNotFound, ErrorToFolderNotFound)):
+                # Папку пересоздали или переименовали: находим ее заново и повторяем один раз.
+                self.folders.invalidate(folder_path, folder)
+                result = await self.batcher.move(message, await self.folders.get(folder_path))
+            self.message_cache.invalidate(old_id)
+            if isinstance(result, Exception):
+                raise result
+            logger.info(f"Письмо {name} перемещено в {folder_path}.")
 
         except Exception as e:
-            logger.error(f"Ошибка при перемещении письма {message.subject} в {folder_path}: {e}")
+            logger.error(f"Ошибка при перемещении письма {name} в {folder_path}: {e}")
+
+    async def mark_as_read(self, message: Message) -> bool:
+        """Помечает письмо прочитанным. Пометки нескольких писем уходят в EWS одним запросом."""
+        message.is_read = True
+        result = await self.batcher.update(message, ['is_read'])
+        if isinstance(result, Exception):
+            logger.error(f"Не удалось пометить письмо {message.id} прочитанным: {result}")
+            return False
+        return True
 
     async def delete_message(self, message_id: str):
         """Удаляет письмо по message_id."""
         try:
-            message = await self.get_message(message_id)
-            if message:
-                await asyncio.get_running_loop().run_in_executor(None, message.delete)
-                logger.info(f"Письмо {message.subject} удалено.")
-            else:
-                logger.info(f"Письмо {message_id} не найдено.")
+            # Для удаления достаточно id, поэтому письмо, которого нет в кэше, из EWS не запрашиваем.
+            message = self.message_cache.get(message_id)
+            result = await self.batcher.delete(message or (message_id, None))
+            self.message_cache.invalidate(message_id)
+            if isinstance(result, Exception):
+                raise result
+            logger.info(f"Письмо {message.subject if message else message_id} удалено.")
         except Exception as e:
             logger.error(f"Ошибка при удалении письма {message_id}: {e}")
 
+    async def delete_messages(self, message_ids: List[str]) -> None:
+        """Удаляет несколько писем; все удаления уходят в EWS одним bulk_delete."""
+        try:
+            items = [self.message_cache.get(message_id) or (message_id, None) for message_id in message_ids]
+            results = await asyncio.gather(*(self.batcher.delete(item) for item in items))
+            for message_id in message_ids:
+                self.message_cache.invalidate(message_id)
+            failed = sum(isinstance(result, Exception) for result in results)
+            if failed:
+                logger.error(f"Не удалось удалить {failed} из {len(message_ids)} писем.")
+            logger.info(f"Удалено {len(message_ids) - failed} писем.")
+        except Exception as e:
+            logger.error(f"Ошибка при удалении писем: {e}", exc_info=True)
+
     async def forward_message(self, message: Message, recipients, subject, body):
         """Пересылает сообщение получателям."""
         loop = asyncio.get_running_loop()
-        await loop.run_in_executor(None, lambda: message.create_forward(
-            subject=subject,
-            body=body,
-            to_recipients=recipients
-        ).send())
+        with EWS_LATENCY.time(operation='send'):
+            await loop.run_in_executor(None, lambda: message.create_forward(
+                subject=subject,
+                body=body,
+                to_recipients=recipients
+            ).send())
         logger.info(f"Письмо {message.subject} успешно переслано.")
 
     async def copy_and_mark_message(self, message: Message):
         """Копирует письмо в 'create_case', помечает его как непрочитанное."""
-        loop = asyncio.get_running_loop()
-
-        copied_message_id, _ = await loop.run_in_executor(
-            None, lambda: message.copy(to_folder=self.account.inbox / 'create_case')
-        )
-
-        copied_message: Message = await self.get_message(copied_message_id)
-        if copied_message:
-            copied_message.is_read = False
-            await self._mark_message(copied_message)
-            await loop.run_in_executor(None, copied_message.save)
-            logger.info(f"Скопированное письмо {copied_message.subject} помечено как непрочитанное.")
+        copied = await self.batcher.copy(message, await self.folders.get('create_case'))
+        if not isinstance(copied, tuple):
+            logger.error(f"Ошибка: не удалось скопировать письмо {message.subject}: {copied}")
+            return
+
+        # Копию не перечитываем из EWS: для обновления достаточно ее id и changekey.
+        copied_id, copied_changekey = copied
+        copied_message = Message(account=self.account, id=copied_id, changekey=copied_changekey)
+        copied_message.is_read = False
+        await self._mark_message(copied_message)
+        result = await self.batcher.update(copied_message, ['is_read', 'importance'])
+        if isinstance(result, Exception):
+            logger.error(f"Ошибка: не удалось пометить копию письма {message.subject}: {result}")
         else:
-            logger.error(f"Ошибка: скопированное письмо {copied_message.subject} не найдено.")
+            logger.info(f"Скопированное письмо {message.subject} помечено как непрочитанное.")
 
-    async def send_message(self, alert_entity: Alert, recipients, subject: str = None, body: str = None):
-        """Отправляет сообщение и копирует его в 'create_case'."""
+    async def send_message(self, alert_entity: Alert, recipients, subject: str = None, body: str = None,
+                           message: Optional[Message] = None):
+        """Пересылает исходное письмо алерта получателям. Возвращает True, если письмо переслано."""
         try:
-            message: Message = await self.get_message(alert_entity.message_id)
+            message = message or await self.get_message(alert_entity.message_id)
             if not message:
                 logger.error(f"Ошибка: письмо {alert_entity.message_id} не найдено.")
-                return
+                return False
 
             await self.forward_message(message, recipients, subject, body)
-            await asyncio.get_running_loop().run_in_executor(None, message.refresh)
-
-            await asyncio.get_running_loop().run_in_executor(None, message.save)
+            # После пересылки у письма меняется changekey, обновляем закэшированный объект.
+            with EWS_LATENCY.time(operation='get'):
+                await asyncio.get_running_loop().run_in_executor(None, message.refresh)
+            return True
         except Exception as e:
             logger.error(f'Ошибка при обработке письма {alert_entity.message_id}: {e}', exc_info=True)
+            return False
 
     async def _mark_message(self, message: Message):
         """Отметить сообщение."""
@@ -231,25 +434,15 @@ class EmailHandler:
         except Exception as e:
             logger.error(f'Не удалось отметить/выделить сообщение: {e}', exc_info=True)
 
-    async def unmark_message(self, message: Message):
-        """Убирает все пометки с сообщения."""
-        try:
-            message.importance = 'Normal'
-            await asyncio.get_running_loop().run_in_executor(None, message.save)
-        except Exception as e:
-            logger.error(f'Не удалось убрать метки с сообщения: {e}', exc_info=True)
-
     async def move_to_folder(self, message_id: int, folder_path: str = None):
-        """Перемещает письмо в папку."""
+        """
+        Перемещает письмо в папку.
+        Письмо, которого нет в кэше, перемещается по одному id без changekey: сохраненный changekey устаревает
+        после пересылки, обновления и копирования письма, а EWS не требует его для перемещения.
+        """
         try:
-            message: Message = await self.get_message(message_id)
-            if not message:
-                logger.error(f"Ошибка: письмо {message_id} не найдено.")
-                return
-
-            await asyncio.get_running_loop().run_in_executor(None, message.save)
             await self._message_move(
-                message,
+                self.message_cache.get(message_id) or (message_id, None),
                 folder_path
             )
         except Exception as e:
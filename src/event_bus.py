@@ -0,0 +1,226 @@
+import asyncio
+import os
+import socket
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+import orjson
+from redis.asyncio import Redis
+from redis.exceptions import ResponseError
+from .settings import setup_logger
+
+logger = setup_logger(__name__)
+
+# Событие из потока: (поток, id записи, данные, доставлено повторно).
+StreamEvent = Tuple[str, str, Dict[str, Any], bool]
+
+
+def _decode(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class EventBus:
+    """
+    Очереди событий между этапами обработки на Redis Streams.
+    Каждый этап читает свои потоки в группе потребителей и подтверждает событие (XACK) только после обработки,
+    поэтому событие упавшего или зависшего экземпляра не теряется: через min_idle его забирает другой
+    потребитель группы. Событие, которое не удалось обработать max_deliveries раз, переносится в '{поток}:dead'.
+    """
+
+    def __init__(self, redis: Redis, key: str = 'vit:events', group: str = 'vit', consumer: Optional[str] = None,
+                 maxlen: int = 100000, count: int = 100, block: float = 1.0, min_idle: float = 60,
+                 max_deliveries: int = 5):
+        """
+        :param key: Префикс ключей потоков.
+        :param group: Группа потребителей; у каждого потока своя группа с этим именем.
+        :param consumer: Имя потребителя, по умолчанию имя хоста и pid.
+        :param maxlen: Примерная максимальная длина потока; старые подтвержденные события обрезаются.
+        :param count: Сколько событий читается за раз.
+        :param block: Сколько секунд ждать новых событий при чтении.
+        :param min_idle: Через сколько секунд без подтверждения событие забирается у другого потребителя.
+        :param max_deliveries: После скольких доставок событие считается необрабатываемым.
+        """
+        self.redis = redis
+        self.key = key
+        self.group = group
+        self.consumer = consumer or f'{socket.gethostname()}:{os.getpid()}'
+        self.maxlen = maxlen
+        self.count = count
+        self.block = block
+        self.min_idle = min_idle
+        self.max_deliveries = max_deliveries
+        self._groups: Set[str] = set()
+        self._next_reclaim: Dict[str, float] = {}
+        # Потоки, которые этот потребитель читает один (exclusive), и откуда продолжать забирать их старые события.
+        self._exclusive: Set[str] = set()
+        self._takeover: Dict[str, str] = {}
+
+    def stream(self, *parts) -> str:
+        """Ключ потока, например stream('alerts', 3) -> 'vit:events:alerts:3'."""
+        return ':'.join([self.key] + [str(part) for part in parts])
+
+    async def _ensure_groups(self, streams: Iterable[str]) -> None:
+        """Создает группы потребителей для потоков, которые читаются впервые."""
+        for stream in streams:
+            if stream in self._groups:
+                continue
+            try:
+                await self.redis.xgroup_create(stream, self.group, id='0', mkstream=True)
+            except ResponseError as e:
+                if 'BUSYGROUP' not in str(e):
+                    raise
+            self._groups.add(stream)
+
+    async def publish(self, events: Sequence[Tuple[str, Dict[str, Any]]]) -> None:
+        """Записывает события [(поток, данные), ...] одним pipeline."""
+        if not events:
+            return
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for stream, data in events:
+                pipe.xadd(stream, {'data': orjson.dumps(data)}, maxlen=self.maxlen, approximate=True)
+            await pipe.execute()
+
+    async def read(self, streams: Sequence[str], exclusive: bool = False) -> List[StreamEvent]:
+        """
+        Возвращает события для этого потребителя: сначала давно не подтвержденные события других потребителей,
+        затем новые (с ожиданием до block секунд).
+        :param exclusive: Потоки читает только этот потребитель, например потоки партиций, которыми он владеет.
+            Тогда у потока, который появился в списке впервые, сначала забираются все неподтвержденные события
+            прежнего потребителя, не дожидаясь min_idle, и только после них читаются новые: иначе новый владелец
+            обработал бы resolved раньше problem, который прежний владелец прочитал, но не успел обработать.
+        """
+        if exclusive:
+            self._start_takeover(streams)
+        if not streams:
+            await asyncio.sleep(self.block)
+            return []
+        try:
+            await self._ensure_groups(streams)
+            events = []
+            for stream in streams:
+                if stream in self._takeover:
+                    events += await self._take_over(stream)
+                elif time.monotonic() >= self._next_reclaim.get(stream, 0):
+                    self._next_reclaim[stream] = time.monotonic() + self.min_idle / 2
+                    events += await self._reclaim(stream, self.min_idle)
+            if events:
+                return events
+            fresh = [stream for stream in streams if stream not in self._takeover]
+            if not fresh:
+                return []
+            response = await self.redis.xreadgroup(
+                self.group, self.consumer, {stream: '>' for stream in fresh},
+                count=self.count, block=int(self.block * 1000)
+            )
+        except ResponseError as e:
+            if 'NOGROUP' in str(e):
+                # Поток удалили вместе с группой, например при очистке кэша; группа создастся заново.
+                self._groups.clear()
+                return []
+            raise
+        for stream, entries in response or []:
+            for entry_id, fields in entries:
+                events.append((_decode(stream), _decode(entry_id), orjson.loads(fields[b'data']), False))
+        return events
+
+    def _start_takeover(self, streams: Sequence[str]) -> None:
+        """Отмечает впервые появившиеся исключительные потоки: их старые события нужно забрать до новых."""
+        current = set(streams)
+        for stream in current - self._exclusive:
+            self._takeover[stream] = '-'
+        for stream in self._exclusive - current:
+            self._takeover.pop(stream, None)
+        self._exclusive = current
+
+    async def _take_over(self, stream: str) -> List[StreamEvent]:
+        """
+        Забирает очередную пачку неподтвержденных событий других потребителей потока независимо от их возраста,
+        по порядку id. Когда таких событий больше нет, поток начинает читаться обычным образом.
+        """
+        pending = await self.redis.xpending_range(stream, self.group, self._takeover[stream], '+', self.count)
+        if len(pending) < self.count:
+            del self._takeover[stream]
+        else:
+            ms, seq = _decode(pending[-1]['message_id']).split('-')
+            self._takeover[stream] = f'{ms}-{int(seq) + 1}'
+        return await self._claim(stream, [entry for entry in pending if _decode(entry['consumer']) != self.consumer], 0)
+
+    async def _reclaim(self, stream: str, min_idle: float) -> List[StreamEvent]:
+        """Забирает себе события, которые дольше min_idle секунд не подтверждены."""
+        min_idle_ms = int(min_idle * 1000)
+        pending = await self.redis.xpending_range(stream, self.group, '-', '+', self.count, idle=min_idle_ms)
+        return await self._claim(stream, pending, min_idle_ms)
+
+    async def _claim(self, stream: str, pending: List[Dict[str, Any]], min_idle_ms: int) -> List[StreamEvent]:
+        """Забирает себе события из ответа XPENDING, необрабатываемые переносит в '{поток}:dead'."""
+        if not pending:
+            return []
+        dead = [_decode(entry['message_id']) for entry in pending if entry['times_delivered'] >= self.max_deliveries]
+        retry = [_decode(entry['message_id']) for entry in pending if entry['times_delivered'] < self.max_deliveries]
+        if dead:
+            await self._dead_letter(stream, dead)
+        if not retry:
+            return []
+        claimed = await self.redis.xclaim(stream, self.group, self.consumer, min_idle_ms, retry)
+        events = []
+        for entry_id, fields in claimed:
+            if not fields:
+                # Событие уже обрезано из потока, обрабатывать нечего.
+                await self.ack(stream, [_decode(entry_id)])
+                continue
+            events.append((stream, _decode(entry_id), orjson.loads(fields[b'data']), True))
+        if events:
+            logger.warning(f"Повторно взято {len(events)} неподтвержденных событий из {stream}.")
+        return events
+
+    async def _dead_letter(self, stream: str, entry_ids: List[str]) -> None:
+        """Переносит необрабатываемые события в '{поток}:dead'."""
+        async with self.redis.pipeline(transaction=True) as pipe:
+            for entry_id in entry_ids:
+                pipe.xrange(stream, entry_id, entry_id)
+            entries = await pipe.execute()
+        async with self.redis.pipeline(transaction=True) as pipe:
+            for found in entries:
+                for _, fields in found:
+                    pipe.xadd(f'{stream}:dead', fields, maxlen=self.maxlen, approximate=True)
+            pipe.xack(stream, self.group, *entry_ids)
+            await pipe.execute()
+        logger.error(f"{len(entry_ids)} событий из {stream} не обработаны за {self.max_deliveries} попыток "
+                     f"и перенесены в {stream}:dead.")
+
+    async def ack(self, stream: str, entry_ids: List[str]) -> None:
+        """Подтверждает обработку событий."""
+        if entry_ids:
+            await self.redis.xack(stream, self.group, *entry_ids)
+
+    async def pending(self, *streams: str) -> int:
+        """Сколько событий выдано потребителям и еще не подтверждено."""
+        total = 0
+        for stream in streams:
+            try:
+                total += (await self.redis.xpending(stream, self.group))['pending']
+            except ResponseError:
+                pass
+        return total
+
+    async def consume(self, streams: Sequence[str], handler: Callable[[Dict[str, Any]], Awaitable[None]]) -> None:
+        """
+        Обрабатывает события потоков: события одного чтения обрабатываются параллельно,
+        успешно обработанные подтверждаются одним XACK на поток. Событие, обработчик которого упал,
+        остается неподтвержденным и будет доставлено повторно.
+        """
+        while True:
+            try:
+                events = await self.read(streams)
+                results = await asyncio.gather(*(handler(data) for _, _, data, _ in events), return_exceptions=True)
+                done: Dict[str, List[str]] = {}
+                for (stream, entry_id, _, _), result in zip(events, results):
+                    if isinstance(result, Exception):
+                        logger.error(f"Ошибка при обработке события {entry_id} из {stream}: {result}",
+                                     exc_info=result)
+                        continue
+                    done.setdefault(stream, []).append(entry_id)
+                for stream, entry_ids in done.items():
+                    await self.ack(stream, entry_ids)
+            except Exception as e:
+                logger.error(f"Ошибка при чтении событий: {e}", exc_info=True)
+                await asyncio.sleep(self.block)
@@ -0,0 +1,112 @@
+import asyncio
+from typing import Dict, Iterable, Optional
+from exchangelib.folders import Folder
+from .metrics import EWS_LATENCY
+from .settings import setup_logger
+
+logger = setup_logger(__name__)
+
+# Папки во входящих, с которыми работает сервис.
+SERVICE_FOLDERS = (
+    'critical_host/problem', 'critical_host/resolved',
+    'high/problem', 'high/resolved',
+    'disaster/problem', 'disaster/resolved',
+    'pbo/problem', 'pbo/resolved',
+    'create_case',
+)
+
+
+def normalize_path(path: str) -> str:
+    """Приводит путь папки к виду 'high/problem': разделители '/' и '\\', без учета регистра."""
+    return '/'.join(name for name in path.replace('\\', '/').lower().split('/') if name)
+
+
+class FolderRegistry:
+    """
+    Кэш папок EWS по пути относительно входящих.
+    Каждое обращение folder / name — отдельный запрос к EWS, поэтому папки находятся один раз
+    (при старте — все папки сервиса) и дальше перемещения и копирования используют готовые объекты с FolderId.
+    Устаревшая папка (например, пересозданная) сбрасывается через invalidate и находится заново.
+    """
+
+    def __init__(self, root: Folder, paths: Iterable[str] = SERVICE_FOLDERS):
+        """
+        :param root: Папка, от которой считаются пути, обычно account.inbox.
+        :param paths: Пути, которые находятся заранее в resolve_all().
+        """
+        self.root = root
+        self.paths = tuple(normalize_path(path) for path in paths)
+        self._folders: Dict[str, Folder] = {}
+        self._lock = asyncio.Lock()
+
+    def __contains__(self, path: str) -> bool:
+        return normalize_path(path) in self._folders
+
+    def _lookup(self, path: str) -> Folder:
+        """Находит папку в EWS, начиная с ближайшей уже найденной родительской. Выполняется в рабочем потоке."""
+        names = path.split('/')
+        folder, start = self.root, 0
+        for index in range(len(names) - 1, 0, -1):
+            cached = self._folders.get('/'.join(names[:index]))
+            if cached is not None:
+                folder, start = cached, index
+                break
+        for index in range(start, len(names)):
+            with EWS_LATENCY.time(operation='folder'):
+                folder = folder / names[index]
+            self._folders['/'.join(names[:index + 1])] = folder
+        return folder
+
+    async def get(self, path: str) -> Folder:
+        """Возвращает папку по пути; если ее нет в кэше, находит в EWS. Бросает исключение, если папки нет."""
+        path = normalize_path(path)
+        folder = self._folders.get(path)
+        if folder is not None:
+            return folder
+        async with self._lock:
+            folder = self._folders.get(path)
+            if folder is None:
+                folder = await asyncio.get_running_loop().run_in_executor(None, self._lookup, path)
+                logger.info(f"Папка {path} найдена.")
+            return folder
+
+    async def resolve_all(self) -> int:
+        """Находит все папки сервиса. Возвращает количество найденных; отсутствующие папки логируются."""
+        resolved = 0
+        for path in self.paths:
+            try:
+                await self.get(path)
+                resolved += 1
+            except Exception as e:
+                logger.error(f"Папка {path} не найдена: {e}")
+        logger.info(f"Найдено {resolved} из {len(self.paths)} папок сервиса.")
+        return resolved
+
+    def invalidate(self, path: Optional[str] = None, folder: Optional[Folder] = None) -> None:
+        """
+        Сбрасывает папку и ее вложенные папки из кэша; без пути — весь кэш.
+        Если передан folder, папка сбрасывается, только если в кэше все еще именно он:
+        так несколько запросов, получивших ошибку по одной папке, не сбрасывают уже найденную заново.
+        """
+        if path is None:
+            self._folders.clear()
+            return
+        path = normalize_path(path)
+        if folder is not None and self._folders.get(path) is not folder:
+            return
+        for cached in [cached for cached in self._folders if cached == path or cached.startswith(path + '/')]:
+            del self._folders[cached]
+
+    async def refresh(self) -> int:
+        """Сбрасывает кэш и находит папки сервиса заново, например если папки переименовали или пересоздали."""
+        self.invalidate()
+        return await self.resolve_all()
+
+    async def run(self, interval: float) -> None:
+        """Периодически обновляет кэш папок."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Ошибка при обновлении папок: {e}", exc_info=True)
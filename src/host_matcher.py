@@ -0,0 +1,80 @@
+import re
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, List, Mapping, Optional, Pattern, Sequence, Set
+
+
+def _compile_alternation(patterns: Iterable[str]) -> Optional[Pattern]:
+    """Компилирует подстроки в одно регулярное выражение; более длинные проверяются первыми."""
+    ordered = sorted({pattern for pattern in patterns if pattern}, key=len, reverse=True)
+    return re.compile('|'.join(map(re.escape, ordered))) if ordered else None
+
+
+class PatternIndex:
+    """
+    Набор подстрок, скомпилированный в одно регулярное выражение.
+    Находит все входящие в текст подстроки, включая перекрывающиеся и вложенные друг в друга.
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns: List[str] = list(dict.fromkeys(patterns))
+        self._index: Dict[str, int] = {pattern: index for index, pattern in enumerate(self.patterns)}
+        self._always = frozenset(self._index[pattern] for pattern in self.patterns if not pattern)
+        self._regex = _compile_alternation(self.patterns)
+        # В одной позиции выражение возвращает только самый длинный шаблон,
+        # поэтому вложенные в него шаблоны добавляются по заранее построенной таблице.
+        self._nested: Dict[str, FrozenSet[int]] = {
+            pattern: frozenset(
+                self._index[other] for other in self.patterns if other and other != pattern and other in pattern
+            )
+            for pattern in self.patterns
+        }
+
+    def find(self, text: str) -> Set[int]:
+        """Возвращает индексы всех шаблонов, которые входят в text."""
+        found = set(self._always)
+        if self._regex is None:
+            return found
+        search = self._regex.search
+        match = search(text)
+        while match:
+            pattern = match.group()
+            found.add(self._index[pattern])
+            found |= self._nested[pattern]
+            # Следующий поиск начинается со следующего символа, чтобы не пропустить перекрывающиеся шаблоны.
+            match = search(text, match.start() + 1)
+        return found
+
+
+class RuleMatcher:
+    """
+    Проверяет правила вида {подстрока темы: [подстроки имени хоста]}.
+    Правило срабатывает, если тема содержит его ключ, а хост — хотя бы одну из его подстрок.
+    Таблица правил компилируется один раз, результаты запоминаются для пар (тема, хост).
+    """
+
+    def __init__(self, rules: Mapping[str, Sequence[str]], empty_matches_any_host: bool = False,
+                 cache_size: int = 65536):
+        """
+        :param rules: Таблица правил.
+        :param empty_matches_any_host: Срабатывает ли правило с пустым списком хостов для любого хоста.
+        :param cache_size: Сколько пар (тема, хост) запоминать.
+        """
+        subjects = list(rules)
+        self._subjects = PatternIndex(subjects)
+        self._any_host_rules = frozenset(
+            rule for rule, subject in enumerate(subjects) if empty_matches_any_host and not rules[subject]
+        )
+        self._host_regex: List[Optional[Pattern]] = [_compile_alternation(rules[subject]) for subject in subjects]
+        self.matches = lru_cache(maxsize=cache_size)(self._matches)
+
+    def _matches(self, subject: str, host: str) -> bool:
+        rules = self._subjects.find(subject)
+        if not rules:
+            return False
+        if rules & self._any_host_rules:
+            return True
+        for rule in rules:
+            regex = self._host_regex[rule]
+            if regex is not None and regex.search(host):
+                return True
+        return False
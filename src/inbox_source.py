@@ -0,0 +1,155 @@
+import asyncio
+import threading
+from typing import Optional
+from exchangelib.properties import CreatedEvent, NewMailEvent
+from .settings import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class InboxSource:
+    """Базовый источник сигналов о том, что во входящих могли появиться новые письма."""
+
+    async def start(self) -> None:
+        """Запускает источник."""
+
+    async def stop(self) -> None:
+        """Останавливает источник."""
+
+    async def wait_for_mail(self, had_mail: bool = False) -> None:
+        """
+        Ждет, пока во входящих не появятся новые письма.
+        :param had_mail: Были ли письма при последней проверке входящих.
+        """
+        raise NotImplementedError
+
+
+class PollingInboxSource(InboxSource):
+    """Опрос входящих с нарастающей паузой, пока новых писем нет."""
+
+    def __init__(self, min_interval: float = 1, max_interval: float = 30, factor: float = 2):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.factor = factor
+        self._interval = min_interval
+
+    def next_interval(self, had_mail: bool) -> float:
+        """Сбрасывает паузу, если письма были, иначе увеличивает ее до max_interval."""
+        if had_mail:
+            self._interval = self.min_interval
+        else:
+            self._interval = min(self._interval * self.factor, self.max_interval)
+        return self._interval
+
+    async def wait_for_mail(self, had_mail: bool = False) -> None:
+        await asyncio.sleep(self.next_interval(had_mail))
+
+
+class StreamingInboxSource(InboxSource):
+    """
+    Получает уведомления о новых письмах через streaming-подписку EWS.
+    Подписка слушается в отдельном потоке, чтобы не занимать пул executor'а.
+    Пока подписка не работает, источник опрашивает почту через PollingInboxSource.
+    """
+
+    _event_types = (NewMailEvent.ELEMENT_NAME, CreatedEvent.ELEMENT_NAME)
+
+    def __init__(self, folder, connection_timeout: int = 29, safety_interval: float = 60,
+                 retry_interval: float = 10, fallback: Optional[PollingInboxSource] = None):
+        """
+        :param folder: Папка exchangelib (обычно account.inbox).
+        :param connection_timeout: Время жизни одного streaming-соединения в минутах (не более 30).
+        :param safety_interval: Контрольная проверка почты, даже если событий не было.
+        :param retry_interval: Пауза перед повторной подпиской после ошибки.
+        :param fallback: Опрос, который используется, пока подписка недоступна.
+        """
+        self.folder = folder
+        self.connection_timeout = connection_timeout
+        self.safety_interval = safety_interval
+        self.retry_interval = retry_interval
+        self.fallback = fallback or PollingInboxSource()
+        self.subscribed = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._listen, name='ews-streaming', daemon=True)
+        self._thread.start()
+        logger.info('Запущено получение новых писем через streaming-подписку.')
+
+    async def stop(self) -> None:
+        self._stopped.set()
+
+    def _notify(self) -> None:
+        """Будит ожидающий wait_for_mail из потока подписки."""
+        self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _listen(self) -> None:
+        """Держит streaming-подписку, переподписываясь после ошибок."""
+        while not self._stopped.is_set():
+            subscription_id = None
+            try:
+                subscription_id = self.folder.subscribe_to_streaming(event_types=self._event_types)
+                self.subscribed = True
+                # Письма, пришедшие пока подписки не было, забираем сразу.
+                self._notify()
+                while not self._stopped.is_set():
+                    for notification in self.folder.get_streaming_events(
+                        subscription_id, connection_timeout=self.connection_timeout
+                    ):
+                        if any(isinstance(event, (NewMailEvent, CreatedEvent)) for event in notification.events):
+                            self._notify()
+                        if self._stopped.is_set():
+                            break
+            except Exception as e:
+                logger.error(f'Ошибка streaming-подписки, перехожу на опрос: {e}')
+            finally:
+                self.subscribed = False
+                if subscription_id:
+                    try:
+                        self.folder.unsubscribe(subscription_id)
+                    except Exception as e:
+                        logger.debug(f'Не удалось отписаться от {subscription_id}: {e}')
+            self._stopped.wait(self.retry_interval)
+
+    async def wait_for_mail(self, had_mail: bool = False) -> None:
+        if had_mail:
+            # Последняя проверка обработала письма, и за ними могли остаться еще: проверяем сразу.
+            # Уведомления о них уже учтены этой проверкой.
+            self.fallback.next_interval(had_mail)
+            self._wakeup.clear()
+            return
+        if self.subscribed:
+            timeout = self.safety_interval
+        else:
+            timeout = self.fallback.next_interval(had_mail)
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+
+def create_inbox_source(folder, mode: str = 'streaming', min_interval: float = 1, max_interval: float = 30,
+                        connection_timeout: int = 29, safety_interval: float = 60) -> InboxSource:
+    """
+    Создает источник новых писем.
+    :param folder: Папка exchangelib, за которой нужно следить.
+    :param mode: 'streaming' — подписка EWS с опросом как запасным вариантом, 'polling' — только опрос.
+    """
+    fallback = PollingInboxSource(min_interval=min_interval, max_interval=max_interval)
+    if mode == 'polling':
+        return fallback
+    if mode != 'streaming':
+        logger.warning(f'Неизвестный режим получения почты {mode}, использую streaming.')
+    return StreamingInboxSource(
+        folder,
+        connection_timeout=connection_timeout,
+        safety_interval=safety_interval,
+        fallback=fallback
+    )
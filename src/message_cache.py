@@ -0,0 +1,60 @@
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+from exchangelib import Message
+from .settings import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class MessageCache:
+    """
+    Кэш писем EWS по id и changekey с ограничением размера и временем жизни.
+    Позволяет не перечитывать из Exchange письмо, которое уже есть в памяти.
+    """
+
+    def __init__(self, max_size: int = 2000, ttl: float = 3600):
+        """
+        :param max_size: Максимальное количество писем; самые давно использованные вытесняются.
+        :param ttl: Время жизни записи в секундах.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._items: "OrderedDict[str, Tuple[float, Message]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, message_id: str, changekey: Optional[str] = None) -> Optional[Message]:
+        """
+        Возвращает письмо из кэша или None.
+        Если передан changekey и он не совпадает с закэшированным, запись считается устаревшей.
+        """
+        entry = self._items.get(message_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, message = entry
+        if expires_at < time.monotonic() or (changekey and message.changekey != changekey):
+            del self._items[message_id]
+            self.misses += 1
+            return None
+        self._items.move_to_end(message_id)
+        self.hits += 1
+        return message
+
+    def put(self, message: Message) -> None:
+        """Добавляет или обновляет письмо в кэше."""
+        if not message.id:
+            return
+        self._items[message.id] = (time.monotonic() + self.ttl, message)
+        self._items.move_to_end(message.id)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def invalidate(self, message_id: str) -> None:
+        """Удаляет письмо из кэша, например после перемещения или удаления."""
+        if self._items.pop(message_id, None) is not None:
+            logger.debug(f"Письмо {message_id} удалено из кэша.")
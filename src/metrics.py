@@ -0,0 +1,266 @@
+import asyncio
+import bisect
+import functools
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+from aiohttp import web
+from .settings import setup_logger
+
+logger = setup_logger(__name__)
+
+LabelValues = Tuple[str, ...]
+GaugeFunction = Callable[[], Union[float, Awaitable[float]]]
+HealthCheck = Callable[[], Awaitable[bool]]
+
+_DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: LabelValues, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(names, values)) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Metric:
+    """Общая часть метрик: имя, описание и метки."""
+
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+    async def collect(self) -> List[str]:
+        raise NotImplementedError
+
+    async def render(self) -> List[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}'] + await self.collect()
+
+
+class Counter(_Metric):
+    """Монотонно растущий счетчик."""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        # Счетчик без меток отдается сразу с нулем, а не появляется после первого события.
+        self._values: Dict[LabelValues, float] = {} if self.label_names else {(): 0}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    async def collect(self) -> List[str]:
+        return [f'{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}'
+                for key, value in self._values.items()]
+
+
+class Gauge(_Metric):
+    """Текущее значение. Может задаваться явно или вычисляться функцией при каждом запросе /metrics."""
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {}
+        self._functions: Dict[LabelValues, GaugeFunction] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        self._values[self._key(labels)] = value
+
+    def set_function(self, function: GaugeFunction, **labels: str) -> None:
+        """Значение будет вычисляться функцией (обычной или async) при каждом запросе /metrics."""
+        self._functions[self._key(labels)] = function
+
+    async def collect(self) -> List[str]:
+        values = dict(self._values)
+        for key, function in self._functions.items():
+            try:
+                value = function()
+                values[key] = await value if asyncio.iscoroutine(value) else value
+            except Exception as e:
+                logger.error(f"Ошибка при вычислении метрики {self.name}: {e}", exc_info=True)
+        return [f'{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}'
+                for key, value in values.items()]
+
+
+class Histogram(_Metric):
+    """Распределение длительностей по корзинам."""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = _DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Для каждого набора меток: счетчики по корзинам (последняя — +Inf), сумма и количество.
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = ([0] * (len(self.buckets) + 1), [0.0, 0])
+        counts, totals = entry
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        totals[0] += value
+        totals[1] += 1
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Замеряет длительность блока with."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels: str) -> int:
+        entry = self._values.get(self._key(labels))
+        return int(entry[1][1]) if entry else 0
+
+    async def collect(self) -> List[str]:
+        lines = []
+        for key, (counts, (total, count)) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.label_names, key, ('le', _format_value(bound)))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.label_names, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {_format_value(count)}')
+        return lines
+
+
+def timed(histogram: Histogram, **labels: str):
+    """Декоратор для async-функций: замеряет длительность вызова."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with histogram.time(**labels):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class MetricsRegistry:
+    """Набор метрик, который отдается в формате Prometheus."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    async def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines += await metric.render()
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+EWS_LATENCY: Histogram = REGISTRY.register(Histogram(
+    'vit_ews_request_seconds', 'Длительность запросов к EWS.', ['operation']
+))
+REDIS_LATENCY: Histogram = REGISTRY.register(Histogram(
+    'vit_redis_request_seconds', 'Длительность обращений к Redis.', ['operation'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+))
+NOTIFICATION_LATENCY: Histogram = REGISTRY.register(Histogram(
+    'vit_notification_latency_seconds',
+    'Задержка доставки уведомления: от получения письма (для эскалаций — от срабатывания таймера) до отправки.',
+    ['kind', 'channel'],
+    buckets=(0.5, 1, 2.5, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+))
+QUEUE_DEPTH: Gauge = REGISTRY.register(Gauge(
+    'vit_queue_depth', 'Количество элементов, ожидающих в очереди.', ['queue']
+))
+PENDING_TIMERS: Gauge = REGISTRY.register(Gauge(
+    'vit_pending_timers', 'Количество таймеров алертов, ожидающих срабатывания.'
+))
+PARTITIONS_OWNED: Gauge = REGISTRY.register(Gauge(
+    'vit_partitions_owned', 'Количество партиций хостов, которыми владеет экземпляр.'
+))
+TELEGRAM_MESSAGES: Gauge = REGISTRY.register(Gauge(
+    'vit_telegram_messages', 'Сообщения Telegram с момента запуска: отправлено, отброшено, сводок, повторов.', ['result']
+))
+ALERTS: Counter = REGISTRY.register(Counter(
+    'vit_alerts_total', 'Количество обработанных писем алертов.', ['type']
+))
+FLAPS: Counter = REGISTRY.register(Counter(
+    'vit_flap_events_total', 'Количество обнаруженных флапов.'
+))
+DEDUP_LOOKUPS: Counter = REGISTRY.register(Counter(
+    'vit_dedup_lookups_total', 'Проверки problem-алертов на повтор: hit — повтор отсеян без Redis и EWS.', ['result']
+))
+MASS_EVENTS: Counter = REGISTRY.register(Counter(
+    'vit_mass_events_total', 'Количество обнаруженных массовых проблем.'
+))
+
+
+class MetricsServer:
+    """HTTP-сервер с /metrics в формате Prometheus и /health."""
+
+    def __init__(self, host: str = '0.0.0.0', port: int = 8080, registry: MetricsRegistry = REGISTRY):
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self._health_checks: Dict[str, HealthCheck] = {}
+        self._runner: Optional[web.AppRunner] = None
+
+    def add_health_check(self, name: str, check: HealthCheck) -> None:
+        """Добавляет проверку для /health; сервис здоров, если все проверки вернули True."""
+        self._health_checks[name] = check
+
+    async def _metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=await self.registry.render(), content_type='text/plain', charset='utf-8')
+
+    async def _health(self, request: web.Request) -> web.Response:
+        checks = {}
+        for name, check in self._health_checks.items():
+            try:
+                checks[name] = bool(await check())
+            except Exception as e:
+                logger.warning(f"Проверка {name} не прошла: {e}")
+                checks[name] = False
+        healthy = all(checks.values())
+        return web.json_response({'status': 'ok' if healthy else 'fail', 'checks': checks},
+                                 status=200 if healthy else 503)
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get('/metrics', self._metrics)
+        app.router.add_get('/health', self._health)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Метрики доступны на http://{self.host}:{self.port}/metrics")
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
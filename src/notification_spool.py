@@ -0,0 +1,63 @@
+import time
+from typing import List, Tuple
+import orjson
+from redis.asyncio import Redis
+from .alert_entity import Alert, AlertProblem
+from .settings import setup_logger
+
+logger = setup_logger(__name__)
+
+# Виды отложенных уведомлений: один алерт может ждать и как обычное уведомление, и как флап или массовая проблема.
+SPOOL_KINDS = ('regular', 'flap', 'mass')
+
+
+class NotificationSpool:
+    """
+    Уведомления problem, которые пришлось отложить вне часов рассылки.
+    Хранятся в hash Redis (ключ — вид уведомления и host:subject), поэтому переживают перезапуск,
+    а повторное уведомление по тому же алерту не создает второй записи.
+    """
+
+    def __init__(self, redis: Redis, key: str = 'vit:spool'):
+        self.redis = redis
+        self.key = key
+
+    @staticmethod
+    def _field(kind: str, alert: Alert) -> str:
+        return f'{kind}:{alert._cache_key}'
+
+    async def add(self, alert: AlertProblem, kind: str) -> None:
+        """Откладывает уведомление по алерту до начала часов рассылки."""
+        try:
+            value = orjson.dumps({'kind': kind, 'alert': alert.to_record(time.time())})
+            await self.redis.hset(self.key, self._field(kind, alert), value)
+            logger.info(f"Уведомление {kind} по {alert._cache_key} отложено до начала рабочего времени.")
+        except Exception as e:
+            logger.error(f"Ошибка при откладывании уведомления: {e}", exc_info=True)
+
+    async def discard(self, alert: Alert) -> None:
+        """Убирает отложенные уведомления по алерту, например после resolved."""
+        try:
+            await self.redis.hdel(self.key, *(self._field(kind, alert) for kind in SPOOL_KINDS))
+        except Exception as e:
+            logger.error(f"Ошибка при удалении отложенного уведомления: {e}", exc_info=True)
+
+    async def drain(self) -> List[Tuple[str, AlertProblem]]:
+        """Забирает все отложенные уведомления и очищает spool одной транзакцией."""
+        try:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.hgetall(self.key)
+                pipe.delete(self.key)
+                entries, _ = await pipe.execute()
+            spooled = []
+            for value in entries.values():
+                data = orjson.loads(value)
+                spooled.append((data['kind'], AlertProblem.from_record(data['alert'])))
+            return spooled
+        except Exception as e:
+            logger.error(f"Ошибка при чтении отложенных уведомлений: {e}", exc_info=True)
+            return []
+
+    async def size(self) -> int:
+        """Количество отложенных уведомлений."""
+        return await self.redis.hlen(self.key)
@@ -0,0 +1,191 @@
+import asyncio
+import math
+import os
+import socket
+import time
+import zlib
+from typing import Callable, List, Optional, Set
+from redis.asyncio import Redis
+from .settings import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class PartitionLeases:
+    """
+    Разделение хостов между несколькими экземплярами сервиса, которые читают один ящик.
+    Хосты делятся на partitions партиций по crc32 имени; партицией владеет тот, кто держит ее аренду
+    (ключ Redis с id экземпляра и сроком lease_ttl), и аренда продлевается в heartbeat.
+    Каждый экземпляр держит примерно partitions / (число живых экземпляров) партиций:
+    лишние отпускает, свободные забирает, поэтому при добавлении или падении экземпляра партиции перераспределяются сами.
+    Письма чужих партиций остаются непрочитанными для их владельца.
+    """
+
+    # Продлевает аренду, только если ею все еще владеет этот экземпляр.
+    _RENEW_SCRIPT = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    end
+    return 0
+    """
+
+    # Отпускает аренду, только если ею все еще владеет этот экземпляр.
+    _RELEASE_SCRIPT = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('DEL', KEYS[1])
+    end
+    return 0
+    """
+
+    # Отмечает письмо как взятое этим экземпляром. Отметку экземпляра, который не отмечался живым дольше
+    # lease_ttl, можно перехватить: иначе письма упавшего экземпляра ждали бы новый владелец до claim_ttl.
+    _CLAIM_SCRIPT = """
+    local holder = redis.call('GET', KEYS[1])
+    if holder and holder ~= ARGV[1] then
+        local seen = redis.call('ZSCORE', KEYS[2], holder)
+        if seen and tonumber(seen) >= tonumber(ARGV[3]) then
+            return 0
+        end
+    end
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return 1
+    """
+
+    def __init__(self, redis: Redis, key: str = 'vit:leases', partitions: int = 16, worker_id: Optional[str] = None,
+                 lease_ttl: float = 15, heartbeat_interval: float = 5, claim_ttl: float = 600,
+                 on_lost: Optional[Callable[[Set[int]], None]] = None):
+        """
+        :param key: Префикс ключей аренды; живые экземпляры хранятся в '{key}:workers', метки писем — в '{key}:claim:{id}'.
+        :param partitions: Количество партиций хостов; больше партиций — ровнее распределение.
+        :param worker_id: Идентификатор экземпляра, по умолчанию имя хоста и pid.
+        :param lease_ttl: Срок аренды в секундах: через столько партиции упавшего экземпляра достанутся другим.
+        :param heartbeat_interval: Как часто продлевать аренду; должен быть заметно меньше lease_ttl.
+        :param claim_ttl: Сколько секунд помнить, что письмо уже взято в обработку.
+        :param on_lost: Вызывается с номерами партиций, которые экземпляр потерял или отпустил.
+        """
+        self.redis = redis
+        self.key = key
+        self.partitions = max(1, partitions)
+        self.worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}'
+        self.lease_ttl = lease_ttl
+        self.heartbeat_interval = heartbeat_interval
+        self.claim_ttl = claim_ttl
+        self.on_lost = on_lost
+        self.workers_key = f'{key}:workers'
+        self.owned: Set[int] = set()
+        # До этого момента аренды заведомо действуют; если Redis недоступен дольше, партиции считаются потерянными.
+        self._valid_until = 0.0
+        self._renew = redis.register_script(self._RENEW_SCRIPT)
+        self._release = redis.register_script(self._RELEASE_SCRIPT)
+        self._claim = redis.register_script(self._CLAIM_SCRIPT)
+
+    def _lease_key(self, partition: int) -> str:
+        return f'{self.key}:{partition}'
+
+    def partition(self, host: str) -> int:
+        """Номер партиции хоста."""
+        return zlib.crc32(host.encode()) % self.partitions
+
+    def owns(self, host: str) -> bool:
+        """Принадлежит ли хост партиции этого экземпляра."""
+        return time.time() < self._valid_until and self.partition(host) in self.owned
+
+    async def heartbeat(self) -> None:
+        """
+        Отмечает экземпляр живым, продлевает свои аренды и выравнивает их число по живым экземплярам.
+        Аренды, которые продлить не удалось, считаются потерянными.
+        """
+        now = time.time()
+        ttl_ms = int(self.lease_ttl * 1000)
+        owned = sorted(self.owned)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.zadd(self.workers_key, {self.worker_id: now})
+            pipe.zremrangebyscore(self.workers_key, '-inf', now - self.lease_ttl)
+            pipe.zrange(self.workers_key, 0, -1)
+            for partition in owned:
+                await self._renew(keys=[self._lease_key(partition)], args=[self.worker_id, ttl_ms], client=pipe)
+            results = await pipe.execute()
+        workers = sorted(worker.decode() if isinstance(worker, bytes) else worker for worker in results[2])
+        lost = {partition for partition, renewed in zip(owned, results[3:]) if not renewed}
+        self.owned -= lost
+        self._valid_until = now + self.lease_ttl
+
+        target = math.ceil(self.partitions / max(1, len(workers)))
+        if len(self.owned) > target:
+            released = set(sorted(self.owned)[target:])
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for partition in released:
+                    await self._release(keys=[self._lease_key(partition)], args=[self.worker_id], client=pipe)
+                await pipe.execute()
+            self.owned -= released
+            lost |= released
+        elif len(self.owned) < target:
+            await self._acquire(target - len(self.owned), workers, ttl_ms)
+
+        if lost:
+            logger.warning(f"Экземпляр {self.worker_id} больше не владеет партициями {sorted(lost)}.")
+            if self.on_lost is not None:
+                self.on_lost(lost)
+
+    async def _acquire(self, count: int, workers: List[str], ttl_ms: int) -> None:
+        """
+        Пробует занять count свободных партиций.
+        Экземпляры начинают перебор с разных партиций, чтобы не пытаться занять одни и те же.
+        """
+        start = workers.index(self.worker_id) * self.partitions // len(workers) if self.worker_id in workers else 0
+        candidates = [(start + offset) % self.partitions for offset in range(self.partitions)]
+        candidates = [partition for partition in candidates if partition not in self.owned]
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for partition in candidates:
+                pipe.set(self._lease_key(partition), self.worker_id, nx=True, px=ttl_ms)
+            acquired = await pipe.execute()
+        taken = [partition for partition, ok in zip(candidates, acquired) if ok]
+        # Лишние занятые партиции сразу отпускаются: их заберут экземпляры, у которых партиций не хватает.
+        extra = taken[count:]
+        if extra:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for partition in extra:
+                    await self._release(keys=[self._lease_key(partition)], args=[self.worker_id], client=pipe)
+                await pipe.execute()
+        if taken[:count]:
+            self.owned.update(taken[:count])
+            logger.info(f"Экземпляр {self.worker_id} занял партиции {sorted(taken[:count])}, "
+                        f"всего {len(self.owned)} из {self.partitions}.")
+
+    async def claim_messages(self, message_ids: List[str]) -> List[bool]:
+        """
+        Отмечает письма как взятые этим экземпляром. Возвращает True для писем, которые никто не взял раньше,
+        уже взял этот экземпляр или взял экземпляр, переставший отмечаться живым.
+        Нужно на время передачи партиции, когда прежний владелец еще может обрабатывать ее письма.
+        """
+        if not message_ids:
+            return []
+        try:
+            ttl_ms = int(self.claim_ttl * 1000)
+            alive_since = time.time() - self.lease_ttl
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for message_id in message_ids:
+                    await self._claim(keys=[f'{self.key}:claim:{message_id}', self.workers_key],
+                                      args=[self.worker_id, ttl_ms, alive_since], client=pipe)
+                return [bool(claimed) for claimed in await pipe.execute()]
+        except Exception as e:
+            logger.error(f"Ошибка при отметке писем: {e}", exc_info=True)
+            return [False] * len(message_ids)
+
+    async def release_all(self) -> None:
+        """Отпускает все аренды и убирает экземпляр из живых, например при остановке."""
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for partition in self.owned:
+                await self._release(keys=[self._lease_key(partition)], args=[self.worker_id], client=pipe)
+            pipe.zrem(self.workers_key, self.worker_id)
+            await pipe.execute()
+        self.owned.clear()
+
+    async def run(self) -> None:
+        """Периодически продлевает аренды."""
+        while True:
+            try:
+                await self.heartbeat()
+            except Exception as e:
+                logger.error(f"Ошибка при продлении аренды партиций: {e}", exc_info=True)
+            await asyncio.sleep(self.heartbeat_interval)
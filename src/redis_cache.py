@@ -1,181 +1,415 @@
+import asyncio
 import json
-from typing import Optional, Any, Dict
+import time
+from typing import Optional, Any, Awaitable, Callable, Dict, List, NamedTuple, Set, Tuple
 from redis.asyncio import Redis
-from .alert_entity import Alert, AlertProblem
+from redis.asyncio.client import Pipeline
+from redis.exceptions import WatchError
+from .alert_entity import Alert, AlertProblem, decode_record, encode_record
+from .metrics import REDIS_LATENCY, timed
 from .settings import setup_logger
 
 
 logger = setup_logger(__name__)
 
+# Дополнительные команды, которые нужно выполнить в том же pipeline, что и обновление состояния алерта.
+PipelineHook = Callable[[Pipeline, AlertProblem], Awaitable[None]]
+
+
+class ProblemState(NamedTuple):
+    """Состояние problem-алерта после записи в Redis."""
+    is_new: bool = False
+    # Сколько problem по хосту за скользящее окно флапов.
+    flap_count: int = 0
+    # Сколько алертов и разных хостов в массовой группе за скользящее окно массовой проблемы.
+    mass_issues: int = 0
+    mass_hosts: int = 0
+    # Сколько алертов и разных групп на площадке за скользящее окно массовой проблемы.
+    site_issues: int = 0
+    site_groups: int = 0
+
 
 class RedisCache:
     """Класс для работы с кэшем Redis."""
 
-    def __init__(self, redis: Redis) -> None:
-        """Инициализирует экземпляр RedisCache."""
+    _scan_count = 500
+
+    def __init__(self, redis: Redis, coalesce_window: float = 0, prefix: str = 'vit:',
+                 flap_window: float = 300, mass_window: float = 300, mass_detail_max: int = 50) -> None:
+        """
+        Инициализирует экземпляр RedisCache.
+        :param coalesce_window: Если больше нуля, алерты, пришедшие в пределах этого окна (в секундах),
+            записываются в Redis одним pipeline.
+        :param prefix: Префикс всех ключей сервиса; Redis может использоваться и другими приложениями.
+        :param flap_window: Длина скользящего окна флапов в секундах.
+        :param mass_window: Длина скользящего окна массовой проблемы группы и площадки в секундах.
+        :param mass_detail_max: Сколько последних алертов хранить в деталях массовой проблемы.
+        """
         self.redis = redis
+        self.prefix = prefix
+        self.coalesce_window = coalesce_window
+        self.flap_window = flap_window
+        self.mass_window = mass_window
+        self.mass_detail_max = mass_detail_max
+        self._pending_problems: List[Tuple[AlertProblem, Optional[PipelineHook], asyncio.Future]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
 
     @classmethod
-    async def create(cls, host: str, port: int = 6379) -> Optional["RedisCache"]:
+    async def create(cls, host: str, port: int = 6379, fresh_start: bool = False,
+                     coalesce_window: float = 0, prefix: str = 'vit:', flap_window: float = 300,
+                     mass_window: float = 300, mass_detail_max: int = 50) -> Optional["RedisCache"]:
         """
         Фабричный метод для создания экземпляра RedisCache.
-        Проводит проверку подключения, очищает кэш и возвращает объект.
+        Проводит проверку подключения и возвращает объект.
+        Кэш сервиса очищается только при fresh_start=True, иначе состояние алертов и таймеров переживает перезапуск.
         """
         try:
             redis = Redis(host=host, port=port)
             await redis.ping()
             logger.info("Успешное подключение к Redis!")
-            instance = cls(redis)
-            await instance.clear_cache()
+            instance = cls(redis, coalesce_window, prefix, flap_window, mass_window, mass_detail_max)
+            if fresh_start:
+                await instance.clear_cache()
             return instance
         except Exception as e:
             logger.error(f"Ошибка при подключении к Redis: {e}")
             return None
 
+    def key(self, name: str) -> str:
+        """Возвращает ключ Redis в пространстве имен сервиса."""
+        return f'{self.prefix}{name}'
+
+    def _alert_key(self, entity: Alert) -> str:
+        return self.key(f'alert:{entity._cache_key}')
+
+    def _flap_key(self, entity: AlertProblem) -> str:
+        return self.key(entity._flap_key)
+
+    def _mass_key(self, entity: AlertProblem) -> str:
+        return self.key(entity._group_mass_key)
+
+    def _add_mass(self, pipe: Pipeline, scope: str, name: str, member: str, entity: AlertProblem, now: float) -> int:
+        """
+        Добавляет в pipeline учет алерта в массовой проблеме группы (scope='mass_group', member — хост)
+        или площадки (scope='mass_site', member — группа). Возвращает позицию первой команды в pipeline:
+        +5 — количество алертов, +9 — количество разных хостов или групп за последние mass_window секунд.
+        Окно скользящее, как у флапов: алерты и участники хранятся в ZSET по времени и старше окна удаляются,
+        поэтому поток редких алертов не копит счетчик. Детали хранятся только по последним mass_detail_max алертам.
+        """
+        offset = len(pipe)
+        details, window, seen = (self.key(f'{prefix}:{name}')
+                                 for prefix in (scope, f'{scope}_window', f'{scope}_seen'))
+        ttl = int(self.mass_window) + 1
+        pipe.lpush(details, json.dumps((entity.host, entity.subject, entity.severity)))
+        pipe.ltrim(details, 0, self.mass_detail_max - 1)
+        pipe.expire(details, ttl)
+        # message_id делает элемент уникальным, иначе одинаковые алерты схлопнутся в один.
+        pipe.zadd(window, {json.dumps((entity.host, entity.subject, entity.message_id)): now})
+        pipe.zremrangebyscore(window, '-inf', now - self.mass_window)
+        pipe.zcard(window)
+        pipe.expire(window, ttl)
+        # Участник хранится со временем последнего алерта и выпадает из окна, если алертов от него больше нет.
+        pipe.zadd(seen, {member: now})
+        pipe.zremrangebyscore(seen, '-inf', now - self.mass_window)
+        pipe.zcard(seen)
+        pipe.expire(seen, ttl)
+        return offset
+
+    def _flap_fired_key(self, entity: AlertProblem) -> str:
+        return self.key(f'flap_fired:{entity.host}')
+
+    def _add_flap(self, pipe: Pipeline, entity: AlertProblem, now: float) -> None:
+        """
+        Добавляет в pipeline запись события в скользящее окно флапов хоста: ZADD, ZREMRANGEBYSCORE, ZCARD, EXPIRE.
+        Третий результат — количество событий за последние flap_window секунд.
+        """
+        key = self._flap_key(entity)
+        # message_id делает элемент уникальным, иначе одинаковые алерты схлопнутся в один.
+        pipe.zadd(key, {json.dumps((entity.subject, entity.severity, entity.message_id)): now})
+        pipe.zremrangebyscore(key, '-inf', now - self.flap_window)
+        pipe.zcard(key)
+        pipe.expire(key, int(self.flap_window) + 1)
+
+    async def _scan(self, pattern: str):
+        """Инкрементально перебирает ключи по шаблону пачками, не блокируя Redis."""
+        cursor = 0
+        while True:
+            cursor, keys = await self.redis.scan(cursor, match=pattern, count=self._scan_count)
+            if keys:
+                yield keys
+            if not cursor:
+                break
+
     async def clear_cache(self) -> None:
-        """Очищает весь кэш при запуске программы."""
+        """Удаляет все ключи сервиса (режим чистого старта). Чужие ключи в Redis не затрагиваются."""
         try:
-            keys = await self.redis.keys("*")
-            if keys:
-                await self.redis.delete(*keys)
-                logger.info("Кэш был очищен при запуске программы!")
+            deleted = 0
+            async for keys in self._scan(self.key('*')):
+                deleted += await self.redis.unlink(*keys)
+            if deleted:
+                logger.info(f"Кэш был очищен при запуске программы: удалено {deleted} ключей.")
             else:
                 logger.info("Кэш уже пуст.")
         except Exception as e:
             logger.error(f"Ошибка при очистке кэша: {e}")
 
-    async def increase_flap_count(self, entity: AlertProblem, expiration: int = 370) -> None:
+    @timed(REDIS_LATENCY, operation='reconcile')
+    async def reconcile(self) -> List[Dict[str, Any]]:
         """
-        Увеличивает счетчик флапов для заданного хоста.
-        Если запись существует, увеличивает счётчик и добавляет новые данные;
-        иначе – создаёт новую запись.
+        Восстанавливает состояние после перезапуска: возвращает все сохраненные алерты,
+        по которым еще не пришел resolved.
         """
-        key = entity._flap_key
+        alerts = []
         try:
-            cached = await self.redis.get(key)
-            if cached:
-                data = json.loads(cached)
-                data['count'] += 1
-                data['mass'].append((entity.subject, entity.severity))
-            else:
-                data = {
-                    'count': 1,
-                    'mass': [(entity.subject, entity.severity)]
-                }
-            await self.redis.set(key, json.dumps(data), ex=expiration)
-            logger.info(f"Счетчик флапов для {key} увеличен.")
+            async for keys in self._scan(self.key('alert:*')):
+                for cached in await self.redis.mget(keys):
+                    if cached:
+                        record = decode_record(cached)
+                        if record:
+                            alerts.append(record)
+            logger.info(f"Из кэша восстановлено {len(alerts)} активных алертов.")
         except Exception as e:
-            logger.error(f"Ошибка при увеличении счетчика флапов: {e}")
+            logger.error(f"Ошибка при восстановлении состояния из кэша: {e}", exc_info=True)
+        return alerts
 
-    async def add_to_mass_group(self, entity: AlertProblem, expiration: int = 370) -> None:
-        """
-        Добавляет информацию об алерте в массовую группу.
-        Для каждого хоста хранится список кортежей (тема, уровень серьезности).
-        """
-        key = entity._group_mass_key
-        try:
-            cached = await self.redis.get(key)
-            if cached:
-                data: Dict[str, Any] = json.loads(cached)
-                if entity.host in data:
-                    data[entity.host].append((entity.subject, entity.severity))
-                else:
-                    data[entity.host] = [(entity.subject, entity.severity)]
-            else:
-                data = {entity.host: [(entity.subject, entity.severity)]}
-            await self.redis.set(key, json.dumps(data), ex=expiration)
-            logger.info(f"Данные добавлены в массовую группу для ключа {key}.")
-        except Exception as e:
-            logger.error(f"Ошибка при добавлении в массовую группу: {e}")
+    async def _read_mass(self, key: str) -> Optional[Dict[str, Any]]:
+        """Читает сохраненные детали массовой проблемы: {host: [(subject, severity), ...]}."""
+        cached = await self.redis.lrange(key, 0, -1)
+        if not cached:
+            logger.info(f"Данные массовой проблемы для {key} отсутствуют.")
+            return None
+        data: Dict[str, Any] = {}
+        for item in reversed(cached):
+            host, subject, severity = json.loads(item)
+            data.setdefault(host, []).append([subject, severity])
+        return data
 
+    @timed(REDIS_LATENCY, operation='get_mass_group')
     async def get_mass_group(self, entity: AlertProblem) -> Optional[Dict[str, Any]]:
         """
-        Получает данные о массовой проблеме для заданного хоста.
+        Получает данные о массовой проблеме для группы алерта: последние mass_detail_max алертов.
         Возвращает словарь вида {host: [(subject, severity), ...]} или None.
         """
         try:
-            cached = await self.redis.get(entity._group_mass_key)
-            if cached:
-                logger.info(f"Данные массовой группы для {entity._group_mass_key} получены.")
-                return json.loads(cached)
-            logger.info(f"Данные массовой группы для {entity._group_mass_key} отсутствуют.")
-            return None
+            return await self._read_mass(self._mass_key(entity))
         except Exception as e:
             logger.error(f"Ошибка при получении массовой группы: {e}", exc_info=True)
             return None
 
-    async def delete_mass_group(self, entity: AlertProblem) -> None:
-        """Удаляет данные массовой проблемы из кэша."""
+    @timed(REDIS_LATENCY, operation='get_mass_site')
+    async def get_mass_site(self, site: str) -> Optional[Dict[str, Any]]:
+        """Получает данные о массовой проблеме на площадке в том же формате, что и get_mass_group."""
         try:
-            await self.redis.delete(entity._group_mass_key)
+            return await self._read_mass(self.key(f'mass_site:{site}'))
         except Exception as e:
-            logger.error(f"Ошибка при удалении массовой группы: {e}", exc_info=True)
+            logger.error(f"Ошибка при получении массовой проблемы площадки: {e}", exc_info=True)
+            return None
 
+    @timed(REDIS_LATENCY, operation='claim_mass')
+    async def claim_mass(self, scope: str, name: str, cooldown: int) -> bool:
+        """
+        Отмечает, что по группе или площадке (scope: 'group' или 'site') отправлено уведомление о массовой проблеме.
+        Возвращает False, если уведомление уже отправлялось в течение cooldown секунд.
+        """
+        try:
+            return bool(await self.redis.set(self.key(f'mass_fired:{scope}:{name}'), 1, nx=True, ex=cooldown))
+        except Exception as e:
+            logger.error(f"Ошибка при отметке массовой проблемы: {e}", exc_info=True)
+            return False
+
+    @timed(REDIS_LATENCY, operation='mass_fired')
+    async def mass_fired(self, scope: str, name: str) -> bool:
+        """Проверяет, отправлялось ли недавно уведомление о массовой проблеме по группе или площадке."""
+        try:
+            return bool(await self.redis.exists(self.key(f'mass_fired:{scope}:{name}')))
+        except Exception as e:
+            logger.error(f"Ошибка при проверке массовой проблемы: {e}", exc_info=True)
+            return False
+
+    @timed(REDIS_LATENCY, operation='get_flap_count')
     async def get_flap_count(self, entity: AlertProblem) -> Optional[Dict[str, Any]]:
         """
-        Получает данные о флапах для заданного хоста.
-        Возвращает словарь с количеством и списком уведомлений или None.
+        Получает данные о флапах для заданного хоста за последние flap_window секунд.
+        Возвращает словарь с количеством, списком уведомлений и длиной окна в секундах или None.
         """
         try:
-            cached = await self.redis.get(entity._flap_key)
+            cached = await self.redis.zrangebyscore(self._flap_key(entity), time.time() - self.flap_window, '+inf')
             if cached:
-                return json.loads(cached)
+                mass = [json.loads(item)[:2] for item in cached]
+                return {'count': len(mass), 'mass': mass, 'window': self.flap_window}
             return None
         except Exception as e:
             logger.error(f"Ошибка при получении флапов: {e}", exc_info=True)
             return None
 
-    async def delete_flap(self, entity: AlertProblem) -> None:
-        """Удаляет данные о флапах для заданного хоста."""
+    @timed(REDIS_LATENCY, operation='claim_flap')
+    async def claim_flap(self, entity: AlertProblem, cooldown: int) -> bool:
+        """
+        Отмечает, что по хосту отправлено уведомление о флапе (SET NX EX).
+        Возвращает False, если уведомление уже отправлялось в течение cooldown секунд.
+        """
+        try:
+            return bool(await self.redis.set(self._flap_fired_key(entity), 1, nx=True, ex=cooldown))
+        except Exception as e:
+            logger.error(f"Ошибка при отметке флапа: {e}", exc_info=True)
+            return False
+
+    async def register_problem(self, entity: AlertProblem, hook: Optional[PipelineHook] = None) -> ProblemState:
+        """
+        Записывает состояние нового problem-алерта за один запрос к Redis:
+        сохраняет алерт, если его еще нет, учитывает его в массовой группе, площадке и окне флапов.
+        :param hook: Корутина, которая добавляет в тот же pipeline свои команды (например, таймеры).
+        """
+        if self.coalesce_window <= 0:
+            return (await self.register_problems([entity], hook))[0]
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending_problems.append((entity, hook, future))
+        if self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.coalesce_window, self._flush_problems)
+        return await future
+
+    def _flush_problems(self) -> None:
+        """Отправляет накопленные за окно алерты одним pipeline."""
+        self._flush_handle = None
+        pending, self._pending_problems = self._pending_problems, []
+        if pending:
+            task = asyncio.ensure_future(self._register_pending(pending))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def close(self) -> None:
+        """Записывает накопленные алерты, не дожидаясь окна, и ждет завершения записи."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_problems()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _register_pending(self, pending) -> None:
+        entities = [entity for entity, _, _ in pending]
+        hooks = {id(entity): hook for entity, hook, _ in pending}
+
+        async def hook(pipe: Pipeline, entity: AlertProblem):
+            entity_hook = hooks.get(id(entity))
+            if entity_hook:
+                await entity_hook(pipe, entity)
+
+        results = await self.register_problems(entities, hook)
+        for (_, _, future), result in zip(pending, results):
+            if not future.done():
+                future.set_result(result)
+
+    @timed(REDIS_LATENCY, operation='register_problems')
+    async def register_problems(self, entities: List[AlertProblem],
+                                hook: Optional[PipelineHook] = None) -> List[ProblemState]:
+        """Записывает состояние пачки problem-алертов одним pipeline и возвращает его для каждого алерта."""
         try:
-            await self.redis.delete(entity._flap_key)
+            async with self.redis.pipeline(transaction=True) as pipe:
+                created_at = time.time()
+                # Позиции результатов каждого алерта в ответе pipeline.
+                offsets = []
+                for entity in entities:
+                    offset, group_offset, site_offset = len(pipe), None, None
+                    pipe.set(self._alert_key(entity), encode_record(entity.to_record(created_at)), nx=True)
+                    self._add_flap(pipe, entity, created_at)
+                    if entity.group and not entity.is_exclude_group:
+                        group_offset = self._add_mass(pipe, 'mass_group', entity.group, entity.host,
+                                                      entity, created_at)
+                        if entity.site:
+                            site_offset = self._add_mass(pipe, 'mass_site', entity.site, entity.group,
+                                                         entity, created_at)
+                    offsets.append((offset, group_offset, site_offset))
+                if hook:
+                    for entity in entities:
+                        await hook(pipe, entity)
+                results = await pipe.execute()
+            logger.info(f"Состояние {len(entities)} алертов записано в Redis одним запросом.")
+            return [self._problem_state(results, *offset) for offset in offsets]
         except Exception as e:
-            logger.error(f"Ошибка при удалении флапов: {e}", exc_info=True)
+            logger.error(f"Ошибка при записи состояния алертов: {e}", exc_info=True)
+            return [ProblemState()] * len(entities)
 
+    @staticmethod
+    def _problem_state(results: list, offset: int, group_offset: Optional[int],
+                       site_offset: Optional[int]) -> ProblemState:
+        """Собирает ProblemState из ответа pipeline по позициям, которые вернули _add_flap и _add_mass."""
+        state = ProblemState(bool(results[offset]), results[offset + 3])
+        if group_offset is not None:
+            state = state._replace(mass_issues=results[group_offset + 5], mass_hosts=results[group_offset + 9])
+        if site_offset is not None:
+            state = state._replace(site_issues=results[site_offset + 5], site_groups=results[site_offset + 9])
+        return state
+
+    @timed(REDIS_LATENCY, operation='get')
     async def get(self, entity: AlertProblem) -> Optional[Dict[str, Any]]:
         """Получает данные из кэша по заданному ключу."""
         try:
-            cached = await self.redis.get(entity._cache_key)
+            cached = await self.redis.get(self._alert_key(entity))
             if cached:
-                return json.loads(cached)
+                return decode_record(cached)
         except Exception as e:
             logger.error(f"Не удалось получить данные из кэша: {e}", exc_info=True)
         return None
 
-    async def delete(self, entity: AlertProblem) -> bool:
-        """Удаляет элемент из кэша по заданному ключу."""
+    @timed(REDIS_LATENCY, operation='active')
+    async def active(self, entities: List[Alert]) -> List[bool]:
+        """Проверяет одним запросом, какие алерты еще есть в кэше, то есть не закрыты."""
         try:
-            result = await self.redis.delete(entity._cache_key)
-            if result:
-                logger.info(f"Элемент {entity._cache_key} удален из кэша.")
-            else:
-                logger.info(f"Элемент {entity._cache_key} не найден в кэше.")
-            return bool(result)
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for entity in entities:
+                    pipe.exists(self._alert_key(entity))
+                return [bool(exists) for exists in await pipe.execute()]
         except Exception as e:
-            logger.error(f"Ошибка при удалении элемента из кэша: {e}", exc_info=True)
-            return False
+            logger.error(f"Ошибка при проверке алертов в кэше: {e}", exc_info=True)
+            return [True] * len(entities)
 
-    async def save(self, entity: AlertProblem, update_data: Optional[Dict[str, Any]] = None,
-                   expiration: Optional[int] = None) -> None:
+    @timed(REDIS_LATENCY, operation='pop')
+    async def pop(self, entity: Alert, hook: Optional[PipelineHook] = None) -> Optional[Dict[str, Any]]:
         """
-        Сохраняет данные в кэше с возможностью обновления отдельных полей.
-        :param entity: Объект алерта.
-        :param update_data: Словарь с обновляемыми данными.
-        :param expiration: Время жизни записи в секундах.
+        Забирает запись алерта и удаляет ее из кэша атомарно (GETDEL).
+        :param hook: Корутина, которая добавляет в тот же pipeline свои команды (например, отмену таймеров).
         """
-        key = entity._cache_key
         try:
-            cached = await self.redis.get(key)
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.getdel(self._alert_key(entity))
+                if hook:
+                    await hook(pipe, entity)
+                cached = (await pipe.execute())[0]
             if cached:
-                data = json.loads(cached)
-            else:
-                data = entity.__dict__
-            if update_data:
-                data.update(update_data)
-            if expiration:
-                await self.redis.set(key, json.dumps(data), ex=expiration)
-            else:
-                await self.redis.set(key, json.dumps(data))
-            logger.info(f"Данные для {key} сохранены в кэше.")
+                return decode_record(cached)
+        except Exception as e:
+            logger.error(f"Не удалось забрать данные из кэша: {e}", exc_info=True)
+        return None
+
+    @timed(REDIS_LATENCY, operation='update')
+    async def update(self, entity: AlertProblem, update_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Обновляет поля записи алерта, только если она еще есть в кэше, и возвращает обновленную запись.
+        Чтение и запись выполняются под WATCH: если resolved забрал запись между ними, транзакция не проходит,
+        и закрытый алерт не возвращается в кэш. Возвращает None, если записи нет.
+        """
+        key = self._alert_key(entity)
+        try:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                while True:
+                    try:
+                        await pipe.watch(key)
+                        cached = await pipe.get(key)
+                        data = decode_record(cached) if cached else None
+                        if data is None:
+                            await pipe.unwatch()
+                            return None
+                        data.update(update_data)
+                        pipe.multi()
+                        pipe.set(key, encode_record(data), xx=True)
+                        await pipe.execute()
+                        logger.info(f"Данные для {key} обновлены в кэше.")
+                        return data
+                    except WatchError:
+                        continue
         except Exception as e:
-            logger.error(f"Ошибка сохранения данных в кэше: {e}", exc_info=True)
+            logger.error(f"Ошибка обновления данных в кэше: {e}", exc_info=True)
+            return None
@@ -1,4 +1,17 @@
 from .config import OUTLOOK_EMAIL, OUTLOOK_PASSWORD, CRITICAL_HOSTS, RECIPIENTS_EMAILS, EXCLUDE_GROUPS, REDIS_HOST, EMAIL_TAC, TELEGRAM_TOKEN
+from .config import INBOX_MODE, INBOX_POLL_MIN_INTERVAL, INBOX_POLL_MAX_INTERVAL, INBOX_STREAMING_TIMEOUT, INBOX_SAFETY_INTERVAL
+from .config import INBOX_PAGE_SIZE, INBOX_BATCH_SIZE, INBOX_QUEUE_SIZE, EWS_BATCH_WINDOW
+from .config import INBOX_CONCURRENCY, INBOX_WORKER_QUEUE_SIZE
+from .config import MESSAGE_CACHE_SIZE, MESSAGE_CACHE_TTL, FOLDER_REFRESH_INTERVAL
+from .config import REDIS_KEY_PREFIX, REDIS_FRESH_START, SCHEDULER_POLL_INTERVAL, SCHEDULER_MAX_RUNNING, REDIS_COALESCE_WINDOW
+from .config import FLAP_WINDOW, FLAP_THRESHOLD
+from .config import MASS_WINDOW, MASS_THRESHOLD, MASS_DETAIL_MAX, MASS_SITES, MASS_SITE_MIN_GROUPS
+from .config import DEDUP_TTL, DEDUP_MAX_SIZE, DEDUP_DELETE_WINDOW
+from .config import PARTITIONS, WORKER_ID, PARTITION_LEASE_TTL, PARTITION_HEARTBEAT_INTERVAL, MESSAGE_CLAIM_TTL
+from .config import EVENT_BUS, EVENT_STREAM_MAXLEN, EVENT_BLOCK, EVENT_MIN_IDLE, EVENT_MAX_DELIVERIES
+from .config import TELEGRAM_CHAT_ID, TELEGRAM_QUEUE_SIZE, TELEGRAM_DIGEST_THRESHOLD, TELEGRAM_DIGEST_MAX
+from .config import USERS_DB_PATH
+from .config import METRICS_HOST, METRICS_PORT
 from .logger import setup_logger
 
 
@@ -11,5 +24,51 @@ __all__ = [
     'REDIS_URL',
     'EMAIL_TAC',
     'TELEGRAM_TOKEN',
+    'TELEGRAM_CHAT_ID',
+    'TELEGRAM_QUEUE_SIZE',
+    'TELEGRAM_DIGEST_THRESHOLD',
+    'TELEGRAM_DIGEST_MAX',
+    'USERS_DB_PATH',
+    'METRICS_HOST',
+    'METRICS_PORT',
+    'INBOX_MODE',
+    'INBOX_POLL_MIN_INTERVAL',
+    'INBOX_POLL_MAX_INTERVAL',
+    'INBOX_STREAMING_TIMEOUT',
+    'INBOX_SAFETY_INTERVAL',
+    'INBOX_PAGE_SIZE',
+    'INBOX_BATCH_SIZE',
+    'INBOX_QUEUE_SIZE',
+    'INBOX_CONCURRENCY',
+    'INBOX_WORKER_QUEUE_SIZE',
+    'EWS_BATCH_WINDOW',
+    'MESSAGE_CACHE_SIZE',
+    'MESSAGE_CACHE_TTL',
+    'FOLDER_REFRESH_INTERVAL',
+    'REDIS_KEY_PREFIX',
+    'REDIS_FRESH_START',
+    'SCHEDULER_POLL_INTERVAL',
+    'SCHEDULER_MAX_RUNNING',
+    'REDIS_COALESCE_WINDOW',
+    'FLAP_WINDOW',
+    'FLAP_THRESHOLD',
+    'MASS_WINDOW',
+    'MASS_THRESHOLD',
+    'MASS_DETAIL_MAX',
+    'MASS_SITES',
+    'MASS_SITE_MIN_GROUPS',
+    'DEDUP_TTL',
+    'DEDUP_MAX_SIZE',
+    'DEDUP_DELETE_WINDOW',
+    'PARTITIONS',
+    'WORKER_ID',
+    'PARTITION_LEASE_TTL',
+    'PARTITION_HEARTBEAT_INTERVAL',
+    'MESSAGE_CLAIM_TTL',
+    'EVENT_BUS',
+    'EVENT_STREAM_MAXLEN',
+    'EVENT_BLOCK',
+    'EVENT_MIN_IDLE',
+    'EVENT_MAX_DELIVERIES',
     'setup_logger'
 ]
@@ -1,9 +1,22 @@
 from dotenv import load_dotenv
 from os import getenv
+from typing import Dict
 
 
 load_dotenv()
 
+
+def _parse_sites(value: str) -> Dict[str, str]:
+    """Разбирает 'площадка:группа,группа;площадка:группа' в словарь группа -> площадка."""
+    sites = {}
+    for entry in filter(None, value.split(';')):
+        site, _, groups = entry.partition(':')
+        for group in groups.split(','):
+            if group.strip():
+                sites[group.strip().replace(' ', '')] = site.strip()
+    return sites
+
+
 # Outlook_vit
 OUTLOOK_EMAIL = getenv('OUTLOOK_EMAIL')
 OUTLOOK_PASSWORD = getenv('OUTLOOK_PASSWORD')
@@ -16,5 +29,59 @@ EXCLUDE_GROUPS = getenv('EXCLUDE_GROUPS')
 # Redis
 REDIS_HOST = getenv('REDIS_HOST', 'redis_app')
 REDIS_PORT = int(getenv('REDIS_PORT', 6379))
+REDIS_KEY_PREFIX = getenv('REDIS_KEY_PREFIX', 'vit:')
+REDIS_FRESH_START = getenv('REDIS_FRESH_START', 'false').lower() in ('1', 'true', 'yes')
+SCHEDULER_POLL_INTERVAL = float(getenv('SCHEDULER_POLL_INTERVAL', 1))
+SCHEDULER_MAX_RUNNING = int(getenv('SCHEDULER_MAX_RUNNING', 100))
+REDIS_COALESCE_WINDOW = float(getenv('REDIS_COALESCE_WINDOW', 0))
+# Flaps
+FLAP_WINDOW = float(getenv('FLAP_WINDOW', 300))
+FLAP_THRESHOLD = int(getenv('FLAP_THRESHOLD', 5))
+# Mass
+MASS_WINDOW = float(getenv('MASS_WINDOW', 300))
+MASS_THRESHOLD = int(getenv('MASS_THRESHOLD', 5))
+MASS_DETAIL_MAX = int(getenv('MASS_DETAIL_MAX', 50))
+MASS_SITES = _parse_sites(getenv('MASS_SITES', ''))
+MASS_SITE_MIN_GROUPS = int(getenv('MASS_SITE_MIN_GROUPS', 2))
+# Dedup
+DEDUP_TTL = float(getenv('DEDUP_TTL', 600))
+DEDUP_MAX_SIZE = int(getenv('DEDUP_MAX_SIZE', 10000))
+DEDUP_DELETE_WINDOW = float(getenv('DEDUP_DELETE_WINDOW', 1))
+# Partitions
+PARTITIONS = int(getenv('PARTITIONS', 0))
+WORKER_ID = getenv('WORKER_ID')
+PARTITION_LEASE_TTL = float(getenv('PARTITION_LEASE_TTL', 15))
+PARTITION_HEARTBEAT_INTERVAL = float(getenv('PARTITION_HEARTBEAT_INTERVAL', 5))
+MESSAGE_CLAIM_TTL = float(getenv('MESSAGE_CLAIM_TTL', 600))
+# Events
+EVENT_BUS = getenv('EVENT_BUS', 'false').lower() in ('1', 'true', 'yes')
+EVENT_STREAM_MAXLEN = int(getenv('EVENT_STREAM_MAXLEN', 100000))
+EVENT_BLOCK = float(getenv('EVENT_BLOCK', 1))
+EVENT_MIN_IDLE = float(getenv('EVENT_MIN_IDLE', 60))
+EVENT_MAX_DELIVERIES = int(getenv('EVENT_MAX_DELIVERIES', 5))
 # Telegram
 TELEGRAM_TOKEN = getenv('TELEGRAM_TOKEN')
+TELEGRAM_CHAT_ID = getenv('TELEGRAM_CHAT_ID', '-1002555605837')
+TELEGRAM_QUEUE_SIZE = int(getenv('TELEGRAM_QUEUE_SIZE', 1000))
+TELEGRAM_DIGEST_THRESHOLD = int(getenv('TELEGRAM_DIGEST_THRESHOLD', 3))
+TELEGRAM_DIGEST_MAX = int(getenv('TELEGRAM_DIGEST_MAX', 10))
+USERS_DB_PATH = getenv('USERS_DB_PATH', 'authorized_users.db')
+# Metrics
+METRICS_HOST = getenv('METRICS_HOST', '0.0.0.0')
+METRICS_PORT = int(getenv('METRICS_PORT', 8080))
+# Inbox
+INBOX_MODE = getenv('INBOX_MODE', 'streaming')
+INBOX_POLL_MIN_INTERVAL = float(getenv('INBOX_POLL_MIN_INTERVAL', 1))
+INBOX_POLL_MAX_INTERVAL = float(getenv('INBOX_POLL_MAX_INTERVAL', 30))
+INBOX_STREAMING_TIMEOUT = int(getenv('INBOX_STREAMING_TIMEOUT', 29))
+INBOX_SAFETY_INTERVAL = float(getenv('INBOX_SAFETY_INTERVAL', 60))
+INBOX_PAGE_SIZE = int(getenv('INBOX_PAGE_SIZE', 100))
+INBOX_BATCH_SIZE = int(getenv('INBOX_BATCH_SIZE', 25))
+INBOX_QUEUE_SIZE = int(getenv('INBOX_QUEUE_SIZE', 4))
+INBOX_CONCURRENCY = int(getenv('INBOX_CONCURRENCY', 8))
+INBOX_WORKER_QUEUE_SIZE = int(getenv('INBOX_WORKER_QUEUE_SIZE', 25))
+# EWS
+EWS_BATCH_WINDOW = float(getenv('EWS_BATCH_WINDOW', 0.2))
+MESSAGE_CACHE_SIZE = int(getenv('MESSAGE_CACHE_SIZE', 2000))
+MESSAGE_CACHE_TTL = float(getenv('MESSAGE_CACHE_TTL', 3600))
+FOLDER_REFRESH_INTERVAL = float(getenv('FOLDER_REFRESH_INTERVAL', 3600))
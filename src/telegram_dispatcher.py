@@ -0,0 +1,159 @@
+import asyncio
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+from aiogram import Bot
+from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+from .settings import setup_logger
+from .metrics import NOTIFICATION_LATENCY
+
+logger = setup_logger(__name__)
+
+ChatId = Union[int, str]
+# Текст уведомления, вид уведомления для метрик и время, к которому оно должно было уйти.
+Pending = Tuple[str, Optional[str], Optional[float]]
+
+# Ограничение Telegram на длину одного сообщения.
+_MAX_MESSAGE_LENGTH = 4096
+_DIGEST_SEPARATOR = '\n\n➖➖➖➖➖\n\n'
+
+
+class TelegramDispatcher:
+    """
+    Очередь уведомлений в Telegram с учетом ограничений на частоту отправки.
+    Алерты ставятся в очередь без ожидания; отдельная задача отправляет их в группу
+    и всем авторизованным пользователям. На 429 отправка ждет retry_after и повторяется.
+    Если в очереди накопилось несколько алертов, они отправляются одной сводкой.
+    Задержка доставки пишется в метрику после первой успешной отправки сообщения.
+    """
+
+    def __init__(self, bot: Bot, chat_id: ChatId, recipients: Optional[Callable[[], Iterable[ChatId]]] = None,
+                 queue_size: int = 1000, digest_threshold: int = 3, digest_max: int = 10,
+                 send_interval: float = 0.05, max_retries: int = 5):
+        """
+        :param bot: Бот aiogram.
+        :param chat_id: Группа, в которую отправляются все алерты.
+        :param recipients: Функция, возвращающая id авторизованных пользователей.
+        :param queue_size: Сколько алертов может ждать отправки; остальные отбрасываются.
+        :param digest_threshold: С какого количества ожидающих алертов они объединяются в сводку.
+        :param digest_max: Сколько алертов максимум объединяется в одну сводку.
+        :param send_interval: Пауза между отправками, чтобы не упираться в общий лимит бота.
+        :param max_retries: Сколько раз повторять отправку при сетевых ошибках и 429.
+        """
+        self.bot = bot
+        # chat_id приходит из окружения строкой, а id пользователей — числа; приводим к одному типу,
+        # чтобы пользователь, совпадающий с группой, не получал алерты дважды.
+        self.chat_id = int(chat_id) if str(chat_id).lstrip('-').isdigit() else chat_id
+        self.recipients = recipients
+        self.digest_threshold = digest_threshold
+        self.digest_max = digest_max
+        self.send_interval = send_interval
+        self.max_retries = max_retries
+        self.queue: "asyncio.Queue[Pending]" = asyncio.Queue(maxsize=queue_size)
+        self._carry: Optional[Pending] = None
+        self.stats: Dict[str, int] = {
+            'queued': 0,
+            'sent': 0,
+            'dropped': 0,
+            'digests': 0,
+            'retries': 0,
+            'failed': 0,
+        }
+
+    def send(self, text: str, kind: Optional[str] = None, due_at: Optional[float] = None) -> bool:
+        """
+        Ставит сообщение в очередь. Возвращает False, если очередь заполнена и сообщение отброшено.
+        :param kind: Вид уведомления для метрики задержки доставки.
+        :param due_at: Время (unix), к которому уведомление должно было уйти; без него задержка не замеряется.
+        """
+        try:
+            self.queue.put_nowait((text, kind, due_at))
+            self.stats['queued'] += 1
+            return True
+        except asyncio.QueueFull:
+            self.stats['dropped'] += 1
+            logger.warning(f"Очередь Telegram заполнена, алерт отброшен (всего отброшено {self.stats['dropped']}).")
+            return False
+
+    def _destinations(self) -> List[ChatId]:
+        """Группа и все авторизованные пользователи."""
+        destinations = [self.chat_id]
+        if self.recipients is not None:
+            try:
+                destinations += [user_id for user_id in self.recipients() if int(user_id) != self.chat_id]
+            except Exception as e:
+                logger.error(f"Ошибка при получении списка получателей: {e}", exc_info=True)
+        return destinations
+
+    def _next_batch(self, first: Pending) -> List[Pending]:
+        """Если очередь растет, забирает из нее еще несколько алертов, чтобы отправить их одной сводкой."""
+        batch = [first]
+        if self.queue.qsize() + 1 < self.digest_threshold:
+            return batch
+        length = len(first[0])
+        while len(batch) < self.digest_max and not self.queue.empty():
+            pending = self.queue.get_nowait()
+            # Алерт, который не помещается в сообщение, уйдет первым в следующей отправке.
+            if length + len(_DIGEST_SEPARATOR) + len(pending[0]) > _MAX_MESSAGE_LENGTH - 100:
+                self._carry = pending
+                break
+            batch.append(pending)
+            length += len(_DIGEST_SEPARATOR) + len(pending[0])
+        return batch
+
+    def _render(self, batch: List[Pending]) -> str:
+        """Текст одного алерта или сводки из нескольких."""
+        if len(batch) == 1:
+            return batch[0][0]
+        self.stats['digests'] += 1
+        return f"📦 <b>Сводка: {len(batch)} алертов</b>\n\n" + _DIGEST_SEPARATOR.join(text for text, _, _ in batch)
+
+    @staticmethod
+    def _observe_latency(batch: List[Pending], sent_at: float) -> None:
+        """Пишет задержку доставки каждого алерта из отправленного сообщения."""
+        for _, kind, due_at in batch:
+            if due_at is not None:
+                NOTIFICATION_LATENCY.observe(max(0.0, sent_at - due_at), kind=kind or 'unknown', channel='telegram')
+
+    async def _send_to(self, chat_id: ChatId, text: str) -> bool:
+        """Отправляет сообщение в один чат, повторяя при 429 и сетевых ошибках."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text, parse_mode=ParseMode.HTML)
+                self.stats['sent'] += 1
+                return True
+            except TelegramRetryAfter as e:
+                delay = e.retry_after
+                logger.warning(f"Telegram ограничил отправку в {chat_id}, повтор через {delay} сек.")
+            except (TelegramNetworkError, TelegramServerError) as e:
+                delay = min(2 ** attempt, 30)
+                logger.warning(f"Ошибка сети при отправке в {chat_id}: {e}, повтор через {delay} сек.")
+            except Exception as e:
+                logger.error(f"Ошибка при отправке алерта в {chat_id}: {e}", exc_info=True)
+                break
+            if attempt < self.max_retries:
+                self.stats['retries'] += 1
+                await asyncio.sleep(delay)
+        self.stats['failed'] += 1
+        return False
+
+    async def run(self) -> None:
+        """Отправляет алерты из очереди."""
+        logger.info(f"Отправка алертов в Telegram запущена (группа {self.chat_id}).")
+        while True:
+            if self._carry is not None:
+                first, self._carry = self._carry, None
+            else:
+                first = await self.queue.get()
+            try:
+                batch = self._next_batch(first)
+                text = self._render(batch)
+                delivered = False
+                for chat_id in self._destinations():
+                    if await self._send_to(chat_id, text) and not delivered:
+                        delivered = True
+                        self._observe_latency(batch, time.time())
+                    if self.send_interval:
+                        await asyncio.sleep(self.send_interval)
+            except Exception as e:
+                logger.error(f"Ошибка при отправке алертов в Telegram: {e}", exc_info=True)
@@ -0,0 +1,69 @@
+import asyncio
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import FrozenSet, Optional, Set
+from .settings import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class UserStore:
+    """
+    Авторизованные пользователи Telegram.
+    Список загружается в память при старте, поэтому проверка доступа не обращается к базе.
+    Все запросы к SQLite выполняются через одно соединение в отдельном потоке и не блокируют цикл событий.
+    """
+
+    def __init__(self, db_path: str = "authorized_users.db"):
+        self.db_path = db_path
+        self._users: Set[int] = set()
+        self._conn: Optional[sqlite3.Connection] = None
+        # Один поток: соединение SQLite используется только из него.
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='user-store')
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _open(self) -> Set[int]:
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS authorized_users (
+                user_id INTEGER PRIMARY KEY
+            )
+        """)
+        self._conn.commit()
+        return {row[0] for row in self._conn.execute("SELECT user_id FROM authorized_users")}
+
+    def _insert(self, user_id: int) -> None:
+        self._conn.execute("INSERT OR IGNORE INTO authorized_users (user_id) VALUES (?)", (user_id,))
+        self._conn.commit()
+
+    @classmethod
+    async def create(cls, db_path: str = "authorized_users.db") -> "UserStore":
+        """Открывает базу и загружает пользователей в память."""
+        self = cls(db_path)
+        self._users = await self._run(self._open)
+        logger.info(f"Загружено {len(self._users)} авторизованных пользователей.")
+        return self
+
+    def is_authorized(self, user_id: int) -> bool:
+        """Проверяет доступ пользователя по данным в памяти."""
+        return user_id in self._users
+
+    async def add(self, user_id: int) -> None:
+        """Сохраняет пользователя в базу и добавляет его в память."""
+        if user_id in self._users:
+            return
+        await self._run(self._insert, user_id)
+        self._users.add(user_id)
+
+    def users(self) -> FrozenSet[int]:
+        """Возвращает всех авторизованных пользователей."""
+        return frozenset(self._users)
+
+    async def close(self) -> None:
+        """Закрывает соединение с базой."""
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=False)
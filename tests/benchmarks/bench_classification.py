@@ -0,0 +1,109 @@
+"""
+Микробенчмарк классификации алертов: стоимость проверки критичного и аварийного хоста на один алерт.
+Сравнивает прежний вложенный перебор правил с компилированным RuleMatcher
+на текущих таблицах правил и на таблицах, увеличенных как при подключении новых площадок.
+
+Запуск: python -m tests.benchmarks.bench_classification
+"""
+import os
+import random
+import timeit
+
+os.environ.setdefault('CRITICAL_HOSTS', '')
+os.environ.setdefault('EXCLUDE_GROUPS', 'PBO')
+
+from src.alert_entity import AlertProblem  # noqa: E402
+from src.host_matcher import RuleMatcher  # noqa: E402
+
+GENERIC_SUBJECTS = [
+    'High CPU utilization (over 90% for 5m)',
+    'Load average is too high (per CPU load over 1.5 for 5m)',
+    'Interface Gi0/1: Link down',
+    'MySQL: Service is down',
+    'Windows: Service "Spooler" is not running',
+    'Memory usage is too high (over 90% for 5m)',
+]
+
+
+def legacy_is_critical(rules: dict, subject: str, host: str) -> bool:
+    for alert_subject, critical_hosts in rules.items():
+        if alert_subject in subject:
+            if critical_hosts:
+                if any(critical_host in host for critical_host in critical_hosts):
+                    return True
+            else:
+                return True
+    return False
+
+
+def legacy_is_emergency(rules: dict, subject: str, host: str) -> bool:
+    for alert_subject, critical_hosts in rules.items():
+        if alert_subject in subject:
+            if any(critical_host in host for critical_host in critical_hosts):
+                return True
+    return False
+
+
+def scaled_rules(rules: dict, sites: int, seed: int = 7) -> dict:
+    """Добавляет к таблице правила для sites дополнительных площадок."""
+    rnd = random.Random(seed)
+    scaled = {subject: list(hosts) for subject, hosts in rules.items()}
+    for site in range(sites):
+        subject = f'Site RU{site:03d}: ' + rnd.choice(GENERIC_SUBJECTS)
+        scaled[subject] = [f'RU{site:03d}-{kind}{n:02d}' for kind in ('POS', 'KVS', 'GSC') for n in range(10)]
+    return scaled
+
+
+def build_corpus(critical: dict, emergency: dict, size: int, seed: int = 42):
+    """Поток алертов: треть по темам из таблиц правил, остальное — типовые темы Zabbix."""
+    rnd = random.Random(seed)
+    rule_subjects = list(critical) + list(emergency)
+    hosts = [host for host_list in critical.values() for host in host_list]
+    hosts += [host for host_list in emergency.values() for host in host_list]
+    hosts += [f'RU{rnd.randint(1000, 9999)}-POS{rnd.randint(1, 30):02d}' for _ in range(200)]
+    corpus = []
+    for _ in range(size):
+        subject = rnd.choice(rule_subjects) if rnd.random() < 0.33 else rnd.choice(GENERIC_SUBJECTS)
+        corpus.append((f'❌ {subject}', rnd.choice(hosts)))
+    return corpus
+
+
+def run(title: str, critical_rules: dict, emergency_rules: dict, size: int, repeat: int):
+    corpus = build_corpus(critical_rules, emergency_rules, size)
+    critical = RuleMatcher(critical_rules, empty_matches_any_host=True)
+    emergency = RuleMatcher(emergency_rules)
+
+    def legacy():
+        for subject, host in corpus:
+            legacy_is_critical(critical_rules, subject, host) or legacy_is_emergency(emergency_rules, subject, host)
+
+    def compiled():
+        for subject, host in corpus:
+            critical._matches(subject, host) or emergency._matches(subject, host)
+
+    def memoized():
+        for subject, host in corpus:
+            critical.matches(subject, host) or emergency.matches(subject, host)
+
+    mismatches = sum(
+        legacy_is_critical(critical_rules, subject, host) != critical.matches(subject, host)
+        or legacy_is_emergency(emergency_rules, subject, host) != emergency.matches(subject, host)
+        for subject, host in corpus
+    )
+    print(f'{title}: правил {len(critical_rules) + len(emergency_rules)}, '
+          f'алертов {size}, расхождений с прежней логикой: {mismatches}')
+    for name, func in (('legacy', legacy), ('compiled', compiled), ('compiled+memo', memoized)):
+        best = min(timeit.repeat(func, number=1, repeat=repeat))
+        print(f'  {name:>14}: {best / size * 1e6:8.2f} мкс на алерт')
+
+
+def main(size: int = 5000, repeat: int = 5):
+    critical_rules = AlertProblem._critical_hosts
+    emergency_rules = AlertProblem._EMERGENCY_ALERTS
+    run('Текущие таблицы', critical_rules, emergency_rules, size, repeat)
+    run('Таблицы +200 площадок', scaled_rules(critical_rules, 200), scaled_rules(emergency_rules, 200, seed=8),
+        size, repeat)
+
+
+if __name__ == '__main__':
+    main()
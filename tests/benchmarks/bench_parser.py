@@ -0,0 +1,95 @@
+"""
+Микробенчмарк разбора писем Zabbix.
+Сравнивает прежний разбор (parse_to_dict + повторный разбор text_body через split() при отправке в Telegram)
+с однопроходным parse_alert на корпусе писем из tests/fixtures/zabbix.
+Перед замером проверяет, что parse_alert выдает ожидаемые поля из expected.json.
+
+Запуск: python -m tests.benchmarks.bench_parser
+"""
+import json
+import os
+import re
+import timeit
+from pathlib import Path
+
+os.environ.setdefault('CRITICAL_HOSTS', '')
+os.environ.setdefault('EXCLUDE_GROUPS', 'PBO')
+
+from src.alert_parser import parse_alert  # noqa: E402
+
+FIXTURES = Path(__file__).resolve().parent.parent / 'fixtures' / 'zabbix'
+
+
+def load_corpus():
+    """Возвращает [(имя файла, тема, тело), ...]. Первая строка файла — 'Subject: ...', затем пустая строка."""
+    corpus = []
+    for path in sorted(FIXTURES.glob('*.txt')):
+        header, _, body = path.read_text(encoding='utf-8').partition('\n\n')
+        corpus.append((path.name, header.split(':', 1)[1].strip(), body))
+    return corpus
+
+
+def legacy_parse(subject: str, body: str) -> dict:
+    body_re = re.sub(r"\s+", "", body)
+
+    def extract(pattern):
+        match = re.search(pattern, body_re, re.DOTALL)
+        return match.group(1) if match else ''
+
+    return {
+        'subject': subject,
+        'alert_type': 'Resolved' if 'Resolved' in subject else 'Problem',
+        'host': extract(r"Host:(.*?)(?:Groups|IP-adress|Severity|Time|$)"),
+        'severity': extract(r"Severity:(.*?)(?:Time|$)"),
+        'groups': extract(r"Groups:(.*?)(?:IP-adress|Severity|Time|$)"),
+    }
+
+
+def legacy_telegram_fields(body: str) -> dict:
+    fields = {}
+    try:
+        fields['time'] = body.split('Time:')[1].split('Operational data:')[0].strip()
+        fields['group_label'] = body.split('Groups:')[1].split('IP-adress:')[0].strip()
+    except IndexError:
+        pass
+    return fields
+
+
+def check(corpus) -> int:
+    expected = json.loads((FIXTURES / 'expected.json').read_text(encoding='utf-8'))
+    errors = 0
+    for name, subject, body in corpus:
+        alert = parse_alert(subject, 'zabbix@example.com', body)
+        for field, value in expected[name].items():
+            if getattr(alert, field) != value:
+                errors += 1
+                print(f'  {name}: {field}={getattr(alert, field)!r}, ожидалось {value!r}')
+        legacy = legacy_parse(subject, body)
+        if (legacy['host'], legacy['severity'], legacy['groups']) != (alert.host, alert.severity, alert.group):
+            print(f'  {name}: расхождение с parse_to_dict: {legacy}')
+    return errors
+
+
+def main(copies: int = 300, repeat: int = 5):
+    corpus = load_corpus()
+    errors = check(corpus)
+    print(f'Писем в корпусе: {len(corpus)}, ошибок разбора: {errors}')
+
+    stream = [(subject, body) for _ in range(copies) for _, subject, body in corpus]
+
+    def legacy():
+        for subject, body in stream:
+            legacy_parse(subject, body)
+            legacy_telegram_fields(body)
+
+    def single_pass():
+        for subject, body in stream:
+            parse_alert(subject, 'zabbix@example.com', body)
+
+    for name, func in (('legacy', legacy), ('single-pass', single_pass)):
+        best = min(timeit.repeat(func, number=1, repeat=repeat))
+        print(f'  {name:>12}: {best / len(stream) * 1e6:8.2f} мкс на письмо')
+
+
+if __name__ == '__main__':
+    main()
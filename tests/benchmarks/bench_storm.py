@@ -0,0 +1,319 @@
+"""
+Нагрузочный стенд: прогоняет синтетический шторм алертов Zabbix через AlertMonitor → AlertManager
+без Exchange и Telegram. Почтовый ящик и бот заменены заглушками из tests/benchmarks/fakes.py,
+Redis — fakeredis или локальный Redis (--redis-url).
+
+Сообщает пропускную способность, p50/p95/p99 задержки от появления письма во входящих
+до окончания его обработки и количество обращений к EWS по операциям.
+С --fire-timers после приема шторма все таймеры эскалации, флапов и массовых проблем
+срабатывают сразу, и отдельно считаются обращения к EWS на рассылку уведомлений.
+
+Запуск: python -m tests.benchmarks.bench_storm --problems 1000 --groups 50
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import statistics
+import time
+from collections import Counter
+from typing import Dict, List, Tuple
+
+os.environ.setdefault('CRITICAL_HOSTS', '')
+os.environ.setdefault('EXCLUDE_GROUPS', 'PBO')
+
+from src.alert_coalescer import AlertCoalescer  # noqa: E402
+from src.alert_manager import AlertManager  # noqa: E402
+from src.alert_monitor import AlertMonitor  # noqa: E402
+from src.alert_scheduler import AlertScheduler  # noqa: E402
+from src.email_batcher import EmailBatcher  # noqa: E402
+from src.email_handler import EmailHandler  # noqa: E402
+from src.event_bus import EventBus  # noqa: E402
+from src.folder_registry import FolderRegistry  # noqa: E402
+from src.inbox_source import PollingInboxSource  # noqa: E402
+from src.message_cache import MessageCache  # noqa: E402
+from src.partition_leases import PartitionLeases  # noqa: E402
+from src.redis_cache import RedisCache  # noqa: E402
+from src.telegram_dispatcher import TelegramDispatcher  # noqa: E402
+from tests.benchmarks.fakes import FakeAccount, FakeBot, FakeRedis  # noqa: E402
+
+SUBJECTS = [
+    'High CPU utilization (over 90% for 5m)',
+    'Load average is too high (per CPU load over 1.5 for 5m)',
+    'Interface Gi0/1: Link down',
+    'Memory usage is too high (over 90% for 5m)',
+    'Unavailable by ICMP ping',
+    'Disk space is low (free < 10% for 30m)',
+    'Zabbix agent is not available (for 3m)',
+]
+
+Mail = Tuple[str, str]
+
+
+def zabbix_body(host: str, group: str, severity: str, minute: int) -> str:
+    return (
+        f"Problem name: alert\n"
+        f"Host: {host}\n"
+        f"Groups: {group}\n"
+        f"IP-adress: 10.0.{minute % 250}.{len(host) % 250}\n"
+        f"Severity: {severity}\n"
+        f"Time: 10:{minute % 60:02d}:00 2025.03.20\n"
+        f"Operational data: 0\n"
+    )
+
+
+def build_storm(problems: int, groups: int, resolve_ratio: float, flap_hosts: int, flaps: int,
+                duplicate_ratio: float = 0, seed: int = 1) -> List[Mail]:
+    """
+    Письма шторма в порядке поступления: problems проблем по groups группам,
+    resolve_ratio из них закрываются позже, duplicate_ratio повторно присылаются до закрытия,
+    flap_hosts хостов по flaps раз переходят в problem и обратно.
+    """
+    rnd = random.Random(seed)
+    group_names = [('PBO Restaurants' if index % 10 == 0 else 'Restaurants') + f' RU{index:03d}'
+                   for index in range(groups)]
+    hosts_per_group = max(1, problems // groups // 3)
+    stream: List[Tuple[float, Mail]] = []
+    for index in range(problems):
+        group_index = index % groups
+        host = f'RU{group_index:03d}-POS{index // groups % hosts_per_group:02d}'
+        subject = SUBJECTS[index // (groups * hosts_per_group) % len(SUBJECTS)]
+        severity = rnd.choice(('High', 'High', 'Disaster'))
+        body = zabbix_body(host, group_names[group_index], severity, index)
+        started = rnd.random()
+        stream.append((started, (f'❌ {subject}', body)))
+        resolved_at = started + rnd.uniform(0.01, 0.5) if rnd.random() < resolve_ratio else None
+        if rnd.random() < duplicate_ratio:
+            stream.append((started + rnd.uniform(0.001, 0.009), (f'❌ {subject}', body)))
+        if resolved_at is not None:
+            stream.append((resolved_at, (f'✅ Resolved {subject}', body)))
+    for index in range(flap_hosts):
+        host = f'RU{index % groups:03d}-KVS{index:02d}'
+        body = zabbix_body(host, group_names[index % groups], 'High', index)
+        started = rnd.random()
+        for flap in range(flaps):
+            stream.append((started + flap * 0.02, ('❌ Unavailable by ICMP ping', body)))
+            stream.append((started + flap * 0.02 + 0.01, ('✅ Resolved Unavailable by ICMP ping', body)))
+    stream.sort(key=lambda item: item[0])
+    return [mail for _, mail in stream]
+
+
+def percentile(values: List[float], share: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(share * (len(ordered) - 1))))]
+
+
+async def create_redis(url: str):
+    if url:
+        from redis.asyncio import Redis
+        return Redis.from_url(url)
+    return FakeRedis()
+
+
+async def wait_until(condition, timeout: float, interval: float = 0.05) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if await condition():
+            return True
+        await asyncio.sleep(interval)
+    return False
+
+
+def quiet_logs() -> None:
+    """Оставляет только ошибки: сервис пишет несколько строк INFO на каждое письмо."""
+    for name, logger in logging.root.manager.loggerDict.items():
+        if name.startswith('src') and isinstance(logger, logging.Logger):
+            logger.setLevel(logging.ERROR)
+
+
+async def create_worker(args, account: FakeAccount, telegram: TelegramDispatcher, redis, index: int):
+    """Собирает один экземпляр сервиса; при --workers больше 1 экземпляры делят хосты через PartitionLeases."""
+    email_handler = EmailHandler(telegram, 'bench', 'bench', args.batch_window, MessageCache())
+    email_handler.account = account
+    email_handler.batcher = EmailBatcher(account, window=args.batch_window)
+    email_handler.folders = FolderRegistry(account.inbox)
+    await email_handler.folders.resolve_all()
+    email_handler._is_within_sending_hours = lambda: True
+
+    redis_cache = RedisCache(redis, prefix='bench:')
+    scheduler = AlertScheduler(redis, key=redis_cache.key('timers'), poll_interval=0.2)
+    alert_manager = AlertManager(email_handler, redis_cache, scheduler)
+    coalescer = AlertCoalescer(alert_manager, email_handler, delete_window=args.batch_window)
+    leases = None
+    if args.workers > 1:
+        leases = PartitionLeases(redis, key=redis_cache.key('leases'), partitions=args.partitions,
+                                 worker_id=f'bench-{index}', heartbeat_interval=0.5, on_lost=coalescer.clear)
+    bus = None
+    if args.event_bus:
+        bus = EventBus(redis, key=redis_cache.key('events'), consumer=f'bench-{index}', block=0.2)
+        alert_manager.bus = bus
+    monitor = AlertMonitor(
+        coalescer, email_handler, PollingInboxSource(min_interval=0.05, max_interval=0.2),
+        page_size=args.page_size, batch_size=args.batch_size, concurrency=args.concurrency, leases=leases, bus=bus
+    )
+    return redis_cache, scheduler, coalescer, monitor, leases
+
+
+async def run(args) -> Dict[str, int]:
+    """Прогоняет шторм, печатает отчет и возвращает итоговые счетчики для проверок."""
+    if not args.verbose:
+        quiet_logs()
+    account = FakeAccount(latency=args.ews_latency)
+    bot = FakeBot(flood_every=args.flood_every)
+    telegram = TelegramDispatcher(bot, '-100', recipients=lambda: [1, 2], send_interval=0)
+
+    redis = await create_redis(args.redis_url)
+    workers = [await create_worker(args, account, telegram, redis, index) for index in range(args.workers)]
+    redis_cache = workers[0][0]
+    await redis_cache.clear_cache()
+    schedulers = [scheduler for _, scheduler, _, _, _ in workers]
+    coalescers = [coalescer for _, _, coalescer, _, _ in workers]
+    leases = [worker_leases for *_, worker_leases in workers if worker_leases is not None]
+    for worker_leases in leases:
+        await worker_leases.heartbeat()
+    # Вторая волна: первые экземпляры отпускают лишние партиции, последние их забирают.
+    for worker_leases in leases:
+        await worker_leases.heartbeat()
+
+    # Время появления письма во входящих и время окончания его обработки.
+    delivered: Dict[str, float] = {}
+    latencies: List[float] = []
+    handled: List[str] = []
+    outcomes: Counter = Counter()
+
+    def track(handler, outcome: str):
+        async def wrapper(message_id, alert):
+            await handler(message_id, alert)
+            latencies.append(time.perf_counter() - delivered[message_id])
+            handled.append(message_id)
+            outcomes[outcome] += 1
+        return wrapper
+
+    for coalescer in coalescers:
+        coalescer.problem_handler = track(coalescer.problem_handler, 'problem')
+        coalescer.resolved_handler = track(coalescer.resolved_handler, 'resolved')
+
+    storm = build_storm(args.problems, args.groups, args.resolve_ratio, args.flap_hosts, args.flaps,
+                        args.duplicate_ratio)
+    coros = [telegram.run()] + [scheduler.run() for scheduler in schedulers]
+    coros += [monitor.start() for _, _, _, monitor, _ in workers] + [worker_leases.run() for worker_leases in leases]
+    if args.event_bus:
+        coros += [monitor.consume() for _, _, _, monitor, _ in workers]
+        coros += [coalescer.alert_manager.run_notifications() for coalescer in coalescers]
+    tasks = [asyncio.create_task(coro) for coro in coros]
+
+    account.calls.clear()
+    started = time.perf_counter()
+    for index, (subject, body) in enumerate(storm):
+        message = account.deliver(subject, body)
+        delivered[message.id] = time.perf_counter()
+        if args.rate:
+            await asyncio.sleep(1 / args.rate)
+    completed = await wait_until(lambda: _done(latencies, storm), args.timeout)
+    elapsed = time.perf_counter() - started
+    ingest_calls = Counter(account.calls)
+
+    print(f'Шторм: {len(storm)} писем ({outcomes["problem"]} problem, {outcomes["resolved"]} resolved), '
+          f'групп {args.groups}, экземпляров {args.workers}, обработчиков {args.concurrency}, '
+          f'задержка EWS {args.ews_latency * 1000:.0f} мс')
+    if not completed:
+        print(f'  Обработано только {len(latencies)} писем за {args.timeout} с.')
+    print(f'  Время: {elapsed:.2f} с, {len(latencies) / elapsed:.1f} писем/с ({len(latencies) / elapsed * 60:.0f} в минуту)')
+    print(f'  Задержка обработки: p50 {percentile(latencies, 0.5) * 1000:.0f} мс, '
+          f'p95 {percentile(latencies, 0.95) * 1000:.0f} мс, p99 {percentile(latencies, 0.99) * 1000:.0f} мс, '
+          f'среднее {statistics.mean(latencies) * 1000 if latencies else 0:.0f} мс')
+    print(f'  Обращения к EWS: {dict(sorted(ingest_calls.items()))} (всего {sum(ingest_calls.values())})')
+    print(f'  Повторов отсеяно без Redis и EWS: {coalescers[0].hit_rate:.1%}')
+    if leases:
+        print(f'  Партиций по экземплярам: {[len(worker_leases.owned) for worker_leases in leases]}, '
+              f'обработано повторно: {len(latencies) - len(set(handled))}')
+    pending_timers = await schedulers[0].pending()
+    print(f'  Таймеров ожидает: {pending_timers}')
+    result = {
+        'mails': len(storm),
+        'handled': len(latencies),
+        'repeated': len(latencies) - len(set(handled)),
+        'timers': pending_timers,
+    }
+
+    if args.fire_timers:
+        await _fire_timers(schedulers, redis)
+        await wait_until(lambda: _timers_done(schedulers, telegram, redis_cache), args.timeout)
+        timer_calls = Counter(account.calls) - ingest_calls
+        print(f'  После срабатывания таймеров: писем переслано {len(account.forwarded)}, '
+              f'сообщений в Telegram {len(bot.messages)} (сводок {telegram.stats["digests"]}, '
+              f'повторов {telegram.stats["retries"]})')
+        print(f'  Обращения к EWS на уведомления: {dict(sorted(timer_calls.items()))} '
+              f'(всего {sum(timer_calls.values())})')
+        result.update(timers_left=await schedulers[0].pending(), forwarded=len(account.forwarded),
+                      telegram=len(bot.messages))
+
+    for task in tasks:
+        task.cancel()
+    await redis_cache.clear_cache()
+    return result
+
+
+async def _done(latencies: List[float], storm: List[Mail]) -> bool:
+    return len(latencies) >= len(storm)
+
+
+async def _fire_timers(schedulers: List[AlertScheduler], redis) -> None:
+    """Переносит все таймеры на текущий момент."""
+    members = await redis.zrange(schedulers[0].key, 0, -1)
+    if members:
+        await redis.zadd(schedulers[0].key, {member: 0 for member in members}, xx=True)
+    for scheduler in schedulers:
+        scheduler.wakeup()
+
+
+async def _timers_done(schedulers: List[AlertScheduler], telegram: TelegramDispatcher, redis_cache: RedisCache) -> bool:
+    if await _unread_notifications(redis_cache):
+        return False
+    return (not await schedulers[0].pending() and not any(scheduler._running_tasks for scheduler in schedulers)
+            and telegram.queue.empty())
+
+
+async def _unread_notifications(redis_cache: RedisCache) -> int:
+    """Сколько уведомлений в потоке еще не прочитано или не подтверждено (при --event-bus)."""
+    stream = redis_cache.key('events:notifications')
+    if not await redis_cache.redis.exists(stream):
+        return 0
+    groups = await redis_cache.redis.xinfo_groups(stream)
+    return sum((group.get('lag') or 0) + group['pending'] for group in groups)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--problems', type=int, default=1000)
+    parser.add_argument('--groups', type=int, default=50)
+    parser.add_argument('--resolve-ratio', type=float, default=0.3)
+    parser.add_argument('--duplicate-ratio', type=float, default=0.2, help='Доля проблем, которые Zabbix присылает повторно.')
+    parser.add_argument('--flap-hosts', type=int, default=10)
+    parser.add_argument('--flaps', type=int, default=6)
+    parser.add_argument('--rate', type=float, default=0, help='Писем в секунду; 0 — весь шторм сразу.')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=1, help='Экземпляров сервиса на один ящик.')
+    parser.add_argument('--partitions', type=int, default=16)
+    parser.add_argument('--event-bus', action='store_true', help='Передавать алерты и уведомления через Redis Streams.')
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--batch-size', type=int, default=25)
+    parser.add_argument('--batch-window', type=float, default=0.2)
+    parser.add_argument('--ews-latency', type=float, default=0.02, help='Задержка одного запроса к EWS, с.')
+    parser.add_argument('--flood-every', type=int, default=0, help='Имитировать 429 от Telegram каждые N отправок.')
+    parser.add_argument('--redis-url', default='', help='Например redis://localhost:6379/15; по умолчанию fakeredis.')
+    parser.add_argument('--fire-timers', action='store_true')
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--verbose', action='store_true', help='Не скрывать логи сервиса.')
+    return parser
+
+
+def main() -> None:
+    asyncio.run(run(build_parser().parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Стенд планировщика таймеров: ставит много таймеров эскалации и проверяет, что память процесса
+не растет с их числом (таймеры хранятся в Redis), а при одновременном наступлении тысяч таймеров
+обработчиков выполняется не больше max_running.
+
+Запуск: python -m tests.benchmarks.bench_timers --timers 50000 --due 5000
+"""
+import argparse
+import asyncio
+import os
+import time
+import tracemalloc
+
+os.environ.setdefault('CRITICAL_HOSTS', '')
+os.environ.setdefault('EXCLUDE_GROUPS', 'PBO')
+
+from src.alert_scheduler import AlertScheduler  # noqa: E402
+from tests.benchmarks.bench_storm import create_redis, quiet_logs  # noqa: E402
+
+
+async def run(args) -> None:
+    quiet_logs()
+    redis = await create_redis(args.redis_url)
+    scheduler = AlertScheduler(redis, key='bench:timers', poll_interval=0.2, max_running=args.max_running)
+    await redis.delete(scheduler.key, scheduler.payload_key)
+    peak, done = 0, 0
+
+    async def handler(payload: dict):
+        nonlocal peak, done
+        peak = max(peak, len(scheduler._running_tasks))
+        await asyncio.sleep(args.handler_latency)
+        done += 1
+
+    scheduler.register('delete', handler)
+    payload = {'message_id': 'AAMk' * 40, 'host': 'RUMOSAP2101', 'subject': 'Unavailable by ICMP ping'}
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    async with redis.pipeline(transaction=False) as pipe:
+        for index in range(args.timers):
+            delay = 0 if index < args.due else 3600
+            await scheduler.schedule('delete', f'host{index}:subject', payload, delay, pipe)
+        await pipe.execute()
+    elapsed = time.perf_counter() - started
+    print(f'Таймеров поставлено: {await scheduler.pending()} за {elapsed:.2f} с')
+    # С fakeredis сюда входят и сами таймеры в памяти Redis; с --redis-url — только процесс сервиса.
+    print(f'  Память процесса: {tracemalloc.get_traced_memory()[0] / 2 ** 20:.1f} МБ')
+    tracemalloc.stop()
+
+    task = asyncio.create_task(scheduler.run())
+    started = time.perf_counter()
+    while done < args.due:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - started
+    print(f'  Наступило {args.due} таймеров: обработано за {elapsed:.2f} с, '
+          f'одновременно не больше {peak} обработчиков (max_running {args.max_running})')
+    task.cancel()
+    await redis.delete(scheduler.key, scheduler.payload_key)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--timers', type=int, default=20000)
+    parser.add_argument('--due', type=int, default=5000, help='Сколько таймеров наступает сразу.')
+    parser.add_argument('--handler-latency', type=float, default=0.05, help='Длительность обработчика, с.')
+    parser.add_argument('--max-running', type=int, default=100)
+    parser.add_argument('--redis-url', default='', help='Например redis://localhost:6379/15; по умолчанию fakeredis.')
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
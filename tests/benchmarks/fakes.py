@@ -0,0 +1,360 @@
+"""
+Заглушки внешних систем для нагрузочного стенда и тестов: Exchange (Account, папки и streaming-подписка),
+бот aiogram и fakeredis с ожиданием в XREADGROUP.
+Реализуют только ту часть API exchangelib и aiogram, которой пользуются EmailHandler и TelegramDispatcher,
+и считают обращения, чтобы по ним можно было ловить регрессии.
+"""
+import asyncio
+import itertools
+import queue
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Dict, Iterator, List, Optional, Union
+
+import fakeredis.aioredis
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+from exchangelib import Account
+from exchangelib.errors import ErrorFolderNotFound, ErrorItemNotFound
+from exchangelib.properties import NewMailEvent, Notification
+
+# Папки, которые сервис ожидает найти во входящих.
+DEFAULT_FOLDERS = (
+    'critical_host/problem', 'critical_host/resolved',
+    'high/problem', 'high/resolved',
+    'disaster/problem', 'disaster/resolved',
+    'pbo/problem', 'pbo/resolved',
+    'create_case',
+)
+
+
+class FakeMessage:
+    """Письмо в почтовом ящике стенда."""
+
+    def __init__(self, account: "FakeAccount", subject: str, text_body: str, sender: str = 'zabbix@example.com'):
+        self.account = account
+        self.id: Optional[str] = None
+        self.changekey: Optional[str] = None
+        self.folder: Optional["FakeFolder"] = None
+        self.subject = subject
+        self.text_body = text_body
+        self.sender = SimpleNamespace(email_address=sender)
+        self.datetime_received = datetime.now(timezone.utc)
+        self.is_read = False
+        self.importance = 'Normal'
+
+    def create_forward(self, subject: str, body: str, to_recipients: List[str]):
+        account = self.account
+
+        def send():
+            account.call('send')
+            account.forwarded.append((subject, tuple(to_recipients)))
+
+        return SimpleNamespace(send=send)
+
+    def refresh(self) -> None:
+        self.account.call('refresh')
+
+
+class FakeQuerySet:
+    """Выборка непрочитанных писем. Страницы запрашиваются по мере обхода, как в exchangelib."""
+
+    def __init__(self, folder: "FakeFolder", filters: Dict[str, object]):
+        self.folder = folder
+        self.filters = filters
+        self.page_size = 100
+        self.chunk_size = 100
+
+    def only(self, *fields: str) -> "FakeQuerySet":
+        return self
+
+    def order_by(self, *fields: str) -> "FakeQuerySet":
+        return self
+
+    def _matches(self, item: FakeMessage) -> bool:
+        for name, value in self.filters.items():
+            if name.endswith('__gte'):
+                if getattr(item, name[:-len('__gte')]) < value:
+                    return False
+            elif getattr(item, name) != value:
+                return False
+        return True
+
+    def _page(self, offset: int, size: Optional[int] = None) -> List[FakeMessage]:
+        account = self.folder.account
+        account.call('filter')
+        with account.lock:
+            items = [item for item in self.folder.items.values() if self._matches(item)]
+            items.sort(key=lambda item: item.datetime_received)
+            return items[offset:offset + (size or self.page_size)]
+
+    def __getitem__(self, index: slice) -> List[FakeMessage]:
+        # Срез — один запрос к EWS с нужным смещением и количеством.
+        start = index.start or 0
+        return self._page(start, index.stop - start)
+
+    def __iter__(self) -> Iterator[FakeMessage]:
+        # Смещение считается по текущему состоянию папки, как и при постраничной выборке из EWS.
+        offset = 0
+        while True:
+            page = self._page(offset)
+            yield from page
+            if len(page) < self.page_size:
+                return
+            offset += len(page)
+
+
+class FakeFolder:
+    """Папка почтового ящика стенда."""
+
+    def __init__(self, account: "FakeAccount", name: str, parent: Optional["FakeFolder"] = None):
+        self.account = account
+        self.name = name
+        self.parent = parent
+        self.id = f'folder-{next(account.ids)}'
+        self.children: Dict[str, "FakeFolder"] = {}
+        self.items: Dict[str, FakeMessage] = {}
+
+    @property
+    def absolute(self) -> str:
+        return f'{self.parent.absolute}/{self.name}' if self.parent else self.name
+
+    def __truediv__(self, name: str) -> "FakeFolder":
+        # Как и в exchangelib: каждый переход — запрос к EWS, только один уровень вложенности и без учета регистра.
+        self.account.call('folder')
+        return self.child(name)
+
+    def child(self, name: str) -> "FakeFolder":
+        """Вложенная папка без обращения к EWS."""
+        for child_name, child in self.children.items():
+            if child_name.lower() == name.lower():
+                return child
+        raise ErrorFolderNotFound(f"No subfolder with name {name!r}")
+
+    def add_child(self, path: str) -> "FakeFolder":
+        folder = self
+        for name in path.replace('\\', '/').split('/'):
+            folder = folder.children.setdefault(name, FakeFolder(self.account, name, folder))
+        return folder
+
+    def filter(self, **filters) -> FakeQuerySet:
+        return FakeQuerySet(self, filters)
+
+    def get(self, id: str) -> FakeMessage:
+        self.account.call('get')
+        # Как и GetItem в EWS, письмо находится по id независимо от папки.
+        with self.account.lock:
+            item = self.account._items.get(id)
+        if item is None:
+            raise ErrorItemNotFound(id)
+        return item
+
+
+class FakeStreamingFolder:
+    """
+    Папка EWS для проверок StreamingInboxSource без Exchange.
+    Повторяет subscribe_to_streaming/get_streaming_events/unsubscribe, а письма «приходят» через deliver().
+    """
+
+    def __init__(self):
+        self.subscriptions = set()
+        self.subscribe_calls = 0
+        self.requests = 0
+        self._events: "queue.Queue[Union[NewMailEvent, Exception, None]]" = queue.Queue()
+
+    def subscribe_to_streaming(self, event_types=None) -> str:
+        self.requests += 1
+        self.subscribe_calls += 1
+        subscription_id = uuid.uuid4().hex
+        self.subscriptions.add(subscription_id)
+        return subscription_id
+
+    def unsubscribe(self, subscription_id: str) -> bool:
+        self.requests += 1
+        self.subscriptions.discard(subscription_id)
+        return True
+
+    def get_streaming_events(self, subscription_id, connection_timeout=1, max_notifications_returned=None):
+        self.requests += 1
+        try:
+            event = self._events.get(timeout=connection_timeout * 60)
+        except queue.Empty:
+            return
+        if isinstance(event, Exception):
+            raise event
+        if subscription_id in self.subscriptions and event is not None:
+            yield Notification(subscription_id=subscription_id, events=[event])
+
+    def deliver(self) -> None:
+        """Имитирует появление нового письма во входящих."""
+        self._events.put(NewMailEvent())
+
+    def fail(self, error: Exception) -> None:
+        """Обрывает подписку ошибкой EWS."""
+        self._events.put(error)
+
+    def close(self) -> None:
+        """Прерывает текущее streaming-соединение."""
+        self._events.put(None)
+
+
+class FakeAccount(Account):
+    """
+    Почтовый ящик Exchange в памяти.
+    Наследуется от Account только для проверок isinstance в exchangelib; сетевые части не используются.
+    """
+
+    def __init__(self, latency: float = 0.0, folders=DEFAULT_FOLDERS):
+        """
+        :param latency: Задержка каждого обращения к EWS в секундах.
+        :param folders: Папки, которые создаются во входящих.
+        """
+        self.latency = latency
+        self.lock = threading.RLock()
+        self.ids = itertools.count(1)
+        self.calls: Counter = Counter()
+        self.forwarded: List[tuple] = []
+        self._inbox = FakeFolder(self, 'inbox')
+        self._items: Dict[str, FakeMessage] = {}
+        for path in folders:
+            self._inbox.add_child(path)
+
+    def __repr__(self) -> str:
+        return 'FakeAccount()'
+
+    @property
+    def inbox(self) -> FakeFolder:
+        return self._inbox
+
+    def call(self, operation: str) -> None:
+        """Учитывает обращение к EWS и имитирует его задержку."""
+        with self.lock:
+            self.calls[operation] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _store(self, item: FakeMessage, folder: FakeFolder) -> None:
+        item.id = f'item-{next(self.ids)}'
+        item.changekey = f'ck-{next(self.ids)}'
+        item.folder = folder
+        folder.items[item.id] = item
+        self._items[item.id] = item
+
+    def _remove(self, item_id: str) -> Optional[FakeMessage]:
+        item = self._items.pop(item_id, None)
+        if item is not None:
+            item.folder.items.pop(item_id, None)
+        return item
+
+    def deliver(self, subject: str, text_body: str) -> FakeMessage:
+        """Кладет новое письмо во входящие."""
+        item = FakeMessage(self, subject, text_body)
+        with self.lock:
+            self._store(item, self._inbox)
+        return item
+
+    def fetch(self, ids):
+        self.call('fetch')
+        with self.lock:
+            return [self._items.get(self._item_id(item)) or ErrorItemNotFound(self._item_id(item)) for item in ids]
+
+    @staticmethod
+    def _item_id(item) -> str:
+        return item[0] if isinstance(item, tuple) else item.id
+
+    def bulk_update(self, items):
+        self.call('bulk_update')
+        results = []
+        with self.lock:
+            for item, fields in items:
+                stored = self._items.get(item.id)
+                if stored is None:
+                    results.append(ErrorItemNotFound(item.id))
+                    continue
+                for field in fields:
+                    setattr(stored, field, getattr(item, field))
+                stored.changekey = f'ck-{next(self.ids)}'
+                results.append((stored.id, stored.changekey))
+        return results
+
+    def bulk_move(self, ids, to_folder: FakeFolder):
+        self.call('bulk_move')
+        results = []
+        with self.lock:
+            for item in ids:
+                stored = self._remove(self._item_id(item))
+                if stored is None:
+                    results.append(ErrorItemNotFound(self._item_id(item)))
+                    continue
+                self._store(stored, to_folder)
+                results.append((stored.id, stored.changekey))
+        return results
+
+    def bulk_copy(self, ids, to_folder: FakeFolder):
+        self.call('bulk_copy')
+        results = []
+        with self.lock:
+            for item in ids:
+                stored = self._items.get(self._item_id(item))
+                if stored is None:
+                    results.append(ErrorItemNotFound(self._item_id(item)))
+                    continue
+                copy = FakeMessage(self, stored.subject, stored.text_body, stored.sender.email_address)
+                copy.is_read, copy.importance = stored.is_read, stored.importance
+                self._store(copy, to_folder)
+                results.append((copy.id, copy.changekey))
+        return results
+
+    def bulk_delete(self, ids):
+        self.call('bulk_delete')
+        with self.lock:
+            return [True if self._remove(self._item_id(item)) else ErrorItemNotFound(self._item_id(item))
+                    for item in ids]
+
+    def count(self, path: str = '') -> int:
+        """Количество писем в папке входящих, например 'high/problem'; пустой путь — сами входящие."""
+        folder = self._inbox
+        for name in filter(None, path.split('/')):
+            folder = folder.child(name)
+        return len(folder.items)
+
+
+class FakeBot:
+    """Бот aiogram, который только запоминает сообщения. Может имитировать 429 каждые flood_every отправок."""
+
+    def __init__(self, flood_every: int = 0, retry_after: int = 1):
+        self.flood_every = flood_every
+        self.retry_after = retry_after
+        self.calls = 0
+        self.messages: List[tuple] = []
+
+    async def send_message(self, chat_id, text: str, parse_mode=None):
+        self.calls += 1
+        if self.flood_every and self.calls % self.flood_every == 0:
+            raise TelegramRetryAfter(
+                method=SendMessage(chat_id=chat_id, text=text), message='Too Many Requests',
+                retry_after=self.retry_after
+            )
+        self.messages.append((chat_id, text))
+
+
+class FakeRedis(fakeredis.aioredis.FakeRedis):
+    """
+    fakeredis отвечает на XREADGROUP BLOCK сразу и не отдает управление event loop,
+    поэтому цикл чтения потока занимал бы его целиком. Здесь пустое чтение ждет, как настоящий Redis,
+    проверяя поток каждые poll_interval секунд.
+    """
+
+    poll_interval = 0.01
+
+    async def xreadgroup(self, groupname, consumername, streams, count=None, block=None, noack=False):
+        deadline = time.monotonic() + (block or 0) / 1000
+        while True:
+            response = await super().xreadgroup(groupname, consumername, streams, count=count, noack=noack)
+            if response or not block or time.monotonic() >= deadline:
+                return response
+            await asyncio.sleep(self.poll_interval)
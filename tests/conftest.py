@@ -0,0 +1,5 @@
+import os
+
+# Настройки, без которых не импортируется src.settings; в тестах внешние системы заменены заглушками.
+os.environ.setdefault('CRITICAL_HOSTS', '')
+os.environ.setdefault('EXCLUDE_GROUPS', 'PBO')
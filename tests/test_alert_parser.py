@@ -0,0 +1,28 @@
+import json
+
+import pytest
+
+from src.alert_parser import parse_alert
+from tests.benchmarks.bench_parser import FIXTURES, legacy_parse, load_corpus
+
+CORPUS = load_corpus()
+EXPECTED = json.loads((FIXTURES / 'expected.json').read_text(encoding='utf-8'))
+
+
+def test_every_fixture_has_expected_fields():
+    assert sorted(name for name, _, _ in CORPUS) == sorted(EXPECTED)
+
+
+@pytest.mark.parametrize('name,subject,body', CORPUS, ids=[name for name, _, _ in CORPUS])
+def test_parse_alert_matches_expected(name, subject, body):
+    alert = parse_alert(subject, 'zabbix@example.com', body)
+    assert {field: getattr(alert, field) for field in EXPECTED[name]} == EXPECTED[name]
+
+
+@pytest.mark.parametrize('name,subject,body', CORPUS, ids=[name for name, _, _ in CORPUS])
+def test_parse_alert_matches_legacy_parser(name, subject, body):
+    alert = parse_alert(subject, 'zabbix@example.com', body)
+    legacy = legacy_parse(subject, body)
+    assert (alert.alert_type, alert.host, alert.severity, alert.group) == (
+        legacy['alert_type'], legacy['host'], legacy['severity'], legacy['groups']
+    )
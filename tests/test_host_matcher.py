@@ -0,0 +1,30 @@
+import pytest
+
+from src.alert_entity import AlertProblem
+from src.host_matcher import RuleMatcher
+from tests.benchmarks.bench_classification import build_corpus, legacy_is_critical, legacy_is_emergency, scaled_rules
+
+TABLES = {
+    'current': (AlertProblem._critical_hosts, AlertProblem._EMERGENCY_ALERTS),
+    'scaled': (scaled_rules(AlertProblem._critical_hosts, 200),
+               scaled_rules(AlertProblem._EMERGENCY_ALERTS, 200, seed=8)),
+}
+
+
+@pytest.mark.parametrize('tables', TABLES.values(), ids=list(TABLES))
+def test_rule_matcher_matches_legacy_logic(tables):
+    critical_rules, emergency_rules = tables
+    critical = RuleMatcher(critical_rules, empty_matches_any_host=True)
+    emergency = RuleMatcher(emergency_rules)
+    for subject, host in build_corpus(critical_rules, emergency_rules, 2000):
+        assert critical.matches(subject, host) == legacy_is_critical(critical_rules, subject, host), (subject, host)
+        assert emergency.matches(subject, host) == legacy_is_emergency(emergency_rules, subject, host), (subject, host)
+
+
+def test_rule_matcher_memoized_result_is_stable():
+    critical_rules = AlertProblem._critical_hosts
+    critical = RuleMatcher(critical_rules, empty_matches_any_host=True)
+    corpus = build_corpus(critical_rules, AlertProblem._EMERGENCY_ALERTS, 200)
+    first = [critical.matches(subject, host) for subject, host in corpus]
+    assert [critical.matches(subject, host) for subject, host in corpus] == first
+    assert [critical._matches(subject, host) for subject, host in corpus] == first
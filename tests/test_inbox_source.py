@@ -0,0 +1,111 @@
+import asyncio
+import time
+
+from src.inbox_source import PollingInboxSource, StreamingInboxSource, create_inbox_source
+from tests.benchmarks.fakes import FakeStreamingFolder
+
+
+async def _wait(condition, timeout: float = 2) -> None:
+    """Ждет, пока condition() не станет истинным."""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'условие не выполнилось вовремя'
+        await asyncio.sleep(0.01)
+
+
+async def _elapsed(awaitable) -> float:
+    started = time.monotonic()
+    await awaitable
+    return time.monotonic() - started
+
+
+async def _started(folder, **kwargs) -> StreamingInboxSource:
+    """Запускает источник и дожидается подписки и первого пробуждения, которое она дает."""
+    source = StreamingInboxSource(folder, connection_timeout=1, **kwargs)
+    await source.start()
+    await _wait(lambda: source.subscribed)
+    await source.wait_for_mail()
+    return source
+
+
+async def _stopped(source: StreamingInboxSource, folder: FakeStreamingFolder) -> None:
+    await source.stop()
+    folder.close()
+
+
+def test_polling_backoff():
+    source = PollingInboxSource(min_interval=1, max_interval=8, factor=2)
+    assert [source.next_interval(False) for _ in range(4)] == [2, 4, 8, 8]
+    assert source.next_interval(True) == 1
+
+
+def test_create_inbox_source_modes():
+    assert isinstance(create_inbox_source(None, mode='polling'), PollingInboxSource)
+    assert isinstance(create_inbox_source(FakeStreamingFolder(), mode='streaming'), StreamingInboxSource)
+
+
+def test_streaming_wakes_up_on_notification():
+    async def scenario():
+        folder = FakeStreamingFolder()
+        source = await _started(folder, safety_interval=10)
+        asyncio.get_running_loop().call_later(0.1, folder.deliver)
+        assert await _elapsed(source.wait_for_mail()) < 1
+        await _stopped(source, folder)
+
+    asyncio.run(scenario())
+
+
+def test_streaming_waits_for_safety_interval_without_mail():
+    async def scenario():
+        folder = FakeStreamingFolder()
+        source = await _started(folder, safety_interval=0.3)
+        assert await _elapsed(source.wait_for_mail()) >= 0.3
+        await _stopped(source, folder)
+
+    asyncio.run(scenario())
+
+
+def test_streaming_returns_immediately_after_mail():
+    async def scenario():
+        folder = FakeStreamingFolder()
+        source = await _started(folder, safety_interval=10)
+        assert await _elapsed(source.wait_for_mail(had_mail=True)) < 0.1
+        await _stopped(source, folder)
+
+    asyncio.run(scenario())
+
+
+def test_streaming_falls_back_to_polling():
+    class BrokenFolder(FakeStreamingFolder):
+        def subscribe_to_streaming(self, event_types=None) -> str:
+            super().subscribe_to_streaming(event_types)
+            raise ConnectionError('streaming недоступен')
+
+    async def scenario():
+        folder = BrokenFolder()
+        fallback = PollingInboxSource(min_interval=0.05, max_interval=0.1)
+        source = StreamingInboxSource(folder, safety_interval=10, retry_interval=0.05, fallback=fallback)
+        await source.start()
+        await _wait(lambda: folder.subscribe_calls >= 2)
+        assert not source.subscribed
+        # Без подписки проверка идет по интервалу опроса, а не по safety_interval.
+        assert await _elapsed(source.wait_for_mail()) < 1
+        await source.stop()
+
+    asyncio.run(scenario())
+
+
+def test_streaming_resubscribes_after_error():
+    async def scenario():
+        folder = FakeStreamingFolder()
+        source = await _started(folder, safety_interval=10, retry_interval=0.05)
+        folder.fail(ConnectionError('соединение оборвано'))
+        await _wait(lambda: folder.subscribe_calls == 2 and source.subscribed)
+        # Старая подписка снята, письма, пришедшие без подписки, забираются сразу после переподписки.
+        assert len(folder.subscriptions) == 1
+        await source.wait_for_mail()
+        asyncio.get_running_loop().call_later(0.1, folder.deliver)
+        assert await _elapsed(source.wait_for_mail()) < 1
+        await _stopped(source, folder)
+
+    asyncio.run(scenario())
@@ -0,0 +1,39 @@
+import asyncio
+
+import pytest
+
+from tests.benchmarks.bench_storm import build_parser, run
+
+STORM = ['--problems', '60', '--groups', '6', '--flap-hosts', '3', '--flaps', '3', '--ews-latency', '0',
+         '--batch-window', '0.05', '--fire-timers', '--timeout', '60']
+
+
+def storm(*extra: str) -> dict:
+    return asyncio.run(run(build_parser().parse_args(STORM + list(extra))))
+
+
+@pytest.fixture(scope='module')
+def single():
+    return storm()
+
+
+def test_storm_handles_every_mail_once(single):
+    assert single['handled'] == single['mails']
+    assert single['repeated'] == 0
+
+
+def test_storm_fires_every_timer(single):
+    assert single['timers'] > 0
+    assert single['timers_left'] == 0
+    assert single['telegram'] > 0
+
+
+@pytest.mark.parametrize('extra', [('--workers', '2', '--partitions', '4'),
+                                   ('--workers', '2', '--partitions', '4', '--event-bus')],
+                         ids=['leases', 'event-bus'])
+def test_storm_with_several_instances_matches_single_instance(single, extra):
+    result = storm(*extra)
+    assert result['handled'] == result['mails']
+    assert result['repeated'] == 0
+    assert result['timers'] == single['timers']
+    assert result['timers_left'] == 0
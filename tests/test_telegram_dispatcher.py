@@ -0,0 +1,49 @@
+import asyncio
+import time
+
+from src.alert_entity import AlertProblem
+from src.email_handler import EmailHandler
+from src.metrics import NOTIFICATION_LATENCY
+from src.telegram_dispatcher import TelegramDispatcher
+from tests.benchmarks.fakes import FakeBot
+
+
+async def _deliver(dispatcher: TelegramDispatcher, bot: FakeBot, messages: int) -> None:
+    """Запускает отправку и ждет, пока бот не получит messages сообщений."""
+    task = asyncio.create_task(dispatcher.run())
+    deadline = time.monotonic() + 2
+    while len(bot.messages) < messages:
+        assert time.monotonic() < deadline, 'сообщения не отправлены вовремя'
+        await asyncio.sleep(0.01)
+    task.cancel()
+
+
+def test_latency_is_observed_after_send():
+    bot = FakeBot()
+    dispatcher = TelegramDispatcher(bot, '-100', recipients=lambda: [1], send_interval=0)
+    before = NOTIFICATION_LATENCY.count(kind='flap', channel='telegram')
+
+    dispatcher.send('queued', 'flap', time.time())
+    assert NOTIFICATION_LATENCY.count(kind='flap', channel='telegram') == before
+
+    asyncio.run(_deliver(dispatcher, bot, 2))
+    # Одно уведомление — одно наблюдение, сколько бы получателей ни было.
+    assert NOTIFICATION_LATENCY.count(kind='flap', channel='telegram') == before + 1
+
+
+def test_escalation_delay_is_excluded():
+    received_at = time.time() - 20 * 60
+    alert = AlertProblem('id', 'host', 'type', 'subject', 'High', 'group', received_at=received_at)
+    assert EmailHandler._notification_due(alert) == received_at
+
+    alert.is_regular = True
+    assert EmailHandler._notification_due(alert) == received_at + 17 * 60
+
+
+
+def test_chat_user_gets_one_message():
+    bot = FakeBot()
+    dispatcher = TelegramDispatcher(bot, '-100', recipients=lambda: [-100, 1], send_interval=0)
+    dispatcher.send('alert')
+    asyncio.run(_deliver(dispatcher, bot, 2))
+    assert [chat_id for chat_id, _ in bot.messages] == [-100, 1]